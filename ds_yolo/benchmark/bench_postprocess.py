@@ -0,0 +1,212 @@
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+
+from loguru import logger
+
+from benchmark.synthetic import SCORE_DISTRIBUTIONS, make_batch
+from postprocess.trt_postprocess import decode, postprocess, postprocess_batch
+
+
+IMAGE_WIDTH = 1920
+IMAGE_HEIGHT = 1080
+
+
+def _run_postprocess(batch, conf_threshold, nms_threshold):
+    return sum(
+        len(postprocess(buffer, IMAGE_WIDTH, IMAGE_HEIGHT, conf_threshold, nms_threshold)) for buffer in batch)
+
+
+def _run_decode(batch, conf_threshold, nms_threshold):
+    return sum(
+        decode(buffer, IMAGE_WIDTH, IMAGE_HEIGHT, conf_threshold, nms_threshold).size for buffer in batch)
+
+
+def _run_batch(batch, conf_threshold, nms_threshold):
+    image_sizes = [(IMAGE_WIDTH, IMAGE_HEIGHT)] * batch.shape[0]
+    return len(postprocess_batch(batch, image_sizes, conf_threshold, nms_threshold))
+
+
+# dense candidates of one class, where NMS does most of the work: many duplicates with
+# high scores, 1000 candidates on 5 objects, and overlaps chaining along rows
+DENSE_REGIMES = [
+    dict(num_boxes=1000, num_classes=1, score_distribution="high", overlap=0.8, batch_size=1),
+    dict(num_boxes=1000, num_classes=1, score_distribution="high", overlap=0.995, batch_size=1),
+    dict(num_boxes=1000, num_classes=1, score_distribution="high", overlap=0.0, batch_size=1, layout="chain"),
+    dict(num_boxes=1000, num_classes=1, score_distribution="high", overlap=0.8, batch_size=8),
+]
+
+
+# benchmarked entry points: name -> fn(stacked buffers, conf, nms) returning the detection count
+APIS = {
+    "postprocess": _run_postprocess,
+    "decode": _run_decode,
+    "batch": _run_batch,
+}
+
+
+def bench_regime(api, regime, iterations=50, warmup=5, pool_size=8, conf_threshold=0.4, nms_threshold=0.5, seed=0):
+    """
+    Time `api` over `iterations` calls cycling through `pool_size` distinct synthetic batches
+    of `regime` (make_buffer arguments plus batch_size). Peak memory is measured by tracemalloc
+    on a separate call so that tracing does not distort the timings.
+    """
+    rng = np.random.default_rng(seed)
+    regime = dict(regime)
+    batch_size = regime.pop("batch_size", 1)
+    pool = [make_batch(rng, batch_size, **regime) for _ in range(pool_size)]
+    run = APIS[api]
+
+    for i in range(warmup):
+        run(pool[i % pool_size], conf_threshold, nms_threshold)
+
+    latencies = np.empty(iterations)
+    detections = 0
+    for i in range(iterations):
+        start_t = time.perf_counter()
+        detections += run(pool[i % pool_size], conf_threshold, nms_threshold)
+        latencies[i] = time.perf_counter() - start_t
+
+    tracemalloc.start()
+    try:
+        run(pool[0], conf_threshold, nms_threshold)
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    total = latencies.sum()
+    candidates = int(sum(buffers[:, 0].sum() for buffers in pool) / pool_size * iterations)
+    latencies_ms = latencies * 1e3
+    return {
+        "frames_per_s": batch_size * iterations / total,
+        "boxes_per_s": candidates / total,
+        "detections_per_frame": detections / (batch_size * iterations),
+        "latency_ms": {
+            "mean": float(latencies_ms.mean()),
+            "p50": float(np.percentile(latencies_ms, 50)),
+            "p95": float(np.percentile(latencies_ms, 95)),
+            "p99": float(np.percentile(latencies_ms, 99)),
+            "max": float(latencies_ms.max()),
+        },
+        "peak_memory_bytes": peak_bytes,
+    }
+
+
+def regime_name(api, regime):
+    name = "{api}/boxes={num_boxes}/classes={num_classes}/scores={score_distribution}/overlap={overlap}/batch={batch_size}".format(
+        api=api, **regime)
+    if regime.get("layout", "clusters") != "clusters":
+        name += "/layout={}".format(regime["layout"])
+    return name
+
+
+def run_suite(args):
+    regimes = [
+        dict(num_boxes=num_boxes, num_classes=num_classes, score_distribution=scores, overlap=overlap, batch_size=batch_size)
+        for num_boxes, num_classes, scores, overlap, batch_size in itertools.product(
+            args.boxes, args.classes, args.scores, args.overlap, args.batch_size)]
+    if not args.skip_dense:
+        regimes += [regime for regime in DENSE_REGIMES if regime not in regimes]
+
+    results = []
+    for api, regime in itertools.product(args.apis, regimes):
+        stats = bench_regime(
+            api, regime, args.iterations, args.warmup, args.pool_size, args.conf_threshold, args.nms_threshold, args.seed)
+        name = regime_name(api, regime)
+        logger.info(
+            f"{name}: {stats['frames_per_s']:.1f} frames/s, {stats['boxes_per_s']:.0f} boxes/s, "
+            f"p50 {stats['latency_ms']['p50']:.3f} ms, p99 {stats['latency_ms']['p99']:.3f} ms, "
+            f"peak {stats['peak_memory_bytes'] / 1024:.0f} KiB")
+        results.append(dict(name=name, api=api, regime=regime, **stats))
+
+    return {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+        },
+        "settings": {
+            "iterations": args.iterations,
+            "warmup": args.warmup,
+            "pool_size": args.pool_size,
+            "conf_threshold": args.conf_threshold,
+            "nms_threshold": args.nms_threshold,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+
+def compare(report, baseline, tolerance):
+    """
+    Log the p50 latency change of every regime found in both reports,
+    return the names of the regimes slower than `tolerance` (e.g. 0.1 for +10%)
+    """
+    baseline_p50 = {result["name"]: result["latency_ms"]["p50"] for result in baseline["results"]}
+    regressions = []
+    for result in report["results"]:
+        before = baseline_p50.get(result["name"])
+        if not before:
+            continue
+        change = result["latency_ms"]["p50"] / before - 1.0
+        logger.info(f"{result['name']}: p50 {before:.3f} -> {result['latency_ms']['p50']:.3f} ms ({change:+.1%})")
+        if change > tolerance:
+            regressions.append(result["name"])
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmark of the yolov5 postprocess")
+    parser.add_argument("--apis", nargs="+", choices=sorted(APIS), default=["postprocess", "batch"])
+    parser.add_argument("--boxes", help="valid rows per output buffer", type=int, nargs="+", default=[0, 10, 100, 1000])
+    parser.add_argument("--classes", help="number of classes", type=int, nargs="+", default=[1, 80])
+    parser.add_argument("--scores", help="score distribution", nargs="+", choices=SCORE_DISTRIBUTIONS, default=["low"])
+    parser.add_argument("--overlap", help="share of duplicate boxes", type=float, nargs="+", default=[0.0, 0.8])
+    parser.add_argument("--batch_size", type=int, nargs="+", default=[1, 8])
+    parser.add_argument("--skip_dense", help="leave out the dense NMS regimes", action="store_true")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--pool_size", help="distinct synthetic batches per regime", type=int, default=8)
+    parser.add_argument("--conf_threshold", type=float, default=0.4)
+    parser.add_argument("--nms_threshold", type=float, default=0.5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout", type=str, default=None)
+    parser.add_argument("--baseline", help="JSON report to compare against", type=str, default=None)
+    parser.add_argument("--tolerance", help="p50 slowdown counted as a regression", type=float, default=0.1)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    report = run_suite(args)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Wrote benchmark report to {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        if regressions:
+            logger.error(f"ERROR: {len(regressions)} regimes regressed: {regressions}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
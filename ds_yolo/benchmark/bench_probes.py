@@ -0,0 +1,171 @@
+import argparse
+import cProfile
+import datetime
+import itertools
+import json
+import os
+import platform
+import pstats
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+
+from loguru import logger
+
+from benchmark import fake_ds
+
+# the fakes have to be in place before the pipeline modules import pyds and gi
+pyds = fake_ds.install()
+
+from benchmark.synthetic import SCORE_DISTRIBUTIONS, make_buffer
+from ds_triton_pipeline.pipeline_parts import PipelineParts
+
+
+IMAGE_WIDTH = 1920
+IMAGE_HEIGHT = 1080
+
+
+def _percentiles(latencies):
+    latencies_ms = np.asarray(latencies) * 1e3
+    return {
+        "mean": float(latencies_ms.mean()),
+        "p50": float(np.percentile(latencies_ms, 50)),
+        "p95": float(np.percentile(latencies_ms, 95)),
+        "p99": float(np.percentile(latencies_ms, 99)),
+        "max": float(latencies_ms.max()),
+    }
+
+
+def make_parts(args, is_save_output):
+    # the result dispatcher is not started: records stay queued, the writer thread is not part of the probe cost
+    return PipelineParts(
+        conf_threshold=args.conf, nms_threshold=args.iou, is_save_output=is_save_output,
+        image_width=IMAGE_WIDTH, image_height=IMAGE_HEIGHT, label_type=args.label_type,
+        result_queue_size=(args.warmup + args.iterations) * max(args.batch_size), latency_stats=args.latency_stats,
+        postprocess_workers=args.postprocess_workers, max_in_flight_batches=args.max_in_flight_batches)
+
+
+def bench_regime(args, batch_size, num_boxes, is_save_output, profiler=None):
+    """
+    Run the pgie src probe, and the osd sink probe when saving output, over `args.iterations`
+    fresh fake batches of `batch_size` frames with `num_boxes` candidate rows per frame
+    """
+    rng = np.random.default_rng(args.seed)
+    pool = [
+        [make_buffer(rng, num_boxes, args.classes, args.scores, args.overlap) for _ in range(batch_size)]
+        for _ in range(args.pool_size)]
+    image_sizes = [(IMAGE_WIDTH, IMAGE_HEIGHT)] * batch_size
+    parts = make_parts(args, is_save_output)
+    if parts.postprocess_pool is not None:
+        parts.postprocess_pool.start()
+
+    pgie_latencies = []
+    osd_latencies = []
+    objects = 0
+    for i in range(args.warmup + args.iterations):
+        # building the batch meta is not timed, every iteration gets fresh frame metas
+        info = fake_ds.make_probe_info(
+            pyds, pool[i % args.pool_size], image_sizes,
+            frame_nums=[i] * batch_size, source_ids=list(range(batch_size)), pts=i)
+        profile = profiler is not None and i >= args.warmup
+        if profile:
+            profiler.enable()
+        start_t = time.perf_counter()
+        parts.pgie_src_pad_buffer_probe(None, info, 0)
+        pgie_t = time.perf_counter()
+        if is_save_output:
+            parts.osd_sink_pad_buffer_probe(None, info, 0)
+        end_t = time.perf_counter()
+        if profile:
+            profiler.disable()
+        if i < args.warmup:
+            continue
+        pgie_latencies.append(pgie_t - start_t)
+        osd_latencies.append(end_t - pgie_t)
+        frame = info.get_buffer().batch_meta.frame_meta_list
+        while frame is not None:
+            objects += frame.data.num_obj_meta
+            frame = frame.next
+
+    # offloaded batches still in the pool count towards the throughput
+    drain = 0.0
+    if parts.postprocess_pool is not None:
+        drain_t = time.perf_counter()
+        parts.postprocess_pool.stop()
+        drain = time.perf_counter() - drain_t
+    total = sum(pgie_latencies) + sum(osd_latencies) + drain
+    result = {
+        "frames_per_s": batch_size * args.iterations / total,
+        "pgie_probe_ms": _percentiles(pgie_latencies),
+        "objects_per_frame": objects / (batch_size * args.iterations),
+        "results_queued": parts.result_dispatcher.pending(),
+    }
+    if parts.postprocess_pool is not None:
+        result["drain_ms"] = drain * 1e3
+    if is_save_output:
+        result["osd_probe_ms"] = _percentiles(osd_latencies)
+    if parts.latency is not None:
+        result["stages_us"] = {
+            str(stage): summary for (stage, stream), summary in parts.latency.summaries().items() if stream is None}
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the PipelineParts pad probes with fake pyds/Gst")
+    parser.add_argument("--batch_size", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--boxes", help="valid rows per output tensor", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--classes", help="number of classes", type=int, default=3)
+    parser.add_argument("--scores", help="score distribution", choices=SCORE_DISTRIBUTIONS, default="low")
+    parser.add_argument("--overlap", help="share of duplicate boxes", type=float, default=0.8)
+    parser.add_argument("--save", help="probe modes: 0 detections only, 1 also object meta and osd probe",
+                        type=int, nargs="+", choices=[0, 1], default=[0, 1])
+    parser.add_argument("--label_type", help="Label type (flag/nsfw/horror) or path to a labels.txt or nvinferserver config", type=str, default="flag")
+    parser.add_argument("--conf", help="Confidence threshold for YOLOv5", type=float, default=0.5)
+    parser.add_argument("--iou", help="IOU threshold", type=float, default=0.45)
+    parser.add_argument("--latency_stats", help="also record the per-stage latency histograms", action="store_true")
+    parser.add_argument(
+        "--postprocess_workers", help="postprocess the frames that are not drawn on N threads (0: in the probe)",
+        type=int, default=0)
+    parser.add_argument("--max_in_flight_batches", help="batches queued for the postprocess threads", type=int, default=4)
+    parser.add_argument("--iterations", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--pool_size", help="distinct synthetic batches per regime", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--profile", help="write cProfile stats of all probe calls to this file", type=str, default=None)
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout", type=str, default=None)
+    args = parser.parse_args(argv)
+
+    profiler = cProfile.Profile() if args.profile else None
+    results = []
+    for batch_size, num_boxes, save in itertools.product(args.batch_size, args.boxes, args.save):
+        stats = bench_regime(args, batch_size, num_boxes, bool(save), profiler)
+        name = f"batch={batch_size}/boxes={num_boxes}/save={save}"
+        logger.info(
+            f"{name}: {stats['frames_per_s']:.1f} frames/s, pgie p50 {stats['pgie_probe_ms']['p50']:.3f} ms"
+            + (f", osd p50 {stats['osd_probe_ms']['p50']:.3f} ms" if save else "")
+            + f", {stats['objects_per_frame']:.1f} objects/frame")
+        results.append(dict(name=name, batch_size=batch_size, num_boxes=num_boxes, is_save_output=bool(save), **stats))
+
+    report = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "environment": {"python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine()},
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "profile")},
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+    if profiler is not None:
+        profiler.dump_stats(args.profile)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(25)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
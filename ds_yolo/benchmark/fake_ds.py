@@ -0,0 +1,308 @@
+import sys
+import types
+import weakref
+
+import numpy as np
+
+
+# In-process stand-ins for pyds and the gi Gst bindings, just enough of their API to drive
+# the PipelineParts pad probes on a CPU-only machine. `install` must run before
+# ds_triton_pipeline.pipeline_parts is imported.
+
+# buffer address (hash of the fake GstBuffer) -> buffer, like the C pointer pyds expects
+_buffers = weakref.WeakValueDictionary()
+# meta pools shared by all batches: like the DeepStream pools, acquiring reuses
+# preallocated objects, so the probes are not timed allocating fakes
+_obj_meta_pool = []
+_display_meta_pool = []
+
+
+class GList:
+    def __init__(self, data, next=None):
+        self.data = data
+        self.next = next
+
+
+def glist(items):
+    head = None
+    for item in reversed(items):
+        head = GList(item, head)
+    return head
+
+
+class Color:
+    def __init__(self):
+        self.red = self.green = self.blue = self.alpha = 0.0
+
+    def set(self, red, green, blue, alpha):
+        self.red = red
+        self.green = green
+        self.blue = blue
+        self.alpha = alpha
+
+    def assign(self, other):
+        self.__dict__.update(other.__dict__)
+
+
+class FontParams:
+    def __init__(self):
+        self.font_name = None
+        self.font_size = 0
+        self.font_color = Color()
+
+    def assign(self, other):
+        font_color = self.font_color
+        self.__dict__.update(other.__dict__)
+        self.font_color = font_color
+        font_color.assign(other.font_color)
+
+
+class TextParams:
+    def __init__(self):
+        self.display_text = None
+        self.x_offset = 0
+        self.y_offset = 0
+        self.font_params = FontParams()
+        self.set_bg_clr = 0
+        self.text_bg_clr = Color()
+
+    def assign(self, other):
+        font_params, text_bg_clr = self.font_params, self.text_bg_clr
+        self.__dict__.update(other.__dict__)
+        self.font_params, self.text_bg_clr = font_params, text_bg_clr
+        font_params.assign(other.font_params)
+        text_bg_clr.assign(other.text_bg_clr)
+
+
+class RectParams:
+    def __init__(self):
+        self.left = self.top = self.width = self.height = 0
+        self.has_bg_color = 0
+        self.bg_color = Color()
+        self.border_width = 0
+        self.border_color = Color()
+
+    def assign(self, other):
+        bg_color, border_color = self.bg_color, self.border_color
+        self.__dict__.update(other.__dict__)
+        self.bg_color, self.border_color = bg_color, border_color
+        bg_color.assign(other.bg_color)
+        border_color.assign(other.border_color)
+
+
+class StructMember:
+    """
+    Struct typed member: assigning copies the struct in place, like pybind11 def_readwrite.
+    Nested structs keep their own storage, a flat dict update stands in for the memcpy.
+    """
+    def __set_name__(self, owner, name):
+        self.name = "_" + name
+
+    def __get__(self, instance, owner):
+        return self if instance is None else instance.__dict__[self.name]
+
+    def __set__(self, instance, value):
+        struct = instance.__dict__.get(self.name)
+        if struct is None:
+            instance.__dict__[self.name] = struct = type(value)()
+        struct.assign(value)
+
+
+class ObjectMeta:
+    rect_params = StructMember()
+    text_params = StructMember()
+
+    def __init__(self):
+        self.rect_params = RectParams()
+        self.text_params = TextParams()
+        self.confidence = 0.0
+        self.class_id = 0
+        self.object_id = 0
+        self.obj_label = ""
+
+
+class DisplayMeta:
+    MAX_ELEMENTS = 16
+
+    def __init__(self):
+        self.num_labels = 0
+        self.num_rects = 0
+        self.text_params = [TextParams() for _ in range(self.MAX_ELEMENTS)]
+        self.rect_params = [RectParams() for _ in range(self.MAX_ELEMENTS)]
+
+
+class BaseMeta:
+    def __init__(self, meta_type):
+        self.meta_type = meta_type
+
+
+class UserMeta:
+    def __init__(self, meta_type, user_meta_data):
+        self.base_meta = BaseMeta(meta_type)
+        self.user_meta_data = user_meta_data
+
+
+class Dims:
+    def __init__(self, shape):
+        self.numDims = len(shape)
+        self.d = list(shape) + [0] * (8 - len(shape))
+
+
+class LayerInfo:
+    def __init__(self, name, buffer, data_type):
+        self.layerName = name
+        self.dataType = data_type
+        self.dims = Dims(buffer.shape)
+        # numpy array standing in for the device-to-host copy of the layer
+        self.buffer = buffer
+
+
+class TensorMeta:
+    def __init__(self, layers):
+        self.output_layers_info = layers
+        self.num_output_layers = len(layers)
+
+
+class FrameMeta:
+    def __init__(self, frame_num, source_id, width, height, pts, user_metas):
+        self.frame_num = frame_num
+        self.source_id = source_id
+        self.pad_index = source_id
+        self.batch_id = 0
+        self.buf_pts = pts
+        self.source_frame_width = width
+        self.source_frame_height = height
+        self.num_obj_meta = 0
+        self.obj_meta_list = None
+        self.display_meta_list = None
+        self.frame_user_meta_list = glist(user_metas)
+
+
+class BatchMeta:
+    def __init__(self, frame_metas):
+        self.num_frames_in_batch = len(frame_metas)
+        self.frame_meta_list = glist(frame_metas)
+        self.num_obj_meta_acquired = 0
+        self.num_display_meta_acquired = 0
+
+
+class GstBuffer:
+    def __init__(self, batch_meta, pts=0):
+        self.batch_meta = batch_meta
+        self.pts = pts
+        _buffers[hash(self)] = self
+
+
+class PadProbeInfo:
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    def get_buffer(self):
+        return self.buffer
+
+
+def _cast(data):
+    return data
+
+
+def _acquire(pool, meta_class, batch_meta, counter):
+    index = getattr(batch_meta, counter)
+    setattr(batch_meta, counter, index + 1)
+    if index == len(pool):
+        pool.append(meta_class())
+    return pool[index]
+
+
+def _make_pyds():
+    pyds = types.ModuleType("pyds")
+    pyds.NvDsInferDataType = types.SimpleNamespace(FLOAT=0, HALF=1, INT8=2, INT32=3)
+    pyds.NvDsMetaType = types.SimpleNamespace(NVDSINFER_TENSOR_OUTPUT_META=12)
+    pyds.NvOSD_RectParams = RectParams
+    pyds.NvOSD_TextParams = TextParams
+    pyds.NvOSD_FontParams = FontParams
+    pyds.NvOSD_ColorParams = Color
+    for name in ("NvDsFrameMeta", "NvDsUserMeta", "NvDsInferTensorMeta", "NvDsObjectMeta", "NvDsDisplayMeta"):
+        setattr(pyds, name, types.SimpleNamespace(cast=_cast))
+
+    def gst_buffer_get_nvds_batch_meta(address):
+        return _buffers[address].batch_meta
+
+    def get_nvds_LayerInfo(tensor_meta, index):
+        return tensor_meta.output_layers_info[index]
+
+    def get_ptr(buffer):
+        return buffer.ctypes.data
+
+    def nvds_acquire_obj_meta_from_pool(batch_meta):
+        return _acquire(_obj_meta_pool, ObjectMeta, batch_meta, "num_obj_meta_acquired")
+
+    def nvds_add_obj_meta_to_frame(frame_meta, obj_meta, parent):
+        frame_meta.obj_meta_list = GList(obj_meta, frame_meta.obj_meta_list)
+        frame_meta.num_obj_meta += 1
+
+    def nvds_acquire_display_meta_from_pool(batch_meta):
+        return _acquire(_display_meta_pool, DisplayMeta, batch_meta, "num_display_meta_acquired")
+
+    def nvds_add_display_meta_to_frame(frame_meta, display_meta):
+        frame_meta.display_meta_list = GList(display_meta, frame_meta.display_meta_list)
+
+    def get_string(text):
+        return text
+
+    def free_buffer(text):
+        pass
+
+    for func in (
+            gst_buffer_get_nvds_batch_meta, get_nvds_LayerInfo, get_ptr, nvds_acquire_obj_meta_from_pool,
+            nvds_add_obj_meta_to_frame, nvds_acquire_display_meta_from_pool, nvds_add_display_meta_to_frame,
+            get_string, free_buffer):
+        setattr(pyds, func.__name__, func)
+    return pyds
+
+
+def _make_gi():
+    gi = types.ModuleType("gi")
+    gi.require_version = lambda namespace, version: None
+    repository = types.ModuleType("gi.repository")
+    repository.Gst = types.SimpleNamespace(
+        PadProbeReturn=types.SimpleNamespace(OK=1, DROP=2, REMOVE=3),
+        PadProbeType=types.SimpleNamespace(BUFFER=16),
+        MessageType=types.SimpleNamespace(EOS=1, ERROR=2, WARNING=4, get_name=lambda message_type: str(message_type)),
+        ElementFactory=types.SimpleNamespace(make=lambda factory_name, name: None),
+        init=lambda argv: None)
+    repository.GLib = types.SimpleNamespace(timeout_add_seconds=lambda interval, callback: 0)
+    repository.GObject = types.SimpleNamespace(threads_init=lambda: None)
+    gi.repository = repository
+    return gi, repository
+
+
+def install():
+    """
+    Register the fake pyds, gi and gi.repository modules, replacing the real ones if loaded.
+    Return the fake pyds module.
+    """
+    pyds = _make_pyds()
+    gi, repository = _make_gi()
+    sys.modules["pyds"] = pyds
+    sys.modules["gi"] = gi
+    sys.modules["gi.repository"] = repository
+    return pyds
+
+
+def make_probe_info(pyds, tensors, image_sizes, frame_nums=None, source_ids=None, pts=0, layer_name="prob"):
+    """
+    PadProbeInfo of a batch: one frame meta per output tensor, each carrying an nvinferserver
+    tensor output user meta with a single FLOAT layer. The tensors must stay alive while
+    the info is used, their memory is read in place.
+    """
+    frame_metas = []
+    for index, tensor in enumerate(tensors):
+        tensor = np.ascontiguousarray(tensor, dtype=np.float32)
+        tensor_meta = TensorMeta([LayerInfo(layer_name, tensor, pyds.NvDsInferDataType.FLOAT)])
+        user_meta = UserMeta(pyds.NvDsMetaType.NVDSINFER_TENSOR_OUTPUT_META, tensor_meta)
+        width, height = image_sizes[index]
+        frame_metas.append(FrameMeta(
+            frame_nums[index] if frame_nums is not None else index,
+            source_ids[index] if source_ids is not None else index,
+            width, height, pts, [user_meta]))
+    return PadProbeInfo(GstBuffer(BatchMeta(frame_metas), pts))
@@ -0,0 +1,86 @@
+import argparse
+import os
+import signal
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+
+from loguru import logger
+
+from common.metrics_server import MetricsRegistry, MetricsServer
+from common.sinks import SINK_TYPES, DetectionRecord, make_sink
+from postprocess.detections import Detections
+from postprocess.labels import get_label_set
+
+
+def make_detections(rng, source_id, num_boxes, num_classes, width=1920, height=1080):
+    """
+    Random detections of one frame of `source_id`, boxes in source resolution
+    """
+    x1 = rng.random(num_boxes) * width * 0.9
+    y1 = rng.random(num_boxes) * height * 0.9
+    boxes = np.stack([x1, y1, x1 + rng.random(num_boxes) * width * 0.1, y1 + rng.random(num_boxes) * height * 0.1], axis=1)
+    return Detections.from_columns(
+        boxes, rng.random(num_boxes), rng.integers(0, num_classes, num_boxes), np.zeros(num_boxes),
+        [(width, height)], [source_id])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Stand-in for deepstream_yolo_trt_parser.py: synthetic detections for every source, no GPU needed")
+    parser.add_argument("--test_video", type=str, nargs="+", default=["mock://0"])
+    parser.add_argument("--fps", help="frames per second of every source", type=float, default=25.0)
+    parser.add_argument("--frames", help="frames per source before exiting (0: run until stopped)", type=int, default=0)
+    parser.add_argument("--boxes", help="detections per frame", type=int, default=5)
+    parser.add_argument("--fail_after", help="exit with status 1 after this many seconds (0: never)", type=float, default=0.0)
+    parser.add_argument("--label_type", type=str, default="flag")
+    parser.add_argument("--sink", help="Detection output ({})".format("/".join(SINK_TYPES)), type=str, default="log")
+    parser.add_argument("--sink_path", type=str, default=None)
+    parser.add_argument("--metrics_port", type=int, default=0)
+    parser.add_argument("--seed", type=int, default=0)
+    # options of the real pipeline passed through by the orchestrator are ignored
+    args, _ = parser.parse_known_args(argv)
+
+    label_names = get_label_set(args.label_type)
+    sink = make_sink(args.sink, label_names, path=args.sink_path, flush_interval=0.2)
+    registry = MetricsRegistry()
+    processed = registry.counter("ds_frames_processed_total", "Frames postprocessed", ["source"])
+    metrics_server = None
+    if args.metrics_port > 0:
+        metrics_server = MetricsServer(registry, port=args.metrics_port)
+        metrics_server.start()
+
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+    rng = np.random.default_rng(args.seed)
+    start_t = time.monotonic()
+    frame_num = 0
+    status = 0
+    try:
+        while not stopping and (not args.frames or frame_num < args.frames):
+            if args.fail_after and time.monotonic() - start_t >= args.fail_after:
+                logger.error(f"ERROR: mock worker failing after {args.fail_after:.1f} s")
+                status = 1
+                break
+            timestamp = time.time()
+            records = []
+            for source_id in range(len(args.test_video)):
+                records.append(DetectionRecord(
+                    frame_num, source_id, timestamp, make_detections(rng, source_id, args.boxes, len(label_names))))
+                processed.inc(1, (str(source_id),))
+            sink.write(records)
+            frame_num += 1
+            time.sleep(max(start_t + frame_num / args.fps - time.monotonic(), 0.0))
+    finally:
+        sink.close()
+        if metrics_server is not None:
+            metrics_server.stop()
+    logger.info(f"[INFO] mock worker: {frame_num} frames of {len(args.test_video)} sources")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
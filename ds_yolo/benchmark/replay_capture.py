@@ -0,0 +1,131 @@
+import argparse
+import concurrent.futures
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from loguru import logger
+
+from common.sinks import SINK_TYPES, DetectionRecord, make_sink
+from common.tensor_capture import MAGIC, TensorCaptureReader
+from postprocess.detections import Detections
+from postprocess.labels import get_label_set
+from postprocess.trt_postprocess import postprocess_batch
+
+
+# capture readers opened by this process, each worker maps every file once
+_readers = {}
+
+
+def _reader(path):
+    reader = _readers.get(path)
+    if reader is None:
+        reader = _readers[path] = TensorCaptureReader(path)
+    return reader
+
+
+def capture_files(paths):
+    """
+    Capture files of `paths`, directories are expanded to the capture files they contain
+    """
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        for name in sorted(os.listdir(path)):
+            file_path = os.path.join(path, name)
+            if os.path.isfile(file_path):
+                with open(file_path, "rb") as f:
+                    if f.read(len(MAGIC)) == MAGIC:
+                        files.append(file_path)
+    return files
+
+
+def make_shards(files, shard_frames=4096):
+    """
+    (path, start, stop) record ranges of at most `shard_frames` frames covering all files
+    """
+    shards = []
+    for path in files:
+        num_frames = len(_reader(path))
+        shards.extend((path, start, min(start + shard_frames, num_frames)) for start in range(0, num_frames, shard_frames))
+    return shards
+
+
+def rescore_shard(shard, conf_threshold, nms_threshold, batch_size=16):
+    """
+    Postprocess the frames of one shard straight from the memory map. Only the shard
+    bounds go to a worker and only the detections come back, frames are never pickled.
+    """
+    path, start, stop = shard
+    return Detections.concatenate(
+        postprocess_batch(tensors, image_sizes, conf_threshold, nms_threshold, source_ids)
+        for tensors, image_sizes, source_ids, _ in _reader(path).batches(batch_size, start, stop))
+
+
+def rescore(shards, conf_threshold=0.5, nms_threshold=0.45, batch_size=16, workers=1, sink=None):
+    """
+    Rescore the shards over `workers` processes and merge the results in shard order,
+    writing the per-frame detections to `sink` if given.
+    Return (frames, detections, seconds).
+    """
+    frames = 0
+    detections = 0
+    start_t = time.perf_counter()
+    args = ([conf_threshold] * len(shards), [nms_threshold] * len(shards), [batch_size] * len(shards))
+    executor = concurrent.futures.ProcessPoolExecutor(workers) if workers > 1 else None
+    try:
+        results = executor.map(rescore_shard, shards, *args) if executor is not None else map(rescore_shard, shards, *args)
+        for (path, start, stop), shard_detections in zip(shards, results):
+            frames += stop - start
+            detections += len(shard_detections)
+            if sink is not None:
+                records = _reader(path).records[start:stop]
+                sink.write([
+                    DetectionRecord(int(record["frame_num"]), int(record["source_id"]), float(record["timestamp"]), frame)
+                    for record, frame in zip(records, shard_detections.split())])
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return frames, detections, time.perf_counter() - start_t
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay the postprocess over tensor capture files")
+    parser.add_argument(
+        "captures", help="files written by deepstream_yolo_trt_parser.py --capture_tensors, or directories of them",
+        type=str, nargs="+")
+    parser.add_argument("--conf", help="Confidence threshold for YOLOv5", type=float, default=0.5)
+    parser.add_argument("--iou", help="IOU threshold", type=float, default=0.45)
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument("--workers", help="worker processes, 1 replays in this process", type=int, default=os.cpu_count())
+    parser.add_argument("--shard_frames", help="frames per worker task", type=int, default=4096)
+    parser.add_argument("--label_type", help="Label type (flag/nsfw/horror) or path to a labels.txt or nvinferserver config", type=str, default="flag")
+    parser.add_argument("--sink", help="Detection output ({})".format("/".join(SINK_TYPES)), type=str, default=None)
+    parser.add_argument("--sink_path", type=str, default=None)
+    args = parser.parse_args(argv)
+
+    files = capture_files(args.captures)
+    shards = make_shards(files, args.shard_frames)
+    logger.info(f"Replaying {sum(stop - start for _, start, stop in shards)} frames of {len(files)} captures "
+                f"in {len(shards)} shards over {args.workers} workers")
+
+    sink = None
+    if args.sink:
+        sink = make_sink(args.sink, get_label_set(args.label_type), path=args.sink_path)
+    try:
+        frames, detections, seconds = rescore(shards, args.conf, args.iou, args.batch_size, args.workers, sink)
+    finally:
+        if sink is not None:
+            sink.close()
+    logger.info(
+        f"[INFO] replayed {frames} frames, {detections} detections in {seconds:.3f} s "
+        f"({frames / seconds if seconds > 0 else 0.0:.1f} frames/s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
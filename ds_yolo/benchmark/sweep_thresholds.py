@@ -0,0 +1,186 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np
+
+from loguru import logger
+
+from benchmark.replay_capture import capture_files
+from benchmark.synthetic import SCORE_DISTRIBUTIONS, make_batch
+from common.tensor_capture import TensorCaptureReader
+from postprocess.labels import get_label_set
+from postprocess.threshold_sweep import ThresholdSweep, match_counts
+
+
+def load_ground_truth(path, label_names):
+    """
+    {(source id, frame num): (boxes, class ids)} of a JSON lines file in the jsonl sink format:
+    one {"frame_num", "source_id", "labels", "boxes"} object per frame, boxes being x1, y1, x2, y2
+    in source resolution. "class_ids" may be given instead of "labels".
+    """
+    class_of_label = {name: class_id for class_id, name in enumerate(label_names)}
+    ground_truth = {}
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            frame = json.loads(line)
+            class_ids = frame.get("class_ids")
+            if class_ids is None:
+                class_ids = [class_of_label[label] for label in frame["labels"]]
+            ground_truth[(frame["source_id"], frame["frame_num"])] = (
+                np.asarray(frame["boxes"], dtype=np.float64).reshape(-1, 4),
+                np.asarray(class_ids, dtype=np.int32))
+    return ground_truth
+
+
+def capture_batches(paths, batch_size, max_frames=None):
+    """
+    (tensors, image sizes, source ids, frame nums) batches of capture files
+    """
+    frames = 0
+    for path in capture_files(paths):
+        for batch in TensorCaptureReader(path).batches(batch_size):
+            if max_frames is not None and frames >= max_frames:
+                return
+            frames += len(batch[3])
+            yield batch
+
+
+def synthetic_batches(args):
+    rng = np.random.default_rng(args.seed)
+    for start in range(0, args.max_frames, args.batch_size):
+        batch_size = min(args.batch_size, args.max_frames - start)
+        tensors = make_batch(
+            rng, batch_size, num_boxes=args.boxes, num_classes=args.classes,
+            score_distribution=args.scores, overlap=args.overlap)
+        yield (
+            tensors,
+            np.tile([1920, 1080], (batch_size, 1)),
+            np.zeros(batch_size, dtype=np.int32),
+            np.arange(start, start + batch_size))
+
+
+def sweep(batches, conf_thresholds, nms_thresholds, ground_truth=None, match_iou=0.5):
+    """
+    Evaluate every (conf, iou) setting over the batches, sharing candidate decoding and
+    pairwise IoU between settings. Return the JSON report.
+    """
+    settings = list(itertools.product(sorted(conf_thresholds), sorted(nms_thresholds)))
+    stats = {setting: {"detections": 0, "seconds": 0.0, "tp": 0, "fp": 0, "fn": 0} for setting in settings}
+    frames = 0
+    evaluated_frames = 0
+    shared_seconds = 0.0
+
+    for tensors, image_sizes, source_ids, frame_nums in batches:
+        start_t = time.perf_counter()
+        batch = ThresholdSweep(tensors, image_sizes, min(conf_thresholds), min(nms_thresholds), source_ids)
+        shared_seconds += time.perf_counter() - start_t
+        frames += len(frame_nums)
+
+        truths = None
+        if ground_truth is not None:
+            truths = [ground_truth.get((int(source_id), int(frame_num))) for source_id, frame_num in zip(source_ids, frame_nums)]
+            evaluated_frames += sum(truth is not None for truth in truths)
+
+        for setting in settings:
+            start_t = time.perf_counter()
+            keep = batch.keep(*setting)
+            setting_stats = stats[setting]
+            setting_stats["detections"] += int(keep.sum())
+            setting_stats["seconds"] += time.perf_counter() - start_t
+            if truths is None:
+                continue
+            frame_of = batch.frames[keep]
+            boxes = batch.boxes[keep]
+            scores = batch.scores[keep]
+            class_ids = batch.class_ids[keep]
+            offsets = np.searchsorted(frame_of, np.arange(len(frame_nums) + 1))
+            for index, truth in enumerate(truths):
+                if truth is None:
+                    continue
+                rows = slice(offsets[index], offsets[index + 1])
+                tp, fp, fn = match_counts(boxes[rows], scores[rows], class_ids[rows], truth[0], truth[1], match_iou)
+                setting_stats["tp"] += tp
+                setting_stats["fp"] += fp
+                setting_stats["fn"] += fn
+
+    results = []
+    for (conf_threshold, nms_threshold), setting_stats in stats.items():
+        result = {
+            "conf": conf_threshold,
+            "iou": nms_threshold,
+            "detections_per_frame": setting_stats["detections"] / frames if frames else 0.0,
+            "seconds": setting_stats["seconds"],
+            "ms_per_frame": setting_stats["seconds"] * 1e3 / frames if frames else 0.0,
+        }
+        if ground_truth is not None:
+            tp, fp, fn = setting_stats["tp"], setting_stats["fp"], setting_stats["fn"]
+            precision = tp / (tp + fp) if tp + fp else 0.0
+            recall = tp / (tp + fn) if tp + fn else 0.0
+            result.update(
+                tp=tp, fp=fp, fn=fn, precision=precision, recall=recall,
+                f1=2 * precision * recall / (precision + recall) if precision + recall else 0.0)
+        results.append(result)
+
+    return {
+        "frames": frames,
+        "evaluated_frames": evaluated_frames,
+        "shared_seconds": shared_seconds,
+        "settings": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sweep confidence and IoU thresholds of the yolov5 postprocess")
+    parser.add_argument("--captures", help="tensor capture files or directories, synthetic buffers if not given", type=str, nargs="+")
+    parser.add_argument("--conf", help="confidence thresholds", type=float, nargs="+", default=[0.25, 0.3, 0.4, 0.5, 0.6])
+    parser.add_argument("--iou", help="IoU thresholds", type=float, nargs="+", default=[0.3, 0.45, 0.5, 0.6])
+    parser.add_argument("--labels", help="ground truth in the jsonl sink format, enables precision/recall", type=str, default=None)
+    parser.add_argument("--label_type", help="Label type (flag/nsfw/horror) or path to a labels.txt or nvinferserver config", type=str, default="flag")
+    parser.add_argument("--match_iou", help="IoU for a detection to match a ground truth box", type=float, default=0.5)
+    parser.add_argument("--batch_size", type=int, default=32)
+    parser.add_argument("--max_frames", type=int, default=1000)
+    parser.add_argument("--boxes", help="synthetic: valid rows per output buffer", type=int, default=200)
+    parser.add_argument("--classes", help="synthetic: number of classes", type=int, default=3)
+    parser.add_argument("--scores", help="synthetic: score distribution", choices=SCORE_DISTRIBUTIONS, default="low")
+    parser.add_argument("--overlap", help="synthetic: share of duplicate boxes", type=float, default=0.7)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout", type=str, default=None)
+    args = parser.parse_args(argv)
+
+    ground_truth = None
+    if args.labels:
+        ground_truth = load_ground_truth(args.labels, get_label_set(args.label_type))
+
+    if args.captures:
+        batches = capture_batches(args.captures, args.batch_size, args.max_frames)
+    else:
+        batches = synthetic_batches(args)
+    report = sweep(batches, args.conf, args.iou, ground_truth, args.match_iou)
+
+    lines = [f"[INFO] sweep over {report['frames']} frames, shared decode {report['shared_seconds']:.3f} s",
+             "   conf    iou  det/frame  ms/frame" + ("  precision  recall      f1" if ground_truth is not None else "")]
+    for result in report["settings"]:
+        line = f"{result['conf']:>7.3f} {result['iou']:>6.3f} {result['detections_per_frame']:>10.2f} {result['ms_per_frame']:>9.4f}"
+        if ground_truth is not None:
+            line += f" {result['precision']:>10.3f} {result['recall']:>7.3f} {result['f1']:>7.3f}"
+        lines.append(line)
+    logger.info("\n".join(lines))
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+import numpy as np
+
+from postprocess.trt_postprocess import BOX_SIZE, INPUT_HEIGHT, INPUT_WIDTH
+
+
+MAX_OUTPUT_BBOX_COUNT = 1000
+SCORE_DISTRIBUTIONS = ("uniform", "low", "high", "bimodal")
+LAYOUTS = ("clusters", "chain")
+
+
+def _scores(rng, distribution, size):
+    """
+    Confidences in [0, 1). "low" is most like a raw yolov5 output: many weak
+    candidates and few confident ones.
+    """
+    if distribution == "uniform":
+        return rng.random(size)
+    if distribution == "low":
+        return rng.beta(0.7, 4.0, size)
+    if distribution == "high":
+        return rng.beta(4.0, 1.5, size)
+    if distribution == "bimodal":
+        return np.where(rng.random(size) < 0.8, rng.beta(1.0, 8.0, size), rng.beta(8.0, 1.5, size))
+    raise ValueError(f"Unknown score distribution {distribution}, expected one of {SCORE_DISTRIBUTIONS}")
+
+
+def make_buffer(
+    rng,
+    num_boxes=100,
+    num_classes=1,
+    score_distribution="uniform",
+    overlap=0.5,
+    max_bboxes=MAX_OUTPUT_BBOX_COUNT,
+    dtype=np.float32,
+    layout="clusters"):
+    """
+    Synthetic yolov5 tensorrt output tensor of shape (1, 1 + 6 * max_bboxes, 1, 1).
+    num_boxes: number of valid rows, the rest of the buffer is left as garbage
+    num_classes: class ids are drawn uniformly from [0, num_classes)
+    score_distribution: one of SCORE_DISTRIBUTIONS
+    overlap: fraction of the boxes that are jittered copies of another box, i.e. the
+        share of candidates NMS has to suppress. 0 gives mostly disjoint boxes.
+    layout: one of LAYOUTS. "chain" ignores `overlap` and lines the boxes up in rows where
+        each box overlaps its neighbours only, with scores falling along the row: every
+        kept box suppresses the next one, the worst case for resolving NMS in passes.
+    """
+    num_boxes = min(num_boxes, max_bboxes)
+    if num_boxes <= 0:
+        # an empty frame: count 0, every row is garbage
+        buffer = rng.uniform(-1.0, 1.0, 1 + max_bboxes * BOX_SIZE).astype(dtype)
+        buffer[0] = 0
+        return buffer.reshape(1, -1, 1, 1)
+    if layout == "chain":
+        rows = _chain_rows(rng, num_boxes, num_classes, score_distribution)
+    elif layout == "clusters":
+        rows = _cluster_rows(rng, num_boxes, num_classes, score_distribution, overlap)
+    else:
+        raise ValueError(f"Unknown layout {layout}, expected one of {LAYOUTS}")
+    rows = rows[rng.permutation(num_boxes)]
+
+    buffer = rng.uniform(-1.0, 1.0, 1 + max_bboxes * BOX_SIZE).astype(dtype)
+    buffer[0] = num_boxes
+    buffer[1: 1 + num_boxes * BOX_SIZE] = rows.ravel()
+    return buffer.reshape(1, -1, 1, 1)
+
+
+def _cluster_rows(rng, num_boxes, num_classes, score_distribution, overlap):
+    num_clusters = max(1, int(round(num_boxes * (1.0 - overlap))))
+
+    # cluster centres and sizes in network resolution
+    sizes = rng.uniform(16, 160, (num_clusters, 2))
+    centres = rng.uniform(sizes / 2, [INPUT_WIDTH, INPUT_HEIGHT] - sizes / 2)
+    # every cluster gets one box, the remaining boxes are spread over random clusters
+    cluster = np.concatenate([np.arange(num_clusters), rng.integers(0, num_clusters, num_boxes - num_clusters)])
+    jitter = rng.normal(0.0, 0.05, (num_boxes, 4)) * np.repeat(sizes[cluster], 2, axis=1)
+    jitter[:num_clusters] = 0
+
+    rows = np.empty((num_boxes, BOX_SIZE), dtype=np.float64)
+    rows[:, :2] = centres[cluster] + jitter[:, :2]
+    rows[:, 2:4] = np.maximum(sizes[cluster] + jitter[:, 2:4], 1.0)
+    rows[:, 4] = _scores(rng, score_distribution, num_boxes)
+    # boxes of a cluster mostly share a class, like real detections of one object
+    cluster_class = rng.integers(0, num_classes, num_clusters)
+    rows[:, 5] = np.where(
+        rng.random(num_boxes) < 0.9, cluster_class[cluster], rng.integers(0, num_classes, num_boxes))
+    return rows
+
+
+def _chain_rows(rng, num_boxes, num_classes, score_distribution, width=8.0, height=64.0):
+    # a step of a quarter width: with the +1 pixel convention of `nms` the IoU is about 0.8
+    # with the next box and below 0.5 with the one after
+    step = width / 4
+    per_row = int((INPUT_WIDTH - width) // step)
+    index = np.arange(num_boxes)
+    rows = np.empty((num_boxes, BOX_SIZE), dtype=np.float64)
+    rows[:, 0] = width / 2 + (index % per_row) * step
+    rows[:, 1] = height / 2 + ((index // per_row) * (height + 2)) % (INPUT_HEIGHT - height)
+    rows[:, 2] = width
+    rows[:, 3] = height
+    rows[:, 4] = np.sort(_scores(rng, score_distribution, num_boxes))[::-1]
+    rows[:, 5] = rng.integers(0, num_classes, num_boxes)
+    return rows
+
+
+def make_batch(rng, batch_size, **kwargs):
+    """
+    (batch_size, 1 + 6 * max_bboxes) stacked buffers, see `make_buffer`
+    """
+    return np.stack([make_buffer(rng, **kwargs).reshape(-1) for _ in range(batch_size)])
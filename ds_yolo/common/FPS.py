@@ -1,28 +1,169 @@
+import math
+import threading
 import time
-start_time=time.time()
-frame_count=0
+
+from loguru import logger
+
+
+class StreamThroughput:
+    """
+    Throughput state of one stream. All fields are guarded by `lock`, which is only
+    held for a few arithmetic operations by writers and while copying by readers.
+
+    The sliding window is split into `num_buckets` time buckets of frame counts,
+    so its memory does not grow with the frame rate.
+    """
+    def __init__(self, window, num_buckets, ewma_tau, now):
+        self.lock = threading.Lock()
+        self.window = window
+        self.ewma_tau = ewma_tau
+        self.bucket_width = window / num_buckets
+        self.buckets = [0] * num_buckets
+        self.bucket_ids = [-1] * num_buckets
+        self.processed = 0
+        self.dropped = 0
+        self.last_frame_num = None
+        self.first_t = now
+        self.last_t = now
+        self.ewma_fps = 0.0
+
+    def add(self, frames, now, frame_num=None):
+        bucket_id = int(now / self.bucket_width)
+        slot = bucket_id % len(self.buckets)
+        with self.lock:
+            if self.bucket_ids[slot] != bucket_id:
+                self.bucket_ids[slot] = bucket_id
+                self.buckets[slot] = 0
+            self.buckets[slot] += frames
+            self.processed += frames
+
+            # a jump in frame numbers means frames were dropped upstream
+            if frame_num is not None:
+                if self.last_frame_num is not None and frame_num > self.last_frame_num + 1:
+                    self.dropped += frame_num - self.last_frame_num - 1
+                self.last_frame_num = frame_num
+
+            elapsed = now - self.last_t
+            if elapsed > 0:
+                alpha = 1.0 - math.exp(-elapsed / self.ewma_tau)
+                self.ewma_fps += alpha * (frames / elapsed - self.ewma_fps)
+                self.last_t = now
+
+    def drop(self, frames):
+        with self.lock:
+            self.dropped += frames
+
+    def restart(self, now):
+        with self.lock:
+            self.buckets = [0] * len(self.buckets)
+            self.bucket_ids = [-1] * len(self.bucket_ids)
+            self.last_frame_num = None
+            self.first_t = now
+            self.last_t = now
+            self.ewma_fps = 0.0
+
+    def snapshot(self, now):
+        with self.lock:
+            buckets = list(self.buckets)
+            bucket_ids = list(self.bucket_ids)
+            processed = self.processed
+            dropped = self.dropped
+            ewma_fps = self.ewma_fps
+            last_t = self.last_t
+
+        current_id = int(now / self.bucket_width)
+        num_buckets = len(buckets)
+        frames = sum(count for count, bucket_id in zip(buckets, bucket_ids) if current_id - bucket_id < num_buckets)
+        # the current bucket is only partly elapsed, and a young stream has no full window yet
+        span = min(self.window - self.bucket_width + (now - current_id * self.bucket_width), now - self.first_t)
+        # the EWMA decays towards 0 while no frames arrive
+        idle = max(0.0, now - last_t)
+        return {
+            "processed": processed,
+            "dropped": dropped,
+            "fps": frames / span if span > 0 else 0.0,
+            "ewma_fps": ewma_fps * math.exp(-idle / self.ewma_tau),
+        }
+
+
+class ThroughputMeter:
+    """
+    Per-stream throughput: processed/dropped frame counters, sliding-window FPS over
+    `window` seconds and an exponentially weighted FPS with time constant `ewma_tau`,
+    on the monotonic clock. Safe to update from several streaming threads; `snapshot`
+    copies each stream's state under its lock and computes the rates outside of it.
+    """
+    def __init__(self, window=5.0, num_buckets=10, ewma_tau=2.0, clock=time.monotonic):
+        self.window = window
+        self.num_buckets = num_buckets
+        self.ewma_tau = ewma_tau
+        self.clock = clock
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def stream(self, stream_id):
+        stream = self._streams.get(stream_id)
+        if stream is None:
+            with self._lock:
+                stream = self._streams.get(stream_id)
+                if stream is None:
+                    stream = StreamThroughput(self.window, self.num_buckets, self.ewma_tau, self.clock())
+                    self._streams[stream_id] = stream
+        return stream
+
+    def update(self, stream_id, frames=1, frame_num=None):
+        """
+        Count processed frames of a stream, `frame_num` enables drop detection by gaps
+        """
+        self.stream(stream_id).add(frames, self.clock(), frame_num)
+
+    def drop(self, stream_id, frames=1):
+        self.stream(stream_id).drop(frames)
+
+    def restart(self, stream_id):
+        """
+        Start the FPS window, EWMA and frame number sequence of a stream over, e.g. when its
+        id is reused by a new source. The processed and dropped counters keep counting.
+        """
+        with self._lock:
+            stream = self._streams.get(stream_id)
+        if stream is not None:
+            stream.restart(self.clock())
+
+    def snapshot(self):
+        """
+        {stream id: {"processed", "dropped", "fps", "ewma_fps"}}
+        """
+        now = self.clock()
+        with self._lock:
+            streams = list(self._streams.items())
+        return {stream_id: stream.snapshot(now) for stream_id, stream in streams}
+
+    def report(self):
+        lines = ["[INFO] throughput: stream processed dropped fps ewma_fps"]
+        for stream_id, stats in sorted(self.snapshot().items()):
+            lines.append(
+                f"{stream_id:>6} {stats['processed']:>10} {stats['dropped']:>8} "
+                f"{stats['fps']:>8.2f} {stats['ewma_fps']:>8.2f}")
+        logger.info("\n".join(lines))
+
 
 class GETFPS:
-    def __init__(self,stream_id):
-        global start_time
-        self.start_time=start_time
-        self.is_first=True
-        global frame_count
-        self.frame_count=frame_count
-        self.stream_id=stream_id
+    """
+    Backward compatible wrapper of ThroughputMeter logging the FPS of a stream every 5 seconds
+    """
+    def __init__(self, stream_id, meter=None):
+        self.stream_id = stream_id
+        self.meter = meter if meter is not None else ThroughputMeter()
+        self.last_print = self.meter.clock()
+
     def get_fps(self):
-        end_time=time.time()
-        if(self.is_first):
-            self.start_time=end_time
-            self.is_first=False
-        if(end_time-self.start_time>5):
-            print("**********************FPS*****************************************")
-            print("Fps of stream",self.stream_id,"is ", float(self.frame_count)/5.0)
-            self.frame_count=0
-            self.start_time=end_time
-        else:
-            self.frame_count=self.frame_count+1
-    def print_data(self):
-        print('frame_count=',self.frame_count)
-        print('start_time=',self.start_time)
+        self.meter.update(self.stream_id)
+        now = self.meter.clock()
+        if now - self.last_print > 5:
+            self.last_print = now
+            logger.info(f"[INFO] Fps of stream {self.stream_id} is {self.meter.snapshot()[self.stream_id]['fps']:.2f}")
 
+    def print_data(self):
+        stats = self.meter.snapshot().get(self.stream_id, {})
+        logger.info(f"[INFO] frame_count={stats.get('processed', 0)} start_time={self.last_print}")
@@ -5,8 +5,16 @@ gi.require_version('Gst', '1.0')
 from gi.repository import GObject, Gst
 from loguru import logger
 
-def bus_call(bus, message, loop):
+def bus_call(bus, message, loop, bus_messages=None, source_errors=None):
+    """
+    Bus watch: quit the loop on EOS or error, log warnings.
+    `bus_messages` is an optional metrics Counter labelled by message type.
+    `source_errors` is an optional callable given the error messages, the loop keeps running
+    when it returns True, e.g. SourceManager.source_error recovering a single source.
+    """
     t = message.type
+    if bus_messages is not None and t in (Gst.MessageType.EOS, Gst.MessageType.WARNING, Gst.MessageType.ERROR):
+        bus_messages.inc(1, (Gst.MessageType.get_name(t),))
     if t == Gst.MessageType.EOS:
         logger.success("End-of-stream\n")
         loop.quit()
@@ -18,5 +26,7 @@ def bus_call(bus, message, loop):
         err, debug = message.parse_error()
         logger.error(f"ERROR: {err}")
         logger.debug(f"DEBUG: {debug}")
+        if source_errors is not None and source_errors(message):
+            return True
         loop.quit()
     return True
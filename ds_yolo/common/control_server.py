@@ -0,0 +1,116 @@
+import json
+import re
+import threading
+
+from http.server import BaseHTTPRequestHandler
+
+from loguru import logger
+
+from common.metrics_server import _ThreadingHTTPServer
+
+
+class ControlServer:
+    """
+    Local JSON control API of a SourceManager and of the preview valve at http://host:port:
+        GET    /sources        list the sources with their health (state, reconnects, downtime)
+        POST   /sources        {"uri": "rtsp://..."} add a source, returns its source_id
+        DELETE /sources/<id>   remove a source
+        GET    /preview        {"enabled": true} if the annotated preview branch is flowing
+        POST   /preview        {"enabled": false} stop or resume the preview branch
+    Bound to localhost by default, there is no authentication.
+    """
+    def __init__(self, manager=None, host="127.0.0.1", port=9102, preview_valve=None):
+        self.manager = manager
+        self.preview_valve = preview_valve
+        self.host = host
+        self.port = port
+        self._httpd = None
+        self._thread = None
+
+    def start(self):
+        manager = self.manager
+        preview_valve = self.preview_valve
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, status, body):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _route(self):
+                path = self.path.rstrip("/")
+                if path == "/sources" and manager is not None:
+                    return path
+                if path == "/preview" and preview_valve is not None:
+                    return path
+                self._reply(404, {"error": "not found"})
+                return None
+
+            def _body(self):
+                try:
+                    length = int(self.headers.get("Content-Length", 0))
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    return {}
+                return body if isinstance(body, dict) else {}
+
+            def do_GET(self):
+                path = self._route()
+                if path == "/sources":
+                    self._reply(200, {"sources": manager.list()})
+                elif path == "/preview":
+                    self._reply(200, {"enabled": not preview_valve.get_property("drop")})
+
+            def do_POST(self):
+                path = self._route()
+                if path == "/preview":
+                    enabled = self._body().get("enabled")
+                    if not isinstance(enabled, bool):
+                        self._reply(400, {"error": "expected a JSON body with a boolean enabled"})
+                        return
+                    # the valve drops the buffers of the preview branch, detections keep flowing
+                    preview_valve.set_property("drop", not enabled)
+                    self._reply(200, {"enabled": enabled})
+                    return
+                if path != "/sources":
+                    return
+                uri = self._body().get("uri")
+                if not uri:
+                    self._reply(400, {"error": "expected a JSON body with a uri"})
+                    return
+                try:
+                    self._reply(201, {"source_id": manager.add(uri), "uri": uri})
+                except Exception as ex:
+                    self._reply(500, {"error": str(ex)})
+
+            def do_DELETE(self):
+                match = re.fullmatch(r"/sources/(\d+)/?", self.path)
+                if match is None or manager is None:
+                    self._reply(404, {"error": "not found"})
+                    return
+                try:
+                    self._reply(200, {"source_id": manager.remove(int(match.group(1)))})
+                except KeyError as ex:
+                    self._reply(404, {"error": ex.args[0]})
+                except Exception as ex:
+                    self._reply(500, {"error": str(ex)})
+
+            def log_message(self, format, *args):
+                logger.debug("control: " + format % args)
+
+        self._httpd = _ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="control-server", daemon=True)
+        self._thread.start()
+        logger.info(f"Serving the control API at http://{self.host}:{self.port}")
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,216 @@
+import numpy as np
+
+from postprocess.tracker import match_boxes
+
+
+EVENT_TYPES = ("start", "update", "end")
+
+# per-track columns of a stream and their dtypes, boxes are (N, 4)
+_COLUMNS = {
+    "boxes": np.float64,
+    "class_ids": np.int32,
+    "first_times": np.float64,
+    "last_times": np.float64,
+    "first_frames": np.int64,
+    "last_frames": np.int64,
+    "hits": np.int64,
+    "peak_scores": np.float32,
+    "peak_boxes": np.float64,
+    "peak_frames": np.int64,
+    "event_ids": np.int64,
+    "reported": np.float64,
+}
+
+
+class StreamEvents:
+    """
+    Open tracks of one stream as columns of `_COLUMNS`, a track being pending (event id -1)
+    until it is seen `min_hits` times
+    """
+    def __init__(self):
+        self.columns = {
+            name: np.empty((0, 4) if name.endswith("boxes") else 0, dtype=dtype) for name, dtype in _COLUMNS.items()}
+
+    def __len__(self):
+        return self.columns["hits"].size
+
+    def select(self, index):
+        for name, column in self.columns.items():
+            self.columns[name] = column[index]
+
+    def append(self, columns):
+        for name, column in columns.items():
+            self.columns[name] = np.concatenate([self.columns[name], np.asarray(column, dtype=_COLUMNS[name])])
+
+
+class EventAggregator:
+    """
+    Collapse per-frame detections into per-stream events. Detections are associated over time
+    by class and IoU with the last box of the open tracks. A track opens an event with a
+    "start" once seen `min_hits` times, each within `max_pending_gap` seconds of the previous
+    one, so flickering false positives never open events. It then reports an "update" every
+    `update_interval` seconds while seen (0: never) and is closed with an "end" when unseen
+    for `max_gap` seconds.
+    Events carry the peak score and the box of the peak frame as the representative box.
+
+    Times are the record timestamps. At most `max_tracks` tracks are kept per stream, the
+    least recently seen ones are evicted (closed) first.
+    """
+    def __init__(
+        self, label_names, min_hits=3, max_pending_gap=0.5, max_gap=2.0, update_interval=30.0,
+        iou_threshold=0.3, max_tracks=64):
+        self.label_names = label_names
+        self.min_hits = min_hits
+        self.max_pending_gap = max_pending_gap
+        self.max_gap = max_gap
+        self.update_interval = update_interval
+        self.iou_threshold = iou_threshold
+        self.max_tracks = max_tracks
+        self.streams = {}
+        self.events_started = 0
+        self.now = None
+
+    def _event(self, event_type, source_id, stream, index):
+        columns = stream.columns
+        first_time = float(columns["first_times"][index])
+        last_time = float(columns["last_times"][index])
+        class_id = int(columns["class_ids"][index])
+        return {
+            "event": event_type,
+            "event_id": int(columns["event_ids"][index]),
+            "source_id": source_id,
+            "class_id": class_id,
+            "label": self.label_names[class_id] if class_id < len(self.label_names) else str(class_id),
+            "start_time": first_time,
+            "last_time": last_time,
+            "duration": last_time - first_time,
+            "start_frame": int(columns["first_frames"][index]),
+            "last_frame": int(columns["last_frames"][index]),
+            "frames": int(columns["hits"][index]),
+            "peak_score": float(columns["peak_scores"][index]),
+            "peak_frame": int(columns["peak_frames"][index]),
+            "box": columns["peak_boxes"][index].astype(np.int32).tolist(),
+        }
+
+    def _close(self, source_id, stream, closed, events):
+        """
+        Drop the tracks of the boolean mask `closed`, ending their events
+        """
+        if not closed.any():
+            return
+        for index in np.flatnonzero(closed & (stream.columns["event_ids"] >= 0)).tolist():
+            events.append(self._event("end", source_id, stream, index))
+        stream.select(~closed)
+
+    def _expire(self, source_id, stream, now, events):
+        columns = stream.columns
+        max_gap = np.where(columns["event_ids"] >= 0, self.max_gap, self.max_pending_gap)
+        self._close(source_id, stream, columns["last_times"] < now - max_gap, events)
+
+    def _update(self, source_id, stream, now, frame_num, detections, events):
+        if len(stream):
+            self._expire(source_id, stream, now, events)
+        if not len(detections):
+            return
+
+        columns = stream.columns
+        boxes = detections.boxes.astype(np.float64)
+        scores = detections.scores
+        tracks, matched, _ = match_boxes(
+            columns["boxes"], columns["class_ids"], boxes, detections.class_ids, self.iou_threshold)
+        columns["boxes"][tracks] = boxes[matched]
+        columns["last_times"][tracks] = now
+        columns["last_frames"][tracks] = frame_num
+        columns["hits"][tracks] += 1
+        peaks = scores[matched] > columns["peak_scores"][tracks]
+        peak_tracks = tracks[peaks]
+        columns["peak_scores"][peak_tracks] = scores[matched][peaks]
+        columns["peak_boxes"][peak_tracks] = boxes[matched][peaks]
+        columns["peak_frames"][peak_tracks] = frame_num
+
+        if self.update_interval > 0:
+            due = tracks[(columns["event_ids"][tracks] >= 0) & (columns["reported"][tracks] <= now - self.update_interval)]
+            for index in due.tolist():
+                events.append(self._event("update", source_id, stream, index))
+            columns["reported"][due] = now
+
+        born = np.ones(len(detections), dtype=bool)
+        born[matched] = False
+        num_born = int(born.sum())
+        if num_born:
+            stream.append({
+                "boxes": boxes[born],
+                "class_ids": detections.class_ids[born],
+                "first_times": np.full(num_born, now),
+                "last_times": np.full(num_born, now),
+                "first_frames": np.full(num_born, frame_num),
+                "last_frames": np.full(num_born, frame_num),
+                "hits": np.ones(num_born),
+                "peak_scores": scores[born],
+                "peak_boxes": boxes[born],
+                "peak_frames": np.full(num_born, frame_num),
+                "event_ids": np.full(num_born, -1),
+                "reported": np.full(num_born, now),
+            })
+            columns = stream.columns
+
+        started = np.flatnonzero((columns["event_ids"] < 0) & (columns["hits"] >= self.min_hits))
+        if started.size:
+            columns["event_ids"][started] = np.arange(self.events_started, self.events_started + started.size)
+            columns["reported"][started] = now
+            self.events_started += started.size
+            for index in started.tolist():
+                events.append(self._event("start", source_id, stream, index))
+
+        if len(stream) > self.max_tracks:
+            # most recently seen first, the most confirmed first among equals
+            order = np.lexsort((-columns["hits"], -columns["last_times"]))
+            evicted = np.zeros(len(stream), dtype=bool)
+            evicted[order[self.max_tracks:]] = True
+            self._close(source_id, stream, evicted, events)
+
+    def process(self, records):
+        """
+        Feed DetectionRecords, return the events they produced
+        """
+        events = []
+        for record in records:
+            stream = self.streams.get(record.source_id)
+            if stream is None:
+                stream = self.streams[record.source_id] = StreamEvents()
+            self._update(record.source_id, stream, record.timestamp, record.frame_num, record.detections, events)
+            if self.now is None or record.timestamp > self.now:
+                self.now = record.timestamp
+        return events
+
+    def expire(self, now=None):
+        """
+        End the events of tracks unseen for `max_gap` seconds at `now`, the latest record
+        timestamp by default, so streams that stopped sending get their events closed too
+        """
+        now = self.now if now is None else now
+        events = []
+        if now is None:
+            return events
+        for source_id, stream in self.streams.items():
+            self._expire(source_id, stream, now, events)
+        return events
+
+    def remove_stream(self, source_id):
+        """
+        End all events of a stream and forget it
+        """
+        events = []
+        stream = self.streams.pop(source_id, None)
+        if stream is not None:
+            self._close(source_id, stream, np.ones(len(stream), dtype=bool), events)
+        return events
+
+    def finish(self):
+        """
+        End all open events
+        """
+        events = []
+        for source_id in list(self.streams):
+            events.extend(self.remove_stream(source_id))
+        return events
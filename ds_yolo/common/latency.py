@@ -0,0 +1,177 @@
+import bisect
+import collections
+import threading
+
+from loguru import logger
+
+
+# Log-linear buckets: exact below 2 ** SUB_BITS us, then 2 ** (SUB_BITS - 1) buckets per
+# power of two (at most ~3% relative error), values clamped at 2 ** MAX_BITS us (~19 hours).
+SUB_BITS = 6
+MAX_BITS = 36
+SUB_COUNT = 1 << SUB_BITS
+HALF_COUNT = SUB_COUNT >> 1
+NUM_BUCKETS = SUB_COUNT + (MAX_BITS - SUB_BITS) * HALF_COUNT
+MAX_VALUE = (1 << MAX_BITS) - 1
+
+PERCENTILES = (50, 95, 99)
+
+
+def bucket_index(value):
+    """
+    Bucket of a non-negative integer microsecond value
+    """
+    if value < SUB_COUNT:
+        return value
+    shift = value.bit_length() - SUB_BITS
+    return SUB_COUNT + (shift - 1) * HALF_COUNT + (value >> shift) - HALF_COUNT
+
+
+def bucket_value(index):
+    """
+    Middle of the value range of a bucket
+    """
+    if index < SUB_COUNT:
+        return index
+    shift, sub = divmod(index - SUB_COUNT, HALF_COUNT)
+    shift += 1
+    low = (sub + HALF_COUNT) << shift
+    return low + ((1 << shift) >> 1)
+
+
+class LatencyHistogram:
+    """
+    HDR style histogram of latencies in microseconds. Recording is a few integer
+    operations and a list increment, cheap enough for pad probes.
+    """
+    def __init__(self):
+        self.counts = [0] * NUM_BUCKETS
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def record(self, seconds):
+        value = min(max(int(seconds * 1e6), 0), MAX_VALUE)
+        self.counts[bucket_index(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        if not self.count:
+            return 0
+        rank = max(1, int(round(self.count * percent / 100.0)))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bucket_value(index), self.max)
+        return self.max
+
+    def cumulative_counts(self, bounds):
+        """
+        Number of values <= each of the ascending microsecond `bounds`, by bucket middle
+        """
+        result = [0] * len(bounds)
+        for index, count in enumerate(self.counts):
+            if count:
+                value = bucket_value(index)
+                position = bisect.bisect_left(bounds, value)
+                if position < len(bounds):
+                    result[position] += count
+        for i in range(1, len(result)):
+            result[i] += result[i - 1]
+        return result
+
+    def merge(self, other):
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def summary(self):
+        """
+        count, mean, p50/p95/p99 and max in microseconds
+        """
+        result = {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+        }
+        for percent in PERCENTILES:
+            result[f"p{percent}"] = self.percentile(percent)
+        result["max"] = self.max
+        return result
+
+
+class LatencyTracker:
+    """
+    Per-stage, per-stream latency histograms for the pipeline.
+    A frame is identified by (stream id, buffer pts): `start` stamps it when it enters
+    the streammux, every following pad calls `lap` which records the time since the
+    previous stamp under its stage, and the last pad calls `finish` which also
+    records the end-to-end "total". At most `max_pending` frames are tracked, the
+    oldest stamps are evicted first (e.g. frames dropped before the sink).
+    """
+    def __init__(self, max_pending=4096):
+        self.max_pending = max_pending
+        self.histograms = {}
+        self.overhead = LatencyHistogram()
+        self.evicted = 0
+        self._pending = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def histogram(self, stage, stream):
+        key = (stage, stream)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms.setdefault(key, LatencyHistogram())
+        return histogram
+
+    def record(self, stage, stream, seconds):
+        # batch level stages are recorded from the probe and the postprocess workers at once
+        with self._lock:
+            self.histogram(stage, stream).record(seconds)
+
+    def record_overhead(self, seconds):
+        # the latency probes run on the streaming threads of several pads
+        with self._lock:
+            self.overhead.record(seconds)
+
+    def start(self, stream, pts, now):
+        with self._lock:
+            self._pending[(stream, pts)] = [now, now]
+            if len(self._pending) > self.max_pending:
+                self._pending.popitem(last=False)
+                self.evicted += 1
+
+    def lap(self, stream, pts, stage, now, finish=False):
+        with self._lock:
+            stamps = self._pending.pop((stream, pts), None) if finish else self._pending.get((stream, pts))
+            if stamps is None:
+                return
+            self.histogram(stage, stream).record(now - stamps[1])
+            stamps[1] = now
+            if finish:
+                self.histogram("total", stream).record(now - stamps[0])
+
+    def summaries(self):
+        """
+        {(stage, stream): summary} of all histograms, plus ("probe_overhead", None)
+        """
+        result = {key: histogram.summary() for key, histogram in sorted(
+            list(self.histograms.items()), key=lambda item: (str(item[0][0]), str(item[0][1])))}
+        result[("probe_overhead", None)] = self.overhead.summary()
+        return result
+
+    def report(self):
+        lines = ["[INFO] latency (us): stage stream count mean p50 p95 p99 max"]
+        for (stage, stream), summary in self.summaries().items():
+            lines.append(
+                f"{stage:>14} {'-' if stream is None else stream:>6} {summary['count']:>8} {summary['mean']:>9.1f} "
+                f"{summary['p50']:>8} {summary['p95']:>8} {summary['p99']:>8} {summary['max']:>8}")
+        if self.evicted:
+            lines.append(f"evicted frames: {self.evicted}")
+        logger.info("\n".join(lines))
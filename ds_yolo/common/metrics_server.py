@@ -0,0 +1,182 @@
+import collections
+import socketserver
+import threading
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from loguru import logger
+
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Prometheus histogram bucket bounds for latencies, in seconds
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# A metric family produced by a collector. `samples` are (labels dict, value) pairs; for
+# histograms the value is a common.latency.LatencyHistogram.
+MetricFamily = collections.namedtuple("MetricFamily", ["name", "type", "help", "samples"])
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    items = ",".join(
+        '{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for key, value in labels.items())
+    return "{" + items + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """
+    Counter or gauge with a fixed tuple of label names. Values are kept per tuple of
+    label values, writers pass that tuple positionally to stay cheap in pad probes.
+    """
+    type = None
+
+    def __init__(self, name, help, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def collect(self):
+        with self._lock:
+            values = list(self._values.items())
+        return MetricFamily(
+            self.name, self.type, self.help,
+            [(dict(zip(self.label_names, label_values)), value) for label_values, value in values])
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, value=1, label_values=()):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + value
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def set(self, value, label_values=()):
+        with self._lock:
+            self._values[label_values] = value
+
+
+class MetricsRegistry:
+    """
+    Counters and gauges updated by the pipeline, plus collectors called at scrape time
+    that return MetricFamily lists (e.g. from ThroughputMeter and LatencyTracker).
+    """
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def counter(self, name, help, label_names=()):
+        return self._register(Counter(name, help, label_names))
+
+    def gauge(self, name, help, label_names=()):
+        return self._register(Gauge(name, help, label_names))
+
+    def _register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def collect(self):
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        families = [metric.collect() for metric in metrics]
+        for collector in collectors:
+            try:
+                families.extend(collector())
+            except Exception as ex:
+                logger.error(f"ERROR: metrics collector failed: {ex}")
+        return families
+
+    def render(self):
+        """
+        All metrics in the Prometheus text exposition format
+        """
+        lines = []
+        for family in self.collect():
+            lines.append(f"# HELP {family.name} {family.help}")
+            lines.append(f"# TYPE {family.name} {family.type}")
+            for labels, value in family.samples:
+                if family.type == "histogram":
+                    lines.extend(self._render_histogram(family.name, labels, value))
+                else:
+                    lines.append(f"{family.name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def _render_histogram(self, name, labels, histogram):
+        bounds = LATENCY_BUCKETS + (float("inf"),)
+        lines = []
+        for bound, count in zip(bounds, histogram.cumulative_counts([bound * 1e6 for bound in bounds])):
+            bucket_labels = dict(labels, le=_format_value(bound))
+            lines.append(f"{name}_bucket{_format_labels(bucket_labels)} {count}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram.total / 1e6)}")
+        lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+        return lines
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MetricsServer:
+    """
+    Serve `registry` at http://host:port/metrics from a background thread.
+    Port 0 picks a free port, see `port` after `start`.
+    """
+    def __init__(self, registry, host="127.0.0.1", port=9101):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._httpd = None
+        self._thread = None
+
+    def start(self):
+        registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logger.debug("metrics: " + format % args)
+
+        self._httpd = _ThreadingHTTPServer((self.host, self.port), Handler)
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="metrics-server", daemon=True)
+        self._thread.start()
+        logger.info(f"Serving metrics at http://{self.host}:{self.port}/metrics")
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+            self._thread.join()
+            self._thread = None
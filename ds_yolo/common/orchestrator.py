@@ -0,0 +1,340 @@
+import collections
+import os
+import re
+import socketserver
+import subprocess
+import threading
+import time
+import urllib.request
+
+from loguru import logger
+
+from common.metrics_server import MetricFamily, MetricsRegistry, _format_labels
+from common.result_dispatch import ResultDispatcher
+from common.sinks import DetectionRecord, read_msgpack_records
+
+
+WORKER_STATES = ("starting", "up", "backoff", "done", "down")
+
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def shard_round_robin(fps, num_workers):
+    """
+    Source i goes to worker i % num_workers
+    """
+    return [list(range(worker, len(fps), num_workers)) for worker in range(num_workers)]
+
+
+def shard_by_fps(fps, num_workers):
+    """
+    Balance the expected FPS: sources from the fastest down go to the least loaded worker
+    """
+    shards = [[] for _ in range(num_workers)]
+    loads = [0.0] * num_workers
+    for source in sorted(range(len(fps)), key=lambda source: fps[source], reverse=True):
+        worker = loads.index(min(loads))
+        shards[worker].append(source)
+        loads[worker] += fps[source]
+    return [sorted(shard) for shard in shards]
+
+
+# name: function(expected fps of every source, number of workers) -> source indices per worker
+SHARDING_STRATEGIES = {
+    "round_robin": shard_round_robin,
+    "fps": shard_by_fps,
+}
+
+
+def make_shards(strategy, fps, num_workers):
+    """
+    Split the sources of expected FPS `fps` over at most `num_workers` workers with the
+    sharding strategy `strategy`, a name of SHARDING_STRATEGIES or a function. Workers
+    left without sources are dropped.
+    """
+    if not callable(strategy):
+        if strategy not in SHARDING_STRATEGIES:
+            raise ValueError(f"Unknown sharding strategy {strategy}, expected one of {tuple(SHARDING_STRATEGIES)}")
+        strategy = SHARDING_STRATEGIES[strategy]
+    shards = [list(shard) for shard in strategy(fps, num_workers) if shard]
+    assigned = sorted(source for shard in shards for source in shard)
+    if assigned != list(range(len(fps))):
+        raise ValueError("Sharding must assign every source to exactly one worker")
+    return shards
+
+
+def parse_metrics(text):
+    """
+    {family name: (help, type, [(sample name, labels dict, value string)])} of a Prometheus
+    text exposition, in the order of the text
+    """
+    families = collections.OrderedDict()
+    family = None
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("#"):
+            parts = line.split(None, 3)
+            if len(parts) >= 3 and parts[1] in ("HELP", "TYPE"):
+                name = parts[2]
+                help, type, samples = families.get(name, ("", "untyped", []))
+                if parts[1] == "HELP":
+                    help = parts[3] if len(parts) > 3 else ""
+                else:
+                    type = parts[3] if len(parts) > 3 else "untyped"
+                families[name] = (help, type, samples)
+                family = name
+            continue
+        if "{" in line:
+            name, rest = line.split("{", 1)
+            label_text, value = rest.rsplit("}", 1)
+            labels = collections.OrderedDict(
+                (key, re.sub(r"\\(.)", lambda match: "\n" if match.group(1) == "n" else match.group(1), raw))
+                for key, raw in _LABEL.findall(label_text))
+        else:
+            name, value = line.split(None, 1)
+            labels = collections.OrderedDict()
+        value = value.split()[0]
+        if family is None or not name.startswith(family):
+            family = name
+            families.setdefault(name, ("", "untyped", []))
+        families[family][2].append((name, labels, value))
+    return families
+
+
+class WorkerProcess:
+    """
+    One pipeline worker process running the sources `source_ids` (global indices) of the
+    orchestrator, restarted with exponential backoff from `backoff_initial` up to
+    `backoff_max` seconds when it fails. The backoff starts over once a worker ran for
+    `backoff_max` seconds. A worker exiting with status 0 is done (its files ended), one
+    that failed `max_restarts` times in a row (0: no limit) is down.
+    """
+    def __init__(
+        self, index, source_ids, command, socket_path, metrics_port=0,
+        backoff_initial=1.0, backoff_max=60.0, max_restarts=0, clock=time.monotonic):
+        self.index = index
+        self.source_ids = source_ids
+        self.command = command
+        self.socket_path = socket_path
+        self.metrics_port = metrics_port
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.max_restarts = max_restarts
+        self.clock = clock
+
+        self.state = "starting"
+        self.process = None
+        self.restarts = 0
+        self.failures = 0
+        self.records = 0
+        self.started = None
+        self.last_record = None
+        self.retry_at = None
+
+    def start(self):
+        logger.info(f"[INFO] Worker {self.index}: starting sources {self.source_ids}")
+        self.process = subprocess.Popen(self.command)
+        self.state = "up"
+        self.started = self.last_record = self.clock()
+
+    def poll(self):
+        """
+        Restart the worker if it failed and its backoff passed, return its state
+        """
+        now = self.clock()
+        if self.state == "backoff" and now >= self.retry_at:
+            self.restarts += 1
+            self.start()
+        elif self.state == "up" and self.process.poll() is not None:
+            self._exited(self.process.returncode, now)
+        return self.state
+
+    def _exited(self, returncode, now):
+        if returncode == 0:
+            logger.info(f"[INFO] Worker {self.index}: finished")
+            self.state = "done"
+            return
+        if now - self.started >= self.backoff_max:
+            self.failures = 0
+        self.failures += 1
+        if self.max_restarts and self.failures > self.max_restarts:
+            logger.error(f"ERROR: Worker {self.index}: exited with {returncode}, giving up after {self.max_restarts} restarts")
+            self.state = "down"
+            return
+        delay = min(self.backoff_initial * 2 ** (self.failures - 1), self.backoff_max)
+        logger.warning(f"WARNING: Worker {self.index}: exited with {returncode}, restarting in {delay:.1f} s")
+        self.state = "backoff"
+        self.retry_at = now + delay
+
+    def kill(self, reason):
+        """
+        Kill a running worker, it is restarted like a crashed one
+        """
+        if self.state == "up" and self.process.poll() is None:
+            logger.warning(f"WARNING: Worker {self.index}: {reason}, killing it")
+            self.process.kill()
+
+    def stop(self):
+        """
+        Ask a running worker to flush its output and exit, see `join`
+        """
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+
+    def join(self, timeout=10.0):
+        if self.process is not None:
+            try:
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+
+class _UnixStreamServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class Orchestrator:
+    """
+    Supervise the WorkerProcesses and merge their output: every worker sends its detections
+    over its own Unix socket (the msgpack sink), the records are renumbered from the local
+    source ids of the worker to the global ones and written to `sink` by a single writer
+    thread. `render` serves the merged metrics: the worker metrics scraped from their
+    metrics ports with worker and global source labels, plus the orchestrator's own.
+    A worker that sent no detections for `stall_timeout` seconds (0: off) is restarted.
+    """
+    def __init__(
+        self, workers, sink, result_queue_size=4096, stall_timeout=0.0, poll_interval=0.5,
+        scrape_timeout=2.0, clock=time.monotonic):
+        self.workers = workers
+        self.sink = sink
+        self.stall_timeout = stall_timeout
+        self.poll_interval = poll_interval
+        self.scrape_timeout = scrape_timeout
+        self.clock = clock
+        self.dispatcher = ResultDispatcher(sink.write, on_idle=sink.tick, max_records=result_queue_size)
+        self.registry = MetricsRegistry()
+        self.registry.add_collector(self.collect_metrics)
+        self.scrape_errors = 0
+        self._servers = []
+        self._stopping = threading.Event()
+
+    def remap(self, worker, record):
+        """
+        `record` of `worker` with the global source id
+        """
+        source_id = worker.source_ids[record.source_id]
+        detections = record.detections
+        detections.source_ids[:] = source_id
+        return DetectionRecord(record.frame_num, source_id, record.timestamp, detections)
+
+    def _serve(self, worker):
+        orchestrator = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                try:
+                    for record in read_msgpack_records(self.rfile):
+                        orchestrator.dispatcher.push(orchestrator.remap(worker, record))
+                        worker.records += 1
+                        worker.last_record = orchestrator.clock()
+                except Exception as ex:
+                    logger.error(f"ERROR: Worker {worker.index}: bad detection stream: {ex}")
+
+        if os.path.exists(worker.socket_path):
+            os.unlink(worker.socket_path)
+        server = _UnixStreamServer(worker.socket_path, Handler)
+        thread = threading.Thread(target=server.serve_forever, name=f"worker-{worker.index}-results", daemon=True)
+        thread.start()
+        self._servers.append((server, thread))
+
+    def run(self):
+        """
+        Start the workers and supervise them until all are done or down, or `stop`.
+        Return 1 if a worker was left down, else 0.
+        """
+        self.dispatcher.start()
+        for worker in self.workers:
+            self._serve(worker)
+            worker.start()
+        try:
+            while not self._stopping.wait(self.poll_interval):
+                states = [worker.poll() for worker in self.workers]
+                if all(state in ("done", "down") for state in states):
+                    break
+                if self.stall_timeout > 0:
+                    now = self.clock()
+                    for worker in self.workers:
+                        if worker.state == "up" and now - worker.last_record > self.stall_timeout:
+                            worker.kill(f"no detections for {now - worker.last_record:.1f} s")
+        finally:
+            for worker in self.workers:
+                worker.stop()
+            for worker in self.workers:
+                worker.join()
+            for server, thread in self._servers:
+                server.shutdown()
+                server.server_close()
+                thread.join()
+                os.unlink(server.server_address)
+            self._servers = []
+            self.dispatcher.stop()
+            self.sink.close()
+        return 1 if any(worker.state == "down" for worker in self.workers) else 0
+
+    def stop(self):
+        self._stopping.set()
+
+    def scrape(self, worker):
+        url = f"http://127.0.0.1:{worker.metrics_port}/metrics"
+        with urllib.request.urlopen(url, timeout=self.scrape_timeout) as response:
+            return parse_metrics(response.read().decode("utf-8"))
+
+    def render(self):
+        """
+        Orchestrator and worker metrics in the Prometheus text exposition format
+        """
+        merged = collections.OrderedDict()
+        for worker in self.workers:
+            if not worker.metrics_port or worker.state != "up":
+                continue
+            try:
+                families = self.scrape(worker)
+            except Exception as ex:
+                self.scrape_errors += 1
+                logger.debug(f"Worker {worker.index}: metrics scrape failed: {ex}")
+                continue
+            for name, (help, type, samples) in families.items():
+                family = merged.setdefault(name, (help, type, []))
+                for sample_name, labels, value in samples:
+                    labels["worker"] = worker.index
+                    if "source" in labels and labels["source"].isdigit() and int(labels["source"]) < len(worker.source_ids):
+                        labels["source"] = worker.source_ids[int(labels["source"])]
+                    family[2].append((sample_name, labels, value))
+
+        lines = [self.registry.render().rstrip("\n")]
+        for name, (help, type, samples) in merged.items():
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {type}")
+            lines.extend(f"{sample_name}{_format_labels(labels)} {value}" for sample_name, labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+    def collect_metrics(self):
+        workers = self.workers
+        return [
+            MetricFamily("ds_worker_state", "gauge", "Worker process state (1 for the current state)",
+                         [({"worker": worker.index, "state": state}, int(worker.state == state))
+                          for worker in workers for state in WORKER_STATES]),
+            MetricFamily("ds_worker_restarts_total", "counter", "Worker process restarts",
+                         [({"worker": worker.index}, worker.restarts) for worker in workers]),
+            MetricFamily("ds_worker_sources", "gauge", "Sources assigned to the worker",
+                         [({"worker": worker.index}, len(worker.source_ids)) for worker in workers]),
+            MetricFamily("ds_worker_records_total", "counter", "Detection records received from the worker",
+                         [({"worker": worker.index}, worker.records) for worker in workers]),
+            MetricFamily("ds_merged_results_dropped_total", "counter", "Merged records dropped by the result queue",
+                         [({}, self.dispatcher.dropped)]),
+            MetricFamily("ds_worker_scrape_errors_total", "counter", "Failed worker metrics scrapes",
+                         [({}, self.scrape_errors)]),
+        ]
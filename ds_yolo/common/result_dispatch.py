@@ -0,0 +1,162 @@
+import collections
+import threading
+
+from loguru import logger
+
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+BLOCK = "block"
+POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+# a function queued with `call`, run by the writer thread in order with the records
+_Call = collections.namedtuple("_Call", ("func", "args"))
+
+
+class ResultDispatcher:
+    """
+    Hands detection records from the GStreamer streaming thread to a background writer.
+    The probe only appends a compact record to a bounded ring; the writer thread
+    batches the records, serializes them with `serialize` if given and passes the
+    batch to `emit`. `on_idle` is called when a flush interval passes without records.
+
+    When the ring is full, `policy` decides:
+        drop_oldest: discard the oldest queued record (default)
+        drop_newest: discard the record being pushed
+        block: wait until the writer makes room
+    """
+    def __init__(
+        self,
+        emit,
+        serialize=None,
+        on_idle=None,
+        max_records=1024,
+        policy=DROP_OLDEST,
+        batch_size=64,
+        flush_interval=0.5):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown result policy {policy}, expected one of {POLICIES}")
+        self.serialize = serialize
+        self.emit = emit
+        self.on_idle = on_idle
+        self.max_records = max_records
+        self.policy = policy
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.pushed = 0
+        self.dropped = 0
+        self.emitted = 0
+        self.errors = 0
+
+        self._records = collections.deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(target=self._run, name="result-dispatcher", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Flush the queued records and stop the writer thread
+        """
+        with self._lock:
+            self._running = False
+            self._not_empty.notify_all()
+            self._not_full.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        logger.info(
+            f"[INFO] results pushed: {self.pushed}, emitted: {self.emitted}, "
+            f"dropped: {self.dropped}, errors: {self.errors}")
+
+    def push(self, record):
+        """
+        Queue a record, return False if it was dropped
+        """
+        with self._lock:
+            if len(self._records) >= self.max_records:
+                if self.policy == DROP_OLDEST:
+                    self._drop_oldest()
+                    self.dropped += 1
+                elif self.policy == DROP_NEWEST or not self._running:
+                    self.dropped += 1
+                    return False
+                else:
+                    while len(self._records) >= self.max_records and self._running:
+                        self._not_full.wait()
+            self._records.append(record)
+            self.pushed += 1
+            if len(self._records) >= self.batch_size:
+                self._not_empty.notify()
+        return True
+
+    def call(self, func, *args):
+        """
+        Run `func(*args)` on the writer thread once the records queued before it are
+        emitted, e.g. to reset sink state between two records. Calls are never dropped.
+        """
+        with self._lock:
+            self._records.append(_Call(func, args))
+            self._not_empty.notify()
+
+    def _drop_oldest(self):
+        for index, queued in enumerate(self._records):
+            if not isinstance(queued, _Call):
+                del self._records[index]
+                return
+
+    def pending(self):
+        return len(self._records)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if self._running and len(self._records) < self.batch_size:
+                    self._not_empty.wait(self.flush_interval)
+                records = list(self._records)
+                self._records.clear()
+                self._not_full.notify_all()
+                running = self._running
+            if records:
+                self._write(records)
+            elif not running:
+                break
+            elif self.on_idle is not None:
+                self._call(self.on_idle)
+
+    def _write(self, records):
+        start = 0
+        for index, record in enumerate(records):
+            if isinstance(record, _Call):
+                self._emit(records[start: index])
+                self._call(record.func, *record.args)
+                start = index + 1
+        self._emit(records[start:] if start else records)
+
+    def _emit(self, records):
+        if not records:
+            return
+        if self.serialize is not None:
+            records = [self.serialize(record) for record in records]
+        if self._call(self.emit, records):
+            self.emitted += len(records)
+        else:
+            self.errors += len(records)
+
+    def _call(self, func, *args):
+        try:
+            func(*args)
+            return True
+        except Exception as ex:
+            logger.error(f"ERROR: result dispatch failed: {ex}")
+            return False
@@ -0,0 +1,431 @@
+import collections
+import datetime
+import json
+import os
+import socket
+import struct
+import time
+
+import numpy as np
+
+from loguru import logger
+
+from common.events import EventAggregator
+from postprocess.detections import Detections
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+# One frame of results as handed from the pgie probe to the sinks
+DetectionRecord = collections.namedtuple("DetectionRecord", ["frame_num", "source_id", "timestamp", "detections"])
+
+SINK_TYPES = ("log", "jsonl", "msgpack", "parquet", "events")
+
+
+def record_to_dict(record, label_names):
+    """
+    JSON serializable dict of a DetectionRecord
+    """
+    result = {
+        "frame_num": record.frame_num,
+        "source_id": record.source_id,
+        "timestamp": record.timestamp,
+    }
+    result.update(record.detections.to_dict(label_names))
+    return result
+
+
+class DetectionSink:
+    """
+    Base of the detection sinks. ResultDispatcher hands DetectionRecord batches to `write`,
+    the sink buffers them and flushes once `flush_bytes` are buffered or `flush_interval`
+    seconds passed since the last flush, so there is no syscall per frame.
+    Subclasses implement `_buffer` (returns the bytes it added) and `_flush`.
+    """
+    def __init__(self, label_names, flush_bytes=1 << 20, flush_interval=1.0):
+        self.label_names = label_names
+        self.flush_bytes = flush_bytes
+        self.flush_interval = flush_interval
+        self.records_written = 0
+        self._buffered_bytes = 0
+        self._buffered_records = 0
+        self._last_flush = time.monotonic()
+
+    def write(self, records):
+        self._buffered_bytes += self._buffer(records)
+        self._buffered_records += len(records)
+        self.tick()
+
+    def tick(self):
+        """
+        Flush when the size or time limit is reached, also called by the dispatcher when idle
+        """
+        if not self._buffered_records:
+            return
+        if self._buffered_bytes >= self.flush_bytes or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self._buffered_records:
+            self._flush()
+            self.records_written += self._buffered_records
+        self._buffered_bytes = 0
+        self._buffered_records = 0
+        self._last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self._close()
+        logger.info(f"[INFO] {type(self).__name__} records written: {self.records_written}")
+
+    def remove_source(self, source_id):
+        """
+        Forget the per-stream state of a source detached at runtime
+        """
+        pass
+
+    def _buffer(self, records):
+        raise NotImplementedError
+
+    def _flush(self):
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+
+class LogSink(DetectionSink):
+    """
+    Log every frame result, one log call per dispatched batch
+    """
+    def __init__(self, label_names):
+        super().__init__(label_names, flush_bytes=0)
+        self._lines = []
+
+    def _buffer(self, records):
+        for record in records:
+            ensemble_results = {
+                "frame_%s"%record.frame_num: record.detections.to_dict(self.label_names)
+            }
+            self._lines.append(f"--> ensemble_result: {ensemble_results}")
+        return len(records)
+
+    def _flush(self):
+        logger.info("\n".join(self._lines))
+        self._lines = []
+
+
+class RotatingFileSink(DetectionSink):
+    """
+    File sink that starts a new file in `directory` once the current one reaches
+    `rotate_bytes` or is older than `rotate_interval` seconds.
+    """
+    extension = ""
+
+    def __init__(
+        self, label_names, directory, prefix="detections",
+        flush_bytes=1 << 20, flush_interval=1.0,
+        rotate_bytes=256 << 20, rotate_interval=3600.0):
+        super().__init__(label_names, flush_bytes, flush_interval)
+        self.directory = directory
+        self.prefix = prefix
+        self.rotate_bytes = rotate_bytes
+        self.rotate_interval = rotate_interval
+        self.path = None
+        self._file_index = 0
+        self._file_bytes = 0
+        self._file_opened = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def _next_path(self):
+        stamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        self._file_index += 1
+        return os.path.join(self.directory, f"{self.prefix}_{stamp}_{self._file_index:05d}{self.extension}")
+
+    def _flush(self):
+        if self.path is not None and (
+                self._file_bytes >= self.rotate_bytes
+                or time.monotonic() - self._file_opened >= self.rotate_interval):
+            self._close()
+        if self.path is None:
+            self.path = self._next_path()
+            self._file_bytes = 0
+            self._file_opened = time.monotonic()
+            self._open()
+            logger.info(f"Writing detections to {self.path}")
+        self._file_bytes += self._write_buffer()
+
+    def _close(self):
+        if self.path is not None:
+            self._close_file()
+            self.path = None
+
+    def _open(self):
+        raise NotImplementedError
+
+    def _write_buffer(self):
+        raise NotImplementedError
+
+    def _close_file(self):
+        raise NotImplementedError
+
+
+class JsonLinesSink(RotatingFileSink):
+    """
+    One JSON object per frame and line, written in buffered chunks
+    """
+    extension = ".jsonl"
+
+    def __init__(self, label_names, directory, **kwargs):
+        super().__init__(label_names, directory, **kwargs)
+        self._chunks = []
+        self._file = None
+
+    def _buffer(self, records):
+        chunk = "".join(json.dumps(record_to_dict(record, self.label_names)) + "\n" for record in records)
+        chunk = chunk.encode("utf-8")
+        self._chunks.append(chunk)
+        return len(chunk)
+
+    def _open(self):
+        self._file = open(self.path, "ab")
+
+    def _write_buffer(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        self._file.write(data)
+        self._file.flush()
+        return len(data)
+
+    def _close_file(self):
+        self._file.close()
+        self._file = None
+
+
+class EventSink(JsonLinesSink):
+    """
+    Per-stream start/update/end events instead of per-frame results, one JSON object per
+    event and line. `records_written` counts events.
+    """
+    def __init__(self, label_names, directory, aggregator=None, **kwargs):
+        super().__init__(label_names, directory, prefix="events", **kwargs)
+        self.aggregator = aggregator if aggregator is not None else EventAggregator(label_names)
+
+    def _add_events(self, events):
+        if not events:
+            return
+        chunk = "".join(json.dumps(event) + "\n" for event in events).encode("utf-8")
+        self._chunks.append(chunk)
+        self._buffered_bytes += len(chunk)
+        self._buffered_records += len(events)
+
+    def write(self, records):
+        self._add_events(self.aggregator.process(records))
+        self.tick()
+
+    def remove_source(self, source_id):
+        # a later source reusing the id starts without tracks
+        self._add_events(self.aggregator.remove_stream(source_id))
+        self.tick()
+
+    def tick(self):
+        # tracks of streams that stopped sending are closed on the clock of the others
+        self._add_events(self.aggregator.expire())
+        super().tick()
+
+    def close(self):
+        self._add_events(self.aggregator.finish())
+        super().close()
+
+
+class ParquetSink(RotatingFileSink):
+    """
+    Columnar Parquet files with one row per detection, one row group per flush.
+    Frames without detections produce no rows. Needs pyarrow.
+    """
+    extension = ".parquet"
+
+    def __init__(self, label_names, directory, **kwargs):
+        if pa is None:
+            raise ImportError("ParquetSink needs pyarrow, install it with `pip3 install pyarrow`")
+        super().__init__(label_names, directory, **kwargs)
+        self._names = np.asarray(label_names, dtype=object)
+        self._columns = collections.defaultdict(list)
+        self._writer = None
+        self.schema = pa.schema([
+            ("frame_num", pa.int64()),
+            ("source_id", pa.int32()),
+            ("timestamp", pa.float64()),
+            ("class_id", pa.int32()),
+            ("label", pa.string()),
+            ("score", pa.float32()),
+            ("x1", pa.float32()),
+            ("y1", pa.float32()),
+            ("x2", pa.float32()),
+            ("y2", pa.float32()),
+        ])
+
+    def _buffer(self, records):
+        num_bytes = 0
+        for record in records:
+            detections = record.detections
+            num_rows = len(detections)
+            if not num_rows:
+                continue
+            self._columns["frame_num"].append(np.full(num_rows, record.frame_num, dtype=np.int64))
+            self._columns["source_id"].append(np.full(num_rows, record.source_id, dtype=np.int32))
+            self._columns["timestamp"].append(np.full(num_rows, record.timestamp, dtype=np.float64))
+            self._columns["class_id"].append(detections.class_ids)
+            self._columns["score"].append(detections.scores)
+            self._columns["boxes"].append(detections.boxes)
+            num_bytes += num_rows * 40
+        return num_bytes
+
+    def _open(self):
+        self._writer = pq.ParquetWriter(self.path, self.schema)
+
+    def _write_buffer(self):
+        if not self._columns:
+            return 0
+        columns = {name: np.concatenate(arrays) for name, arrays in self._columns.items()}
+        self._columns.clear()
+        boxes = columns.pop("boxes")
+        columns["label"] = self._names[columns["class_id"]]
+        for i, name in enumerate(("x1", "y1", "x2", "y2")):
+            columns[name] = boxes[:, i]
+        table = pa.Table.from_pydict(columns, schema=self.schema)
+        self._writer.write_table(table)
+        return table.nbytes
+
+    def _close_file(self):
+        self._writer.close()
+        self._writer = None
+
+
+class MsgpackSocketSink(DetectionSink):
+    """
+    Length-prefixed msgpack messages over a Unix domain socket, one message per frame:
+    a little-endian uint32 payload size followed by a msgpack map with frame_num,
+    source_id, timestamp and raw little-endian arrays class_ids (int32),
+    scores (float32) and boxes (float32, N x 4). Needs msgpack.
+    Batches are dropped while the socket is down, reconnecting at most every
+    `reconnect_interval` seconds.
+    """
+    def __init__(
+        self, label_names, socket_path,
+        flush_bytes=256 << 10, flush_interval=0.2, reconnect_interval=1.0):
+        if msgpack is None:
+            raise ImportError("MsgpackSocketSink needs msgpack, install it with `pip3 install msgpack`")
+        super().__init__(label_names, flush_bytes, flush_interval)
+        self.socket_path = socket_path
+        self.reconnect_interval = reconnect_interval
+        self.dropped = 0
+        self._messages = []
+        self._socket = None
+        self._last_connect = None
+
+    def _buffer(self, records):
+        num_bytes = 0
+        for record in records:
+            detections = record.detections
+            payload = msgpack.packb({
+                "frame_num": record.frame_num,
+                "source_id": record.source_id,
+                "timestamp": record.timestamp,
+                "class_ids": detections.class_ids.astype("<i4").tobytes(),
+                "scores": detections.scores.astype("<f4").tobytes(),
+                "boxes": detections.boxes.astype("<f4").tobytes(),
+            }, use_bin_type=True)
+            self._messages.append(struct.pack("<I", len(payload)))
+            self._messages.append(payload)
+            num_bytes += 4 + len(payload)
+        return num_bytes
+
+    def _connect(self):
+        now = time.monotonic()
+        if self._last_connect is not None and now - self._last_connect < self.reconnect_interval:
+            return False
+        self._last_connect = now
+        try:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.connect(self.socket_path)
+            logger.info(f"Sending detections to {self.socket_path}")
+            return True
+        except OSError as ex:
+            logger.warning(f"WARNING: Unable to connect to {self.socket_path}: {ex}")
+            self._close()
+            return False
+
+    def _flush(self):
+        data = b"".join(self._messages)
+        self._messages = []
+        if self._socket is None and not self._connect():
+            self.dropped += self._buffered_records
+            return
+        try:
+            self._socket.sendall(data)
+        except OSError as ex:
+            logger.warning(f"WARNING: Sending detections to {self.socket_path} failed: {ex}")
+            self.dropped += self._buffered_records
+            self._close()
+
+    def _close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+def read_msgpack_records(stream):
+    """
+    DetectionRecords of the MsgpackSocketSink messages read from the file object `stream`
+    until it is closed. Boxes are in source resolution, the frame size is not sent.
+    """
+    if msgpack is None:
+        raise ImportError("Reading msgpack detections needs msgpack, install it with `pip3 install msgpack`")
+    while True:
+        header = stream.read(4)
+        if len(header) < 4:
+            return
+        payload = stream.read(struct.unpack("<I", header)[0])
+        message = msgpack.unpackb(payload, raw=False)
+        class_ids = np.frombuffer(message["class_ids"], dtype="<i4")
+        detections = Detections.from_columns(
+            np.frombuffer(message["boxes"], dtype="<f4"), np.frombuffer(message["scores"], dtype="<f4"), class_ids,
+            np.zeros(len(class_ids), dtype=np.int32), [(0, 0)], [message["source_id"]])
+        yield DetectionRecord(message["frame_num"], message["source_id"], message["timestamp"], detections)
+
+
+def make_sink(
+    sink_type, label_names, path=None, flush_interval=1.0, rotate_bytes=256 << 20, rotate_interval=3600.0,
+    event_options=None):
+    """
+    Create a detection sink by type: log, jsonl, msgpack, parquet or events.
+    `path` is the output directory of the file sinks and the socket path of msgpack.
+    `event_options` are EventAggregator keyword arguments of the events sink.
+    """
+    if sink_type == "events":
+        return EventSink(
+            label_names, path or "./events", aggregator=EventAggregator(label_names, **(event_options or {})),
+            flush_interval=flush_interval, rotate_bytes=rotate_bytes, rotate_interval=rotate_interval)
+    if sink_type == "log":
+        return LogSink(label_names)
+    if sink_type in ("jsonl", "parquet"):
+        sink_class = JsonLinesSink if sink_type == "jsonl" else ParquetSink
+        return sink_class(
+            label_names, path or "./detections",
+            flush_interval=flush_interval, rotate_bytes=rotate_bytes, rotate_interval=rotate_interval)
+    if sink_type == "msgpack":
+        if path is None:
+            raise ValueError("msgpack sink needs a Unix socket path")
+        return MsgpackSocketSink(label_names, path, flush_interval=flush_interval)
+    raise ValueError(f"Unknown sink type {sink_type}, expected one of {SINK_TYPES}")
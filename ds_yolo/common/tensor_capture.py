@@ -0,0 +1,185 @@
+import json
+import os
+import struct
+import threading
+
+import numpy as np
+
+from loguru import logger
+
+from common.result_dispatch import DROP_NEWEST, ResultDispatcher
+
+
+# File layout: MAGIC, uint64 committed record count, uint64 header length, json header,
+# zero padding up to HEADER_SIZE, then `capacity` fixed size records.
+MAGIC = b"DSTCAP01"
+HEADER_SIZE = 4096
+_COUNT_OFFSET = len(MAGIC)
+_PREFIX = struct.Struct("<QQ")
+
+
+def record_dtype(tensor_dtype, tensor_shape):
+    """
+    Structured dtype of one captured frame. width and height are the frame size the
+    boxes are scaled to, i.e. the source size (the output video size with --is_save).
+    """
+    return np.dtype([
+        ("frame_num", np.int64),
+        ("source_id", np.int32),
+        ("width", np.int32),
+        ("height", np.int32),
+        ("timestamp", np.float64),
+        ("tensor", np.dtype(tensor_dtype), tuple(tensor_shape)),
+    ], align=True)
+
+
+class TensorCaptureWriter:
+    """
+    Append raw output tensors to a preallocated, memory-mapped record file.
+    `push` runs in the pgie probe and only copies the tensor out of the inference
+    buffer, which is recycled after the probe returns. The copies are written to the
+    file by a ResultDispatcher thread; the record count in the header is updated after
+    every written batch, so a reader sees only complete records.
+    The file is created with the dtype and shape of the first tensor. Frames past
+    `capacity` and tensors of another shape are dropped.
+    """
+    def __init__(self, path, capacity=10000, max_pending=256, layer_name=None):
+        self.path = path
+        self.capacity = capacity
+        self.layer_name = layer_name
+        self.written = 0
+        self.rejected = 0
+        self._records = None
+        self._file = None
+        self._lock = threading.Lock()
+        self.dispatcher = ResultDispatcher(
+            self._write, max_records=max_pending, policy=DROP_NEWEST, batch_size=16, flush_interval=0.2)
+
+    def start(self):
+        self.dispatcher.start()
+
+    def push(self, frame_num, source_id, width, height, timestamp, tensor):
+        return self.dispatcher.push((frame_num, source_id, width, height, timestamp, np.array(tensor)))
+
+    def close(self):
+        self.dispatcher.stop()
+        with self._lock:
+            if self._records is not None:
+                self._records.flush()
+                self._records = None
+                self._file.close()
+                self._file = None
+        logger.info(
+            f"[INFO] captured {self.written} frames to {self.path}, "
+            f"dropped: {self.dispatcher.dropped + self.rejected}")
+
+    def _open(self, tensor):
+        dtype = record_dtype(tensor.dtype, tensor.shape)
+        header = json.dumps({
+            "tensor_dtype": tensor.dtype.str,
+            "tensor_shape": list(tensor.shape),
+            "capacity": self.capacity,
+            "layer": self.layer_name,
+        }).encode("utf-8")
+        if len(header) > HEADER_SIZE - len(MAGIC) - _PREFIX.size:
+            raise ValueError("tensor capture header too large")
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "w+b")
+        self._file.write(MAGIC + _PREFIX.pack(0, len(header)) + header)
+        # preallocate the whole file, sparse until written
+        self._file.truncate(HEADER_SIZE + self.capacity * dtype.itemsize)
+        self._file.flush()
+        self._records = np.memmap(self._file, dtype=dtype, mode="r+", offset=HEADER_SIZE, shape=(self.capacity,))
+        logger.info(f"Capturing {tensor.shape} {tensor.dtype} tensors to {self.path}")
+
+    def _write(self, frames):
+        with self._lock:
+            if self._records is None:
+                self._open(frames[0][-1])
+            records = self._records
+            shape = records.dtype["tensor"].shape
+            start = self.written
+            for frame_num, source_id, width, height, timestamp, tensor in frames:
+                if self.written >= self.capacity:
+                    if not self.rejected:
+                        logger.warning(f"WARNING: tensor capture {self.path} is full ({self.capacity} frames)")
+                    self.rejected += 1
+                    continue
+                if tensor.shape != shape:
+                    self.rejected += 1
+                    continue
+                record = records[self.written]
+                record["frame_num"] = frame_num
+                record["source_id"] = source_id
+                record["width"] = width
+                record["height"] = height
+                record["timestamp"] = timestamp
+                record["tensor"] = tensor
+                self.written += 1
+            if self.written != start:
+                # commit the count once the records are in the page cache
+                self._file.seek(_COUNT_OFFSET)
+                self._file.write(struct.pack("<Q", self.written))
+                self._file.flush()
+
+
+class TensorCaptureReader:
+    """
+    Zero-copy access to a tensor capture file: the tensors and per-frame fields are
+    read-only numpy views over the memory map, e.g. `tensors[i:j]` can be passed to postprocess_batch as is.
+    Only the records committed when the file was opened are visible.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            prefix = f.read(len(MAGIC) + _PREFIX.size)
+            if prefix[:len(MAGIC)] != MAGIC:
+                raise ValueError(f"{path} is not a tensor capture file")
+            count, header_length = _PREFIX.unpack(prefix[len(MAGIC):])
+            self.header = json.loads(f.read(header_length).decode("utf-8"))
+        self.dtype = record_dtype(self.header["tensor_dtype"], self.header["tensor_shape"])
+        self.records = np.memmap(path, dtype=self.dtype, mode="r", offset=HEADER_SIZE, shape=(count,)) \
+            if count else np.empty(0, dtype=self.dtype)
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def tensors(self):
+        return self.records["tensor"]
+
+    @property
+    def frame_nums(self):
+        return self.records["frame_num"]
+
+    @property
+    def source_ids(self):
+        return self.records["source_id"]
+
+    @property
+    def timestamps(self):
+        return self.records["timestamp"]
+
+    @property
+    def image_sizes(self):
+        """
+        (N, 2) width, height pairs
+        """
+        return np.stack([self.records["width"], self.records["height"]], axis=1)
+
+    def batches(self, batch_size=16, start=0, stop=None):
+        """
+        Yield (tensors, image sizes, source ids, frame nums) of consecutive records,
+        the tensors being views over the file
+        """
+        stop = len(self) if stop is None else min(stop, len(self))
+        for begin in range(start, stop, batch_size):
+            records = self.records[begin: min(begin + batch_size, stop)]
+            yield (
+                records["tensor"],
+                np.stack([records["width"], records["height"]], axis=1),
+                records["source_id"],
+                records["frame_num"],
+            )
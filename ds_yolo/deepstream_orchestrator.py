@@ -0,0 +1,108 @@
+import argparse
+import os
+import shlex
+import signal
+import sys
+import tempfile
+
+from loguru import logger
+
+from common.metrics_server import MetricsServer
+from common.orchestrator import SHARDING_STRATEGIES, Orchestrator, WorkerProcess, make_shards
+from common.sinks import SINK_TYPES, make_sink
+from postprocess.labels import get_label_set
+
+
+PIPELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "deepstream_yolo_trt_parser.py")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Split the sources over several Deepstream Triton Yolov5 pipeline processes. "
+                    "Options not listed here are passed to every worker, {worker} is replaced by the worker index.")
+    parser.add_argument("--test_video", help="sources, as for deepstream_yolo_trt_parser.py", type=str, nargs="+", required=True)
+    parser.add_argument("--workers", help="worker processes", type=int, default=2)
+    parser.add_argument(
+        "--sharding", help="Split of the sources over the workers ({})".format("/".join(SHARDING_STRATEGIES)),
+        type=str, default="round_robin")
+    parser.add_argument(
+        "--expected_fps", help="fps sharding: expected FPS of every source, or one value for all", type=float, nargs="+",
+        default=[25.0])
+    parser.add_argument(
+        "--worker_command", help="command of a worker, the pipeline by default, e.g. 'python3 benchmark/mock_worker.py'",
+        type=str, default=f"{sys.executable} {PIPELINE}")
+    parser.add_argument("--label_type", help="Label type (flag/nsfw/horror) or path to a labels.txt or nvinferserver config", type=str, default="flag")
+    parser.add_argument("--sink", help="Merged detection output ({})".format("/".join(SINK_TYPES)), type=str, default="log")
+    parser.add_argument(
+        "--sink_path", help="Output directory of jsonl/parquet/events sinks or Unix socket path of msgpack sink", type=str, default=None)
+    parser.add_argument("--sink_flush_interval", help="Max seconds between sink flushes", type=float, default=1.0)
+    parser.add_argument("--sink_rotate_mb", help="Rotate jsonl/parquet output files at this size (MB)", type=int, default=256)
+    parser.add_argument(
+        "--metrics_port", help="Serve the merged Prometheus metrics at http://127.0.0.1:PORT/metrics (0: off)", type=int, default=0)
+    parser.add_argument(
+        "--worker_metrics_port", help="Metrics port of worker 0, worker i uses PORT + i", type=int, default=9200)
+    parser.add_argument("--restart_backoff", help="Seconds before restarting a failed worker, doubled on every failure", type=float, default=1.0)
+    parser.add_argument("--restart_max_backoff", help="Max seconds between worker restarts", type=float, default=60.0)
+    parser.add_argument(
+        "--restart_max_retries", help="Failures in a row before a worker is left down (0: no limit)", type=int, default=0)
+    parser.add_argument(
+        "--worker_stall_timeout", help="Restart a worker that sent no detections for N seconds (0: off)", type=float, default=0)
+    parser.add_argument("--run_dir", help="Directory of the worker detection sockets, a temporary one by default", type=str, default=None)
+    return parser.parse_known_args(argv)
+
+
+def main(argv=None):
+    args, worker_args = parse_args(argv)
+    sources = args.test_video
+    fps = args.expected_fps * len(sources) if len(args.expected_fps) == 1 else args.expected_fps
+    if len(fps) != len(sources):
+        logger.error(f"ERROR: --expected_fps needs 1 or {len(sources)} values, got {len(fps)}")
+        return 1
+    try:
+        shards = make_shards(args.sharding, fps, args.workers)
+    except ValueError as ex:
+        logger.error(f"ERROR: {ex}")
+        return 1
+
+    run_dir = args.run_dir or tempfile.mkdtemp(prefix="ds_orchestrator_")
+    os.makedirs(run_dir, exist_ok=True)
+    workers = []
+    for index, source_ids in enumerate(shards):
+        socket_path = os.path.join(run_dir, f"worker_{index}.sock")
+        metrics_port = args.worker_metrics_port + index if args.metrics_port > 0 else 0
+        command = shlex.split(args.worker_command) + [arg.replace("{worker}", str(index)) for arg in worker_args]
+        command += ["--test_video"] + [sources[source] for source in source_ids]
+        command += ["--sink", "msgpack", "--sink_path", socket_path, "--label_type", args.label_type]
+        if metrics_port:
+            command += ["--metrics_port", str(metrics_port)]
+        workers.append(WorkerProcess(
+            index, source_ids, command, socket_path, metrics_port, backoff_initial=args.restart_backoff,
+            backoff_max=args.restart_max_backoff, max_restarts=args.restart_max_retries))
+        logger.info(
+            f"[INFO] Worker {index}: {len(source_ids)} sources, expected {sum(fps[source] for source in source_ids):.1f} fps")
+
+    sink = make_sink(
+        args.sink, get_label_set(args.label_type), path=args.sink_path, flush_interval=args.sink_flush_interval,
+        rotate_bytes=args.sink_rotate_mb << 20)
+    orchestrator = Orchestrator(workers, sink, stall_timeout=args.worker_stall_timeout)
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda signum, frame: orchestrator.stop())
+
+    metrics_server = None
+    if args.metrics_port > 0:
+        # the orchestrator renders its own metrics and those scraped from the workers
+        metrics_server = MetricsServer(orchestrator, port=args.metrics_port)
+        metrics_server.start()
+    try:
+        status = orchestrator.run()
+    finally:
+        if metrics_server is not None:
+            metrics_server.stop()
+    for worker in workers:
+        logger.info(
+            f"[INFO] Worker {worker.index}: {worker.state}, {worker.records} records, {worker.restarts} restarts")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
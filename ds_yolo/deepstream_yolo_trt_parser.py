@@ -1,6 +1,7 @@
 import argparse
 import os
 import pyds
+import signal
 import time
 import sys
 
@@ -9,13 +10,17 @@ sys.path.append("../")
 import gi
 
 gi.require_version("Gst", "1.0")
-from gi.repository import GObject, Gst
+from gi.repository import GLib, GObject, Gst
 from loguru import logger
 
 from common.bus_call import bus_call
+from common.control_server import ControlServer
+from common.metrics_server import MetricsRegistry, MetricsServer
 
+from ds_triton_pipeline.batch_controller import BatchController
 from ds_triton_pipeline.pipeline_parts import PipelineParts
-from ds_triton_pipeline.pipeline_type import h264_pipeline, uri_local_pipeline, image_pipeline
+from ds_triton_pipeline.pipeline_type import build_pipeline, pipeline_spec, source_kind
+from ds_triton_pipeline.source_manager import SourceManager
 
 
 parser = argparse.ArgumentParser(description="Deepstream Triton Yolov5 PIPELINE")
@@ -28,12 +33,71 @@ parser.add_argument(
     type=str, nargs="+",
     default=["/opt/nvidia/deepstream/deepstream-6.0/samples/streams/sample_qHD.h264"])
 parser.add_argument("--batch_size", help="batch size inference", type=int, default=1)
-parser.add_argument("--label_type", help="Label type (flag/nsfw)", type=str, default="flag")
+parser.add_argument(
+    "--batch_latency_budget_ms",
+    help="Adapt the streammux batched-push-timeout (and batch size if supported) to the stream rates and batch fill, "
+         "within this latency budget (0: fixed 4 s timeout)", type=float, default=0)
+parser.add_argument("--label_type", help="Label type (flag/nsfw/horror) or path to a labels.txt or nvinferserver config", type=str, default="flag")
 parser.add_argument("--is_save", help="Save result video output", action="store_true")
+parser.add_argument(
+    "--preview_streams", help="--is_save: tile the first N streams into the saved video (0: all)", type=int, default=0)
+parser.add_argument(
+    "--preview_fps", help="--is_save: max frames per second of the saved video (0: every batch)", type=int, default=5)
 parser.add_argument("--conf", help="Confidence threshold for YOLOv5", type=float, default=0.5)
 parser.add_argument("--iou", help="IOU threshold", type=float, default=0.45)
 parser.add_argument("--outvid_width", help="VIDEO OUTPUT WIDTH", type=int, default=1920)
 parser.add_argument("--outvid_height", help="VIDEO OUTPUT_HEIGHT", type=int, default=1080)
+parser.add_argument("--output_layer", help="Name of the output layer with yolov5 detections, default the last layer", type=str, default=None)
+parser.add_argument("--result_queue_size", help="Max per-frame results queued for the result writer thread", type=int, default=1024)
+parser.add_argument(
+    "--result_policy", help="What to do when the result queue is full (drop_oldest/drop_newest/block)", type=str, default="drop_oldest")
+parser.add_argument("--sink", help="Detection output (log/jsonl/msgpack/parquet/events)", type=str, default="log")
+parser.add_argument(
+    "--sink_path", help="Output directory of jsonl/parquet/events sinks or Unix socket path of msgpack sink", type=str, default=None)
+parser.add_argument("--sink_flush_interval", help="Max seconds between sink flushes", type=float, default=1.0)
+parser.add_argument("--sink_rotate_mb", help="Rotate jsonl/parquet output files at this size (MB)", type=int, default=256)
+parser.add_argument("--event_min_hits", help="events sink: detections needed to start an event", type=int, default=3)
+parser.add_argument("--event_max_gap", help="events sink: seconds unseen before an event ends", type=float, default=2.0)
+parser.add_argument(
+    "--event_update_interval", help="events sink: seconds between update events of an open event (0: off)", type=float, default=30.0)
+parser.add_argument(
+    "--latency_report", help="Record per-stage latency histograms and log them every N seconds (0: off)", type=int, default=0)
+parser.add_argument(
+    "--metrics_port", help="Serve Prometheus metrics at http://127.0.0.1:PORT/metrics (0: off)", type=int, default=0)
+parser.add_argument(
+    "--capture_tensors", "--capture-tensors",
+    help="Record the raw output tensors to this memory-mapped file for offline replay", type=str, default=None)
+parser.add_argument("--capture_max_frames", help="Capacity of the tensor capture file in frames", type=int, default=10000)
+parser.add_argument(
+    "--max_draw_objects", help="Draw at most this many highest score objects per frame with --is_save (0: all)", type=int, default=100)
+parser.add_argument(
+    "--max_skip_interval",
+    help="Adaptive inference skipping: skip up to N batches between inferences on stable scenes, "
+         "tracking the boxes in between (0: off)", type=int, default=0)
+parser.add_argument(
+    "--postprocess_workers",
+    help="Postprocess the frames that are not drawn on N threads, the probe only copies their tensors (0: in the probe)",
+    type=int, default=0)
+parser.add_argument(
+    "--max_in_flight_batches", help="Batches queued for the postprocess threads before the probe waits", type=int, default=4)
+parser.add_argument(
+    "--control_port",
+    help="Serve the control API at http://127.0.0.1:PORT to add/remove URI sources and toggle the --is_save preview "
+         "at runtime (0: off)",
+    type=int, default=0)
+parser.add_argument(
+    "--reconnect_backoff",
+    help="Seconds before rebuilding a failed or ended rtsp source, doubled on every failed attempt (0: an error stops "
+         "the pipeline)", type=float, default=1.0)
+parser.add_argument("--reconnect_max_backoff", help="Max seconds between source reconnect attempts", type=float, default=60.0)
+parser.add_argument(
+    "--reconnect_max_retries", help="Failed reconnect attempts in a row before a source is left down (0: no limit)",
+    type=int, default=0)
+parser.add_argument(
+    "--stall_timeout", help="Reconnect a source that delivered no frame for N seconds (0: off)", type=float, default=0)
+parser.add_argument(
+    "--pipeline_dot", help="Write the pipeline graph with element creation times to this Graphviz DOT file",
+    type=str, default=None)
 parser.add_argument("--is_dali", help="DeepStream Triton DALI yolov5 trt, use dali for preprocessing", action="store_true")
 parser.add_argument(
     "--is_grpc", help="Don't use DeepStream Triton Docker, use seperately DeepStream and Triton that need GRPC protocol for communicate", action="store_true")
@@ -51,6 +115,31 @@ IS_GRPC = args.is_grpc
 test_video = args.test_video
 label_type = args.label_type
 BATCH_SIZE = args.batch_size
+OUTPUT_LAYER = args.output_layer
+RESULT_QUEUE_SIZE = args.result_queue_size
+RESULT_POLICY = args.result_policy
+SINK_TYPE = args.sink
+SINK_PATH = args.sink_path
+SINK_FLUSH_INTERVAL = args.sink_flush_interval
+SINK_ROTATE_MB = args.sink_rotate_mb
+EVENT_OPTIONS = dict(
+    min_hits=args.event_min_hits, max_gap=args.event_max_gap, update_interval=args.event_update_interval)
+LATENCY_REPORT = args.latency_report
+METRICS_PORT = args.metrics_port
+CAPTURE_TENSORS = args.capture_tensors
+CAPTURE_MAX_FRAMES = args.capture_max_frames
+MAX_DRAW_OBJECTS = args.max_draw_objects
+MAX_SKIP_INTERVAL = args.max_skip_interval
+POSTPROCESS_WORKERS = args.postprocess_workers
+MAX_IN_FLIGHT_BATCHES = args.max_in_flight_batches
+CONTROL_PORT = args.control_port
+PIPELINE_DOT = args.pipeline_dot
+BATCH_LATENCY_BUDGET = args.batch_latency_budget_ms / 1000
+PREVIEW_STREAMS = args.preview_streams
+PREVIEW_FPS = args.preview_fps
+RECONNECT_OPTIONS = dict(
+    backoff_initial=args.reconnect_backoff, backoff_max=args.reconnect_max_backoff,
+    max_reconnects=args.reconnect_max_retries, stall_timeout=args.stall_timeout)
 
 
 def ds_pipeline(
@@ -62,13 +151,22 @@ def ds_pipeline(
     is_dali=False, 
     is_grpc=False,
     output_video_name="./ds_triton_yolov5_trt_out.mp4", 
-    label_type="flag"):
+    label_type="flag",
+    output_layer=None,
+    result_queue_size=1024, result_policy="drop_oldest",
+    sink_type="log", sink_path=None, sink_flush_interval=1.0, sink_rotate_mb=256, event_options=None,
+    latency_report=0,
+    metrics_port=0,
+    capture_tensors=None, capture_max_frames=10000,
+    max_draw_objects=100,
+    max_skip_interval=0,
+    postprocess_workers=0, max_in_flight_batches=4,
+    control_port=0,
+    reconnect_options=None,
+    pipeline_dot=None,
+    preview_streams=0, preview_fps=5,
+    batch_latency_budget=0):
     init_t = time.perf_counter()
-    # can't save video output if batch size larger than 1
-    if batch_size != 1 or len(test_video) != 1:
-        if is_save_output:
-            logger.warning("Save video output only operate with 1 video input and batch_size == 1")
-            is_save_output = False
 
     # Initialize Pipleline parts
     try:
@@ -76,7 +174,19 @@ def ds_pipeline(
             is_save_output=is_save_output, 
             image_width=outvid_width, image_height=outvid_height, 
             conf_threshold=conf_threshold, nms_threshold=iou_threshold, 
-            label_type=label_type)
+            label_type=label_type,
+            output_layer=output_layer,
+            result_queue_size=result_queue_size, result_policy=result_policy,
+            sink_type=sink_type, sink_path=sink_path,
+            sink_flush_interval=sink_flush_interval, sink_rotate_bytes=sink_rotate_mb << 20,
+            event_options=event_options,
+            latency_stats=latency_report > 0 or metrics_port > 0,
+            capture_path=capture_tensors, capture_capacity=capture_max_frames,
+            max_draw_objects=max_draw_objects,
+            max_skip_interval=max_skip_interval,
+            preview_streams=preview_streams,
+            postprocess_workers=postprocess_workers,
+            max_in_flight_batches=max_in_flight_batches)
     except Exception as ex:
         logger.error(f"ERROR: {ex}")
 
@@ -91,49 +201,96 @@ def ds_pipeline(
 
     if not pipeline:
         logger.warning("WARNING: Unable to create Pipeline \n")
+    # uris of the source bins, only uri pipelines can attach sources at runtime
+    source_uris = None
+    kind = source_kind(test_video)
+    if kind is None:
+        logger.error("ERROR: Not found source: {}".format((",").join(test_video)))
+        logger.debug(
+            "DEBUG: The system allow a or more source and accepts any format like: mp4, h264, https, rstp... \nSetup --test_video file:///path/to/video_1.mp4 file:///path/to/video_2.mp4 ")
+        sys.exit(1)
+    if kind == "uri":
+        source_uris = test_video
+    if kind == "image" and is_save_output:
+        logger.warning("WARNING: Save video output is not supported for image inputs")
+        is_save_output = False
     try:
-        if test_video[0].endswith(".h264") and not test_video[0].startswith("https://") and not test_video[0].startswith("file:///"):
-            # Pipeline: 
-            # filesrc -> h264parser -> nvh264-decoder -> streammux -> tritoninfer -> postprocess
-            pipeline, pgie, nvosd = h264_pipeline(
-                pipeline, pl, 
-                test_video[0], 
-                batch_size=batch_size,
-                is_save_output=is_save_output, 
-                output_video_name=output_video_name, 
-                image_width=outvid_width, image_height=outvid_height,
-                is_dali=is_dali, is_grpc=is_grpc)
-        elif test_video[0].startswith("file://") or test_video[0].startswith("https://") or test_video[0].startswith("rtsp://"):
-            # uridecoders -> streammux -> triton_infer -> postprocess 
-            pipeline, pgie, nvosd = uri_local_pipeline(
-                pipeline, pl, 
-                test_video, 
-                batch_size=batch_size,
-                is_save_output=is_save_output, 
-                output_video_name=output_video_name, 
-                image_width=outvid_width, image_height=outvid_height, 
-                is_dali=is_dali, is_grpc=is_grpc)
-        elif os.path.isdir(test_video[0]) or os.path.isfile(test_video[0]) or test_video[0].endswith(".jpg") or test_video[0].endswith(".mjpeg"):
-            pipeline, pgie = image_pipeline(
-                pipeline, pl, 
-                test_video[0], 
-                batch_size=batch_size, 
-                image_width=outvid_width, image_height=outvid_height)
-        else:
-            logger.error("ERROR: Not found source: {}".format((",").join(test_video)))
-            logger.debug(
-                "DEBUG: The system allow a or more source and accepts any format like: mp4, h264, https, rstp... \nSetup --test_video file:///path/to/video_1.mp4 file:///path/to/video_2.mp4 ")
-            sys.exit(1)
-
+        # h264:  filesrc -> h264parser -> nvh264-decoder -> streammux -> tritoninfer -> postprocess
+        # uri:   uridecoders -> streammux -> triton_infer -> postprocess
+        # image: filesrc -> jpegparser -> nvjpeg-decoder -> streammux -> tritoninfer -> postprocess
+        spec = pipeline_spec(
+            kind, test_video,
+            batch_size=batch_size,
+            is_save_output=is_save_output,
+            output_video_name=output_video_name,
+            image_width=outvid_width, image_height=outvid_height,
+            is_dali=is_dali, is_grpc=is_grpc,
+            preview_streams=preview_streams, preview_fps=preview_fps,
+            push_timeout=batch_latency_budget if batch_latency_budget > 0 else 4.0)
+        pipeline, elements, builder = build_pipeline(pipeline, pl, spec)
+        pgie = elements["primary-inference"]
+        nvosd = elements.get("onscreendisplay")
+        builder.log_report()
+        if pipeline_dot:
+            with open(pipeline_dot, "w") as dot_file:
+                dot_file.write(spec.to_dot(builder.timings))
+            logger.info(f"[INFO] Pipeline graph written to {pipeline_dot}")
     except Exception as ex:
         logger.error(f"ERROR: {ex}")
         sys.exit(1)
 
     # create an event loop and feed gstreamer bus mesages to it
     loop = GObject.MainLoop()
+    # SIGTERM (e.g. from the orchestrator) stops the pipeline and flushes the sinks like an EOS
+    GLib.unix_signal_add(GLib.PRIORITY_DEFAULT, signal.SIGTERM, loop.quit)
     bus = pipeline.get_bus()
     bus.add_signal_watch()
-    bus.connect("message", bus_call, loop)
+    if batch_latency_budget > 0:
+        # decisions are taken on the main loop from the rates and batch fill of the last seconds
+        pl.batch_controller = BatchController(
+            elements["Stream-muxer"], pl.throughput, batch_latency_budget)
+        GLib.timeout_add_seconds(2, pl.batch_controller.tick)
+
+    reconnect_options = reconnect_options or {}
+    source_manager = None
+    reconnect = reconnect_options.get("backoff_initial", 0) > 0 and any(uri.startswith("rtsp://") for uri in test_video)
+    if source_uris is not None and (control_port > 0 or reconnect):
+        source_manager = SourceManager(pipeline, pipeline.get_by_name("Stream-muxer"), pl, **reconnect_options)
+        source_manager.adopt(source_uris)
+        # per-stream EOS detaches or reconnects the source, the pipeline keeps running for the others
+        bus.connect("message", source_manager.bus_message)
+        source_manager.start()
+    elif control_port > 0:
+        logger.warning("WARNING: Sources can only be added/removed at runtime with file/https/rtsp uri inputs")
+
+    metrics_server = None
+    bus_messages = None
+    if metrics_port > 0:
+        registry = MetricsRegistry()
+        bus_messages = registry.counter("ds_bus_messages_total", "EOS, warning and error bus messages", ("type",))
+        pl.register_metrics(registry)
+        if pl.batch_controller is not None:
+            pl.batch_controller.register_metrics(registry)
+        if source_manager is not None:
+            source_manager.register_metrics(registry)
+        try:
+            metrics_server = MetricsServer(registry, port=metrics_port)
+            metrics_server.start()
+        except Exception as ex:
+            logger.error(f"ERROR: Unable to start metrics server: {ex}")
+            metrics_server = None
+    # errors of a single source bin are recovered by the source manager, others stop the loop
+    bus.connect("message", bus_call, loop, bus_messages, source_manager.source_error if source_manager else None)
+
+    control_server = None
+    preview_valve = elements.get("preview-valve")
+    if control_port > 0 and (source_manager is not None or preview_valve is not None):
+        try:
+            control_server = ControlServer(source_manager, port=control_port, preview_valve=preview_valve)
+            control_server.start()
+        except Exception as ex:
+            logger.error(f"ERROR: Unable to start control server: {ex}")
+            control_server = None
 
     # Add a probe on the primary-infer source pad to get inference output tensors
     try:
@@ -146,6 +303,9 @@ def ds_pipeline(
     
 
     pgiesrcpad.add_probe(Gst.PadProbeType.BUFFER, pl.pgie_src_pad_buffer_probe, 0)
+    if pl.inference_skipper is not None:
+        # the probe adapts the interval of the inference element from here on
+        pl.set_infer_element(pgie)
 
     if is_save_output:
         # Lets add probe to get informed of the meta data generated, we add probe to
@@ -160,10 +320,25 @@ def ds_pipeline(
         except Exception as ex:
             logger.error("ERROR: {}".format(ex))    
     
+    if pl.latency is not None:
+        try:
+            # the preview branch is rate limited and leaky, latency is timed on the detections branch
+            pl.add_latency_probes(pipeline, pgie)
+        except Exception as ex:
+            logger.error("ERROR: {}".format(ex))
+    if latency_report > 0:
+        # periodic latency summaries, the last one is logged at EOS
+        GLib.timeout_add_seconds(latency_report, lambda: pl.latency.report() or True)
+
     done_init_t = time.perf_counter() - init_t
 
     # start play back and listen to events
     logger.info("Starting pipeline \n")
+    pl.result_dispatcher.start()
+    if pl.postprocess_pool is not None:
+        pl.postprocess_pool.start()
+    if pl.tensor_capture is not None:
+        pl.tensor_capture.start()
     pipeline.set_state(Gst.State.PLAYING)
     
     start_t = time.perf_counter()
@@ -174,6 +349,13 @@ def ds_pipeline(
         pass
     # cleanup
     pipeline.set_state(Gst.State.NULL)
+    if pl.postprocess_pool is not None:
+        # the batches still in flight are emitted before the dispatcher flushes
+        pl.postprocess_pool.stop()
+    pl.result_dispatcher.stop()
+    pl.sink.close()
+    if pl.tensor_capture is not None:
+        pl.tensor_capture.close()
     
     end = time.perf_counter() - start_t
     
@@ -181,6 +363,13 @@ def ds_pipeline(
     logger.info(f"[INFO] Inference + Postprocess + save (option): {end:.5f}")
     logger.info(f"[INFO] elapsed time: {(done_init_t + end):.5f}")
     logger.info(f"[INFO] extracted frames: {pl.extracted_frame}")
+    pl.throughput.report()
+    if control_server is not None:
+        control_server.stop()
+    if metrics_server is not None:
+        metrics_server.stop()
+    if pl.latency is not None:
+        pl.latency.report()
 
 
 if __name__ == "__main__":
@@ -196,5 +385,27 @@ if __name__ == "__main__":
             is_dali=IS_DALI,
             is_grpc=IS_GRPC,
             output_video_name=OUTPUT_VIDEO_NAME,
-            label_type=label_type
+            label_type=label_type,
+            output_layer=OUTPUT_LAYER,
+            result_queue_size=RESULT_QUEUE_SIZE,
+            result_policy=RESULT_POLICY,
+            sink_type=SINK_TYPE,
+            sink_path=SINK_PATH,
+            sink_flush_interval=SINK_FLUSH_INTERVAL,
+            sink_rotate_mb=SINK_ROTATE_MB,
+            event_options=EVENT_OPTIONS,
+            latency_report=LATENCY_REPORT,
+            metrics_port=METRICS_PORT,
+            capture_tensors=CAPTURE_TENSORS,
+            capture_max_frames=CAPTURE_MAX_FRAMES,
+            max_draw_objects=MAX_DRAW_OBJECTS,
+            max_skip_interval=MAX_SKIP_INTERVAL,
+            postprocess_workers=POSTPROCESS_WORKERS,
+            max_in_flight_batches=MAX_IN_FLIGHT_BATCHES,
+            control_port=CONTROL_PORT,
+            reconnect_options=RECONNECT_OPTIONS,
+            pipeline_dot=PIPELINE_DOT,
+            preview_streams=PREVIEW_STREAMS,
+            preview_fps=PREVIEW_FPS,
+            batch_latency_budget=BATCH_LATENCY_BUDGET
         ))
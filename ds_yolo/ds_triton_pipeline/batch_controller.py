@@ -0,0 +1,136 @@
+import threading
+
+import gi
+
+gi.require_version("Gst", "1.0")
+from gi.repository import Gst
+from loguru import logger
+
+from common.metrics_server import MetricFamily
+
+
+def mutable_in_playing(element, name):
+    """
+    Whether the property `name` of `element` may be set while the pipeline is PLAYING
+    """
+    pspec = element.find_property(name)
+    return pspec is not None and bool(pspec.flags & Gst.PARAM_MUTABLE_PLAYING)
+
+
+class BatchController:
+    """
+    Adaptive nvstreammux batching within a latency budget, run every few seconds on the
+    GLib main loop by `tick`.
+
+    Arrival rates are the per-stream FPS of the ThroughputMeter, batch fill is fed by
+    `observe_batch` from the inference probe. A full batch needs one frame of every active
+    stream and `batch size` frames overall, so the push timeout follows the longer of the
+    frame interval of the slowest active stream and the time all streams take to deliver a
+    batch, plus `margin`. It is scaled up while batches leave less than `fill_target` full
+    and back down once they are (nearly) all full, never above `latency_budget` seconds or
+    below `min_timeout`.
+    The batch size follows the number of active streams up to `max_batch_size`, only if the
+    streammux allows changing it while PLAYING. Changes within `hysteresis` of the current
+    timeout are not applied.
+    """
+    def __init__(
+        self, streammux, throughput, latency_budget, max_batch_size=None, min_timeout=0.001, margin=0.25,
+        fill_target=0.9, full=0.98, max_scale=4.0, min_fps=0.5, hysteresis=0.1):
+        self.streammux = streammux
+        self.throughput = throughput
+        self.latency_budget = latency_budget
+        self.min_timeout = min_timeout
+        self.margin = margin
+        self.fill_target = fill_target
+        self.full = full
+        self.max_scale = max_scale
+        self.min_fps = min_fps
+        self.hysteresis = hysteresis
+
+        self.batch_size = streammux.get_property("batch-size")
+        self.max_batch_size = max_batch_size or self.batch_size
+        self.timeout = streammux.get_property("batched-push-timeout") / 1e6
+        self.resizable = mutable_in_playing(streammux, "batch-size")
+        if not self.resizable:
+            logger.info(f"[INFO] Batching: streammux batch-size is fixed at {self.batch_size}, only the timeout adapts")
+        self.scale = 1.0
+        self.occupancy = 0.0
+        self.adjustments = 0
+        self.batches_total = 0
+        self.frames_total = 0
+        # batches and frames seen since the last tick
+        self._batches = 0
+        self._frames = 0
+        self._lock = threading.Lock()
+
+    def observe_batch(self, num_frames):
+        """
+        Count a batch of `num_frames` frames, called on the streaming thread
+        """
+        with self._lock:
+            self._batches += 1
+            self._frames += num_frames
+
+    def decide(self, rates, batches, frames):
+        """
+        (batch size, timeout in seconds) for the stream FPS `rates` and the `batches`
+        carrying `frames` frames since the last decision
+        """
+        active = [fps for fps in rates if fps >= self.min_fps]
+        if batches:
+            self.occupancy = frames / (batches * self.batch_size)
+            # between fill_target and full the scale holds, so it does not oscillate around the target
+            if self.occupancy < self.fill_target:
+                self.scale = min(self.scale * 1.25, self.max_scale)
+            elif self.occupancy >= self.full:
+                self.scale = max(self.scale * 0.9, 1.0)
+        batch_size = self.batch_size
+        if self.resizable:
+            batch_size = min(max(len(active), 1), self.max_batch_size)
+        if active:
+            fill_time = max(1.0 / min(active), batch_size / sum(active))
+            timeout = (1 + self.margin) * fill_time * self.scale
+        else:
+            timeout = self.latency_budget
+        return batch_size, min(max(timeout, self.min_timeout), self.latency_budget)
+
+    def tick(self):
+        with self._lock:
+            batches, frames = self._batches, self._frames
+            self._batches = self._frames = 0
+            self.batches_total += batches
+            self.frames_total += frames
+        rates = [stats["fps"] for stats in self.throughput.snapshot().values()]
+        batch_size, timeout = self.decide(rates, batches, frames)
+        if batch_size == self.batch_size and abs(timeout - self.timeout) <= self.hysteresis * self.timeout:
+            return True
+
+        active = [fps for fps in rates if fps >= self.min_fps]
+        slowest = f"slowest {min(active):.1f} fps" if active else "no active stream"
+        logger.info(
+            f"[INFO] Batching: batch-size {self.batch_size} -> {batch_size}, batched-push-timeout "
+            f"{self.timeout * 1000:.1f} -> {timeout * 1000:.1f} ms ({len(active)} active streams, {slowest}, "
+            f"occupancy {self.occupancy:.2f})")
+        if batch_size != self.batch_size:
+            self.streammux.set_property("batch-size", batch_size)
+            self.batch_size = batch_size
+        self.streammux.set_property("batched-push-timeout", int(timeout * 1e6))
+        self.timeout = timeout
+        self.adjustments += 1
+        return True
+
+    def register_metrics(self, registry):
+        registry.add_collector(self.collect_metrics)
+
+    def collect_metrics(self):
+        return [
+            MetricFamily("ds_batch_occupancy", "gauge", "Mean fill ratio of the streammux batches since the last decision",
+                         [({}, self.occupancy)]),
+            MetricFamily("ds_streammux_batch_size", "gauge", "Current streammux batch size", [({}, self.batch_size)]),
+            MetricFamily("ds_streammux_push_timeout_seconds", "gauge", "Current streammux batched push timeout",
+                         [({}, self.timeout)]),
+            MetricFamily("ds_batches_total", "counter", "Batches seen by the batching controller",
+                         [({}, self.batches_total)]),
+            MetricFamily("ds_batching_adjustments_total", "counter", "Streammux batch size or timeout changes",
+                         [({}, self.adjustments)]),
+        ]
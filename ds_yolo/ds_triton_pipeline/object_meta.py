@@ -0,0 +1,133 @@
+import importlib
+
+import numpy as np
+
+from loguru import logger
+
+
+UNTRACKED_OBJECT_ID = 0xffffffffffffffff
+
+
+class ObjectStyle:
+    """
+    Drawing style of the inserted objects, built once. When pyds can construct
+    NvOSD_RectParams / NvOSD_TextParams, the style lives in template structs that are
+    copied into every object meta with one assignment each (pybind11 copies struct
+    members on assignment), otherwise `apply` falls back to setting every field.
+    `pyds_module` defaults to the real pyds, any module with the same API works.
+    """
+    def __init__(
+        self,
+        pyds_module=None,
+        border_width=3, border_color=(1.0, 0.0, 0.0, 1.0),
+        has_bg_color=0, bg_color=(1.0, 1.0, 0.0, 0.4),
+        font_name="Serif", font_size=10, font_color=(1.0, 1.0, 1.0, 1.0),
+        text_bg_color=(0.0, 0.0, 0.0, 1.0)):
+        self.pyds = pyds_module if pyds_module is not None else importlib.import_module("pyds")
+        self.border_width = border_width
+        self.border_color = border_color
+        self.has_bg_color = has_bg_color
+        self.bg_color = bg_color
+        self.font_name = font_name
+        self.font_size = font_size
+        self.font_color = font_color
+        self.text_bg_color = text_bg_color
+
+        self.rect_params = None
+        self.text_params = None
+        try:
+            rect_params = self.pyds.NvOSD_RectParams()
+            text_params = self.pyds.NvOSD_TextParams()
+        except (AttributeError, TypeError) as ex:
+            logger.warning(f"WARNING: pyds can't build style templates, setting object style per field: {ex}")
+        else:
+            # a new template holds no display text, so copies never share a string buffer
+            self.apply_rect_style(rect_params)
+            self.apply_text_style(text_params)
+            self.rect_params = rect_params
+            self.text_params = text_params
+
+    def apply_rect_style(self, rect_params):
+        rect_params.has_bg_color = self.has_bg_color
+        rect_params.bg_color.set(*self.bg_color)
+        rect_params.border_width = self.border_width
+        rect_params.border_color.set(*self.border_color)
+
+    def apply_text_style(self, text_params):
+        text_params.font_params.font_name = self.font_name
+        text_params.font_params.font_size = self.font_size
+        text_params.font_params.font_color.set(*self.font_color)
+        text_params.set_bg_clr = 1
+        text_params.text_bg_clr.set(*self.text_bg_color)
+
+    def apply(self, obj_meta):
+        """
+        Style `obj_meta`, freeing the display text a recycled meta may still hold.
+        Geometry and text are left to the caller.
+        """
+        if obj_meta.text_params.display_text:
+            self.pyds.free_buffer(obj_meta.text_params.display_text)
+        if self.rect_params is not None:
+            try:
+                obj_meta.rect_params = self.rect_params
+                obj_meta.text_params = self.text_params
+                return
+            except (AttributeError, TypeError) as ex:
+                logger.warning(f"WARNING: can't copy style templates into object meta, setting style per field: {ex}")
+                self.rect_params = None
+                self.text_params = None
+        self.apply_rect_style(obj_meta.rect_params)
+        self.apply_text_style(obj_meta.text_params)
+
+
+def top_k(scores, k):
+    """
+    Indices of the `k` highest scores in their original order, all indices if k <= 0
+    """
+    if k <= 0 or scores.size <= k:
+        return np.arange(scores.size)
+    return np.sort(np.argpartition(-scores, k - 1)[:k])
+
+
+def add_detections_to_frame(pyds, style, batch_meta, frame_meta, detections, label_names, max_objects=0):
+    """
+    Insert the detections of one frame as object meta, at most `max_objects` of the highest
+    scores if > 0. Geometry, labels and display texts are computed for the whole frame up
+    front, the loop only sets the per-object fields. Return the number of inserted objects.
+    """
+    if not len(detections):
+        return 0
+    index = top_k(detections.scores, max_objects)
+    boxes = detections.int_boxes()[index]
+    lefts = boxes[:, 0].tolist()
+    tops = boxes[:, 1].tolist()
+    widths = (boxes[:, 2] - boxes[:, 0]).tolist()
+    heights = (boxes[:, 3] - boxes[:, 1]).tolist()
+    text_tops = np.maximum(boxes[:, 1] - 10, 0).tolist()
+    scores = detections.scores[index].tolist()
+    class_ids = detections.class_ids[index]
+    labels = label_names.lookup(class_ids).tolist()
+    texts = label_names.display_texts(class_ids.tolist(), scores)
+
+    acquire = pyds.nvds_acquire_obj_meta_from_pool
+    add = pyds.nvds_add_obj_meta_to_frame
+    apply_style = style.apply
+    for left, top, width, height, text_top, score, label, text in zip(
+            lefts, tops, widths, heights, text_tops, scores, labels, texts):
+        obj_meta = acquire(batch_meta)
+        apply_style(obj_meta)
+        rect_params = obj_meta.rect_params
+        rect_params.left = left
+        rect_params.top = top
+        rect_params.width = width
+        rect_params.height = height
+        obj_meta.confidence = score
+        # there is no tracking id upon detection, the tracker assigns one
+        obj_meta.object_id = UNTRACKED_OBJECT_ID
+        obj_meta.obj_label = label
+        text_params = obj_meta.text_params
+        text_params.x_offset = left
+        text_params.y_offset = text_top
+        text_params.display_text = text
+        add(frame_meta, obj_meta, None)
+    return len(lefts)
@@ -0,0 +1,219 @@
+import time
+
+import gi
+
+gi.require_version("Gst", "1.0")
+from gi.repository import Gst
+from loguru import logger
+
+
+class ElementSpec:
+    """
+    One element of a PipelineSpec. `properties` are (name, value) pairs set in order after
+    creation, `caps` is set as the caps property from a caps string. `make`, if given, builds
+    the element instead of the factory (source bins); `comment` is only shown in the graph.
+    """
+    def __init__(self, factory, name, printed_name=None, properties=(), caps=None, detail="", make=None, comment=None):
+        self.factory = factory
+        self.name = name
+        self.printed_name = printed_name or name
+        self.properties = list(properties)
+        self.caps = caps
+        self.detail = detail
+        self.make = make
+        self.comment = comment
+
+
+class LinkSpec:
+    """
+    Link of two elements, through the default pads or the named ones. A named pad that is
+    not a static pad is requested (tee src_%u, streammux sink_%u pads).
+    """
+    def __init__(self, src, dst, src_pad=None, dst_pad=None):
+        self.src = src
+        self.dst = dst
+        self.src_pad = src_pad
+        self.dst_pad = dst_pad
+
+
+class PipelineSpec:
+    """
+    Declarative description of a pipeline: the elements to create, in creation order, and
+    the links between them. Only what is in the spec gets instantiated.
+    """
+    def __init__(self, name="pipeline"):
+        self.name = name
+        self.elements = []
+        self.links = []
+
+    def __len__(self):
+        return len(self.elements)
+
+    def add(self, element):
+        self.elements.append(element)
+        return element.name
+
+    def get(self, name):
+        return next((element for element in self.elements if element.name == name), None)
+
+    def link(self, src, dst, src_pad=None, dst_pad=None):
+        self.links.append(LinkSpec(src, dst, src_pad, dst_pad))
+
+    def chain(self, *names):
+        """
+        Link the elements `names` one after the other through their default pads
+        """
+        for src, dst in zip(names, names[1:]):
+            self.link(src, dst)
+
+    def validate(self):
+        """
+        Raise ValueError on duplicate element names, links to unknown elements, pads linked
+        twice and elements left unlinked
+        """
+        names = [element.name for element in self.elements]
+        duplicates = sorted({name for name in names if names.count(name) > 1})
+        if duplicates:
+            raise ValueError(f"Duplicate element names: {', '.join(duplicates)}")
+        known = set(names)
+        linked = set()
+        pads = set()
+        for link in self.links:
+            for name in (link.src, link.dst):
+                if name not in known:
+                    raise ValueError(f"Link {link.src} -> {link.dst} refers to unknown element {name}")
+            for pad in ((link.src, link.src_pad or "src"), (link.dst, link.dst_pad or "sink")):
+                if pad in pads:
+                    raise ValueError(f"Pad {pad[1]} of {pad[0]} is linked twice")
+                pads.add(pad)
+            linked.update((link.src, link.dst))
+        unlinked = [name for name in names if name not in linked]
+        if len(names) > 1 and unlinked:
+            raise ValueError(f"Unlinked elements: {', '.join(unlinked)}")
+
+    def to_dot(self, timings=None):
+        """
+        The graph in Graphviz DOT, with the creation time of the elements if `timings`
+        ({name: seconds}) is given
+        """
+        def escape(text):
+            return str(text).replace("\\", "\\\\").replace('"', '\\"')
+
+        def quote(text):
+            return '"' + escape(text) + '"'
+
+        lines = [f"digraph {quote(self.name)} {{", "  rankdir=LR;", "  node [shape=box, fontsize=10];"]
+        for element in self.elements:
+            label = [element.name, element.factory]
+            label.extend(f"{key}={value}" for key, value in element.properties)
+            if element.caps is not None:
+                label.append(f"caps={element.caps}")
+            if element.comment is not None:
+                label.append(element.comment)
+            if timings is not None and element.name in timings:
+                label.append(f"{timings[element.name] * 1000:.2f} ms")
+            label = "\\n".join(escape(part) for part in label)
+            lines.append(f"  {quote(element.name)} [label=\"{label}\"];")
+        for link in self.links:
+            attributes = ""
+            if link.src_pad is not None or link.dst_pad is not None:
+                attributes = f" [label={quote((link.src_pad or 'src') + ' -> ' + (link.dst_pad or 'sink'))}]"
+            lines.append(f"  {quote(link.src)} -> {quote(link.dst)}{attributes};")
+        lines.append("}")
+        return "\n".join(lines) + "\n"
+
+
+class PipelineBuilder:
+    """
+    Instantiate a PipelineSpec into a Gst.Pipeline and time it: creation and configuration
+    of every element, adding and linking. `make_element(factory, name, printed_name, detail)`
+    creates the factory elements, PipelineParts.make_elm_or_print_err by default.
+    """
+    def __init__(self, make_element=None):
+        self.make_element = make_element
+        self.timings = {}
+        self.links = 0
+        self.add_time = 0.0
+        self.link_time = 0.0
+        self.total_time = 0.0
+
+    def _make(self, element):
+        if element.make is not None:
+            gst_element = element.make()
+        elif self.make_element is not None:
+            gst_element = self.make_element(element.factory, element.name, element.printed_name, element.detail)
+        else:
+            gst_element = Gst.ElementFactory.make(element.factory, element.name)
+        if not gst_element:
+            raise RuntimeError(f"Unable to create {element.printed_name} ({element.factory})")
+        for key, value in element.properties:
+            gst_element.set_property(key, value)
+        if element.caps is not None:
+            gst_element.set_property("caps", Gst.Caps.from_string(element.caps))
+        return gst_element
+
+    @staticmethod
+    def _link(src, dst, link):
+        if link.src_pad is None and link.dst_pad is None:
+            return bool(src.link(dst))
+        src_pad = link.src_pad or "src"
+        srcpad = src.get_static_pad(src_pad) or src.get_request_pad(src_pad)
+        dst_pad = link.dst_pad or "sink"
+        sinkpad = dst.get_static_pad(dst_pad) or dst.get_request_pad(dst_pad)
+        if not srcpad or not sinkpad:
+            return False
+        return srcpad.link(sinkpad) == Gst.PadLinkReturn.OK
+
+    def build(self, spec, pipeline=None):
+        """
+        Validate `spec`, create, add and link its elements into `pipeline` (a new one by
+        default). Return (pipeline, {name: element}).
+        """
+        start_t = time.perf_counter()
+        spec.validate()
+        if pipeline is None:
+            pipeline = Gst.Pipeline.new(spec.name)
+        elements = {}
+        for element in spec.elements:
+            element_t = time.perf_counter()
+            elements[element.name] = self._make(element)
+            self.timings[element.name] = time.perf_counter() - element_t
+
+        add_t = time.perf_counter()
+        for element in spec.elements:
+            pipeline.add(elements[element.name])
+        link_t = time.perf_counter()
+        self.add_time = link_t - add_t
+
+        for link in spec.links:
+            if not self._link(elements[link.src], elements[link.dst], link):
+                pads = f" ({link.src_pad or 'src'} -> {link.dst_pad or 'sink'})" if link.src_pad or link.dst_pad else ""
+                raise RuntimeError(f"Unable to link {link.src} to {link.dst}{pads}")
+        self.links = len(spec.links)
+        self.link_time = time.perf_counter() - link_t
+        self.total_time = time.perf_counter() - start_t
+        return pipeline, elements
+
+    def report(self):
+        """
+        {"elements", "links", "create", "add", "link", "total", "slowest"}: times in seconds,
+        the five slowest elements to create as (name, seconds)
+        """
+        slowest = sorted(self.timings.items(), key=lambda item: item[1], reverse=True)[:5]
+        return {
+            "elements": len(self.timings),
+            "links": self.links,
+            "create": sum(self.timings.values()),
+            "add": self.add_time,
+            "link": self.link_time,
+            "total": self.total_time,
+            "slowest": slowest,
+        }
+
+    def log_report(self):
+        report = self.report()
+        slowest = ", ".join(f"{name} {seconds * 1000:.1f} ms" for name, seconds in report["slowest"])
+        logger.info(
+            f"[INFO] Pipeline build: {report['elements']} elements, {report['links']} links in "
+            f"{report['total'] * 1000:.1f} ms (create {report['create'] * 1000:.1f} ms, add {report['add'] * 1000:.1f} ms, "
+            f"link {report['link'] * 1000:.1f} ms), slowest: {slowest}")
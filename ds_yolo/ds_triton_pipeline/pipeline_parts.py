@@ -1,4 +1,3 @@
-import ctypes
 import gi
 import numpy as np
 import os
@@ -6,6 +5,8 @@ import io
 import pathlib
 import pyds
 import sys
+import threading
+import time
 
 gi.require_version("Gst", "1.0")
 from gi.repository import GObject, GLib, Gst
@@ -21,8 +22,19 @@ file_path = pathlib.Path(__file__).resolve().parents[1]
 
 sys.path.append(os.path.abspath(file_path))
 
-from postprocess.labels import NSFWLabels, FlagLabels
-from postprocess.trt_postprocess import postprocess
+from postprocess.detections import Detections
+from postprocess.labels import get_label_set
+from postprocess.postprocess_pool import PostprocessPool
+from postprocess.tracker import InferenceSkipper
+from postprocess.trt_postprocess import postprocess_batch
+from ds_triton_pipeline.tensor_reader import TensorReader
+from ds_triton_pipeline.object_meta import ObjectStyle, add_detections_to_frame
+from common.result_dispatch import ResultDispatcher
+from common.sinks import DetectionRecord, make_sink
+from common.latency import LatencyTracker
+from common.FPS import ThroughputMeter
+from common.metrics_server import MetricFamily
+from common.tensor_capture import TensorCaptureWriter
 
 
 
@@ -33,7 +45,19 @@ class PipelineParts():
         nms_threshold=0.4, 
         is_save_output=True, 
         image_width=1920, image_height=1080, 
-        label_type="flag"):
+        label_type="flag",
+        output_layer=None,
+        result_queue_size=1024,
+        result_policy="drop_oldest",
+        sink_type="log", sink_path=None,
+        sink_flush_interval=1.0, sink_rotate_bytes=256 << 20, event_options=None,
+        latency_stats=False,
+        capture_path=None, capture_capacity=10000,
+        max_draw_objects=100,
+        max_skip_interval=0,
+        preview_streams=0,
+        postprocess_workers=0,
+        max_in_flight_batches=4):
         
         self.conf_thresh = conf_threshold
         self.nms_thresh = nms_threshold
@@ -41,13 +65,190 @@ class PipelineParts():
         self.image_width = image_width
         self.image_height = image_height
         
-        if label_type == "flag":
-            self.label = FlagLabels
-        elif label_type == "nsfw":
-            self.label = NSFWLabels
-
+        # LabelSet of the model: label name and display text prefix of every class id
+        self.label_names = get_label_set(label_type)
+
+        # output layer holding the yolov5 detections, the last layer if None
+        self.output_layer = output_layer
+        self.tensor_reader = TensorReader(pyds)
+        # per-frame results are serialized and written to the sink off the streaming thread
+        self.sink = make_sink(
+            sink_type, self.label_names, path=sink_path,
+            flush_interval=sink_flush_interval, rotate_bytes=sink_rotate_bytes, event_options=event_options)
+        self.result_dispatcher = ResultDispatcher(
+            self.sink.write, on_idle=self.sink.tick, max_records=result_queue_size, policy=result_policy)
+
+        # per-stage latency histograms, filled by pad probes when enabled
+        self.latency = LatencyTracker() if latency_stats else None
+        # per-source processed/dropped frames and FPS
+        self.throughput = ThroughputMeter()
+        # raw output tensors recorded for offline replay, written off the streaming thread
+        self.tensor_capture = TensorCaptureWriter(
+            capture_path, capacity=capture_capacity, layer_name=output_layer) if capture_path else None
+        # drawing style built once, copied into every inserted object meta
+        self.object_style = ObjectStyle(pyds)
+        # highest score objects drawn per frame, all of them if <= 0
+        self.max_draw_objects = max_draw_objects
+        # object meta is only inserted for the streams of the tiled preview, the first
+        # preview_streams pad indices, all of them if <= 0
+        self.preview_streams = preview_streams
+        # tracker assisted inference skipping: boxes are carried over the batches the
+        # inference element skips, its interval adapts to the scene, off if max_skip_interval <= 0
+        self.inference_skipper = InferenceSkipper(max_skip_interval) if max_skip_interval > 0 else None
+        # inference element whose interval property is adapted, set by set_infer_element
+        self.infer_element = None
+        self.infer_interval = 0
+        # adaptive streammux batching, fed with the batch sizes seen by the inference probe
+        self.batch_controller = None
+        # postprocess of the frames that are not drawn runs on worker threads, the probe only
+        # copies their tensors, off if postprocess_workers <= 0
+        self.postprocess_pool = None
+        if postprocess_workers > 0 and self.inference_skipper is not None:
+            logger.warning("WARNING: the tracker of inference skipping needs the detections in the probe, postprocess stays in the probe")
+        elif postprocess_workers > 0:
+            self.postprocess_pool = PostprocessPool(
+                self.emit_offloaded, conf_threshold, nms_threshold, workers=postprocess_workers,
+                max_in_flight=max_in_flight_batches, timings=self.record_timings if latency_stats else None)
+        # metrics counters, set by register_metrics
+        self.detections_counter = None
+
+        # emit_result runs on the probe thread and the postprocess workers
+        self._emit_lock = threading.Lock()
         self.extracted_frame = 0
         
+    def register_metrics(self, registry):
+        """
+        Expose the pipeline state in a MetricsRegistry: detections per source, throughput,
+        result queue and latency histograms are read at scrape time
+        """
+        self.detections_counter = registry.counter(
+            "ds_detections_total", "Detections emitted by the postprocess", ("source",))
+        registry.add_collector(self.collect_metrics)
+
+    def collect_metrics(self):
+        throughput = self.throughput.snapshot()
+        families = [
+            MetricFamily("ds_frames_processed_total", "counter", "Frames postprocessed",
+                         [({"source": source}, stats["processed"]) for source, stats in throughput.items()]),
+            MetricFamily("ds_frames_dropped_total", "counter", "Frames missing from the frame number sequence",
+                         [({"source": source}, stats["dropped"]) for source, stats in throughput.items()]),
+            MetricFamily("ds_stream_fps", "gauge", "Sliding window FPS",
+                         [({"source": source}, stats["fps"]) for source, stats in throughput.items()]),
+            MetricFamily("ds_stream_fps_ewma", "gauge", "Exponentially weighted FPS",
+                         [({"source": source}, stats["ewma_fps"]) for source, stats in throughput.items()]),
+            MetricFamily("ds_result_queue_depth", "gauge", "Results waiting for the sink",
+                         [({}, self.result_dispatcher.pending())]),
+            MetricFamily("ds_results_dropped_total", "counter", "Results dropped by the result queue",
+                         [({}, self.result_dispatcher.dropped)]),
+            MetricFamily("ds_results_emitted_total", "counter", "Results written to the sink",
+                         [({}, self.result_dispatcher.emitted)]),
+        ]
+        if self.postprocess_pool is not None:
+            families.extend([
+                MetricFamily("ds_postprocess_in_flight", "gauge", "Batches waiting for or in the postprocess workers",
+                             [({}, self.postprocess_pool.in_flight())]),
+                MetricFamily("ds_postprocess_waits_total", "counter", "Batches that waited for a free postprocess buffer",
+                             [({}, self.postprocess_pool.waits)]),
+            ])
+        if self.inference_skipper is not None:
+            skipping = self.inference_skipper.snapshot()
+            families.extend([
+                MetricFamily("ds_inferences_skipped_total", "counter", "Frames whose boxes were carried by the tracker",
+                             [({"source": source}, stats["skipped"]) for source, stats in skipping.items()]),
+                MetricFamily("ds_frames_inferred_total", "counter", "Frames that went through inference",
+                             [({"source": source}, stats["inferred"]) for source, stats in skipping.items()]),
+                MetricFamily("ds_infer_interval", "gauge", "Inference interval asked for by the stream",
+                             [({"source": source}, stats["interval"]) for source, stats in skipping.items()]),
+                MetricFamily("ds_infer_element_interval", "gauge", "Interval of the inference element",
+                             [({}, self.infer_interval)]),
+            ])
+        if self.latency is not None:
+            histograms = list(self.latency.histograms.items())
+            families.append(MetricFamily(
+                "ds_stage_latency_seconds", "histogram", "Per-stage latency, stream \"batch\" for batch level stages",
+                [({"stage": stage, "stream": "batch" if stream is None else stream}, histogram)
+                 for (stage, stream), histogram in histograms]))
+            families.append(MetricFamily(
+                "ds_probe_overhead_seconds", "histogram", "Time spent in the latency probes",
+                [({}, self.latency.overhead)]))
+        return families
+
+    def remove_source(self, source_id):
+        """
+        Forget the per-stream state of a source detached at runtime, so that a source
+        reusing its id starts clean
+        """
+        self.throughput.restart(source_id)
+        # the sink state goes after the records of the source still queued
+        self.result_dispatcher.call(self.sink.remove_source, source_id)
+        if self.inference_skipper is not None:
+            self.inference_skipper.remove(source_id)
+            self.apply_infer_interval()
+
+    def set_infer_element(self, pgie):
+        """
+        Let the inference skipping drive the interval property of the inference element
+        """
+        self.infer_element = pgie
+        self.infer_interval = self.inference_skipper.interval()
+        pgie.set_property("interval", self.infer_interval)
+
+    def apply_infer_interval(self):
+        interval = self.inference_skipper.interval()
+        if interval != self.infer_interval:
+            self.infer_interval = interval
+            if self.infer_element is not None:
+                self.infer_element.set_property("interval", interval)
+
+    def propagate_tracks(self, batch_meta, frames, timestamp):
+        """
+        Emit the tracked boxes of frames the inference element skipped, `frames` being
+        (frame meta, width, height) tuples
+        """
+        for frame_meta, width, height in frames:
+            carried = self.inference_skipper.propagate(frame_meta.source_id, frame_meta.frame_num)
+            if carried is None:
+                continue
+            boxes, scores, class_ids = carried
+            boxes = np.clip(boxes, 0, [width, height, width, height])
+            detections = Detections.from_columns(
+                boxes, scores, class_ids, np.zeros(scores.size), [(width, height)], [frame_meta.source_id])
+            self.emit_result(frame_meta.frame_num, frame_meta.source_id, timestamp, detections)
+            if self.draws(frame_meta):
+                add_detections_to_frame(
+                    pyds, self.object_style, batch_meta, frame_meta, detections, self.label_names, self.max_draw_objects)
+
+    def emit_result(self, frame_num, source_id, timestamp, detections):
+        """
+        Hand the detections of a frame to the sink and count them
+        """
+        # serialization and output happen on the result dispatcher thread
+        self.result_dispatcher.push(DetectionRecord(frame_num, source_id, timestamp, detections))
+        with self._emit_lock:
+            self.extracted_frame += 1
+        self.throughput.update(source_id, frame_num=frame_num)
+        if self.detections_counter is not None:
+            self.detections_counter.inc(len(detections), (source_id,))
+
+    def emit_offloaded(self, context, batch_detections):
+        """
+        Emit the detections of an offloaded batch, `context` being (timestamp, [(frame_num, source_id)])
+        """
+        timestamp, frames = context
+        for (frame_num, source_id), detections in zip(frames, batch_detections.split()):
+            self.emit_result(frame_num, source_id, timestamp, detections)
+
+    def record_timings(self, timings):
+        # batch level stages are recorded under stream None
+        for stage, seconds in timings.items():
+            self.latency.record(stage, None, seconds)
+
+    def draws(self, frame_meta):
+        """
+        Whether the detections of the frame are inserted as object meta for the preview
+        """
+        return self.is_save_output and (self.preview_streams <= 0 or frame_meta.pad_index < self.preview_streams)
+
     def make_elm_or_print_err(self, factoryname, name, printedname, detail=""):
         """ Creates an element with Gst Element Factory make.
             Return the element  if successfully created, otherwise print
@@ -139,100 +340,95 @@ class PipelineParts():
         return Gst.PadProbeReturn.OK
 
 
-    def add_obj_meta_to_frame(self, bbox, score, label, batch_meta, frame_meta):
-        """ 
-        Inserts an object into the metadata 
+    def add_latency_probes(self, pipeline, pgie, nvosd=None):
         """
-        untracked_obj_id=0xffffffffffffffff
-        # this is a good place to insert objects into the metadata.
-        # Here's an example of inserting a single object.
-        obj_meta = pyds.nvds_acquire_obj_meta_from_pool(batch_meta)
-        # Set bbox properties. These are in input resolution.
-        rect_params = obj_meta.rect_params
-        rect_params.left = int(bbox[0])
-        rect_params.top = int(bbox[1])
-        rect_params.width = int((bbox[2] - bbox[0]))
-        rect_params.height = int(bbox[3] - bbox[1])
-        #logger.info(f"rect_params.left: {rect_params.height}")
-
-        # Semi-transparent yellow backgroud
-        rect_params.has_bg_color = 0
-        rect_params.bg_color.set(1, 1, 0, 0.4)
-
-        # Red border of width 3
-        rect_params.border_width = 3
-        rect_params.border_color.set(1, 0, 0, 1)
-
-        # Set object info including class, detection confidence, etc.
-        obj_meta.confidence = score
-        #obj_meta.class_id = int(label)
-
-        # There is no tracking ID upon detection. The tracker will
-        # assign an ID.
-        obj_meta.object_id = untracked_obj_id
-
-        #lbl_id = int(label)
-        #if lbl_id >= len(label_names):
-        #    lbl_id = 0
-
-        # Set the object classification label.
-        obj_meta.obj_label = label
-
-        # Set display text for the object.
-        txt_params = obj_meta.text_params
-        if txt_params.display_text:
-            pyds.free_buffer(txt_params.display_text)
-
-        txt_params.x_offset = int(rect_params.left)
-        txt_params.y_offset = max(0, int(rect_params.top) - 10)
-        txt_params.display_text = (
-            label + " " + "{:04.3f}".format(score)
-        )
-        # Font , font-color and font-size
-        txt_params.font_params.font_name = "Serif"
-        txt_params.font_params.font_size = 10
-        # set(red, green, blue, alpha); set to White
-        txt_params.font_params.font_color.set(1.0, 1.0, 1.0, 1.0)
-
-        # Text background color
-        txt_params.set_bg_clr = 1
-        # set(red, green, blue, alpha); set to Black
-        txt_params.text_bg_clr.set(0.0, 0.0, 0.0, 1.0)
-
-        # Inser the object into current frame meta
-        # This object has no parent
-        pyds.nvds_add_obj_meta_to_frame(frame_meta, obj_meta, None)
+        Attach the latency probes: streammux sink pads stamp incoming frames, then
+        pgie sink ("mux"), pgie src ("infer", in pgie_src_pad_buffer_probe) and
+        either nvosd sink/src ("convert", "osd") or the sink ("sink") record laps.
+        """
+        streammux = pipeline.get_by_name("Stream-muxer")
+        for sinkpad in streammux.sinkpads:
+            pad_index = int(sinkpad.get_name().split("_")[-1])
+            sinkpad.add_probe(Gst.PadProbeType.BUFFER, self.streammux_sink_pad_buffer_probe, pad_index)
+
+        pgie.get_static_pad("sink").add_probe(
+            Gst.PadProbeType.BUFFER, self.latency_pad_buffer_probe, ("mux", False))
+        if nvosd is not None:
+            # batch meta does not survive the encode branch, nvosd src is the last stop
+            nvosd.get_static_pad("sink").add_probe(
+                Gst.PadProbeType.BUFFER, self.latency_pad_buffer_probe, ("convert", False))
+            nvosd.get_static_pad("src").add_probe(
+                Gst.PadProbeType.BUFFER, self.latency_pad_buffer_probe, ("osd", True))
+        else:
+            sink = pipeline.get_by_name("fake-sink")
+            sink.get_static_pad("sink").add_probe(
+                Gst.PadProbeType.BUFFER, self.latency_pad_buffer_probe, ("sink", True))
+
+    def streammux_sink_pad_buffer_probe(self, pad, info, pad_index):
+        """
+        Stamp every frame entering the streammux, keyed by sink pad index and pts
+        """
+        start_t = time.perf_counter()
+        gst_buffer = info.get_buffer()
+        if gst_buffer:
+            self.latency.start(pad_index, gst_buffer.pts, start_t)
+        self.latency.record_overhead(time.perf_counter() - start_t)
+        return Gst.PadProbeReturn.OK
 
+    def latency_pad_buffer_probe(self, pad, info, u_data):
+        """
+        Record, for every frame of the batch, the time since it passed the previous
+        latency probe. u_data: (stage name, whether this is the last probe)
+        """
+        start_t = time.perf_counter()
+        stage, finish = u_data
+        gst_buffer = info.get_buffer()
+        if gst_buffer:
+            batch_meta = pyds.gst_buffer_get_nvds_batch_meta(hash(gst_buffer))
+            l_frame = batch_meta.frame_meta_list
+            while l_frame is not None:
+                try:
+                    frame_meta = pyds.NvDsFrameMeta.cast(l_frame.data)
+                except StopIteration:
+                    break
+                self.latency.lap(frame_meta.pad_index, frame_meta.buf_pts, stage, start_t, finish)
+                try:
+                    l_frame = l_frame.next
+                except StopIteration:
+                    break
+        self.latency.record_overhead(time.perf_counter() - start_t)
+        return Gst.PadProbeReturn.OK
 
     def pgie_src_pad_buffer_probe(self, pad, info, u_data):
         """
         Get tensor_metadata from triton inference output 
         Convert tensor metadata to numpy array 
-        Postprocessing 
+        Collect the output tensors of every frame in the batch, then
+        postprocess the whole batch in one call
         """
+        probe_t = time.perf_counter()
+        timestamp = time.time()
         # get the buffer of info argument
         gst_buffer = info.get_buffer()
         if not gst_buffer:
             logger.warning("Unable to get GstBuffer ")
             return
-        #logger.info(f"gst_buffer: {gst_buffer}")
-        #logger.info(f"hash gst_buffer: {hash(gst_buffer)}")
 
         # Retrieve batch metadata from the gst_buffer
         # Note that pyds.gst_buffer_get_nvds_batch_meta() expects the
         # C address of gst_buffer as input, which is obtained with hash(gst_buffer)
         batch_meta = pyds.gst_buffer_get_nvds_batch_meta(hash(gst_buffer))
-        
-        #logger.info("batch_meta: {}".format(batch_meta))
+        if self.batch_controller is not None:
+            self.batch_controller.observe_batch(batch_meta.num_frames_in_batch)
         
         l_frame = batch_meta.frame_meta_list
 
-        #logger.info(f"l_frame.num_frames_in_batch: {batch_meta.num_frames_in_batch}")
-        #logger.info(f"l_fram.max_frames_in_batch: {batch_meta.max_frames_in_batch}")
-        #logger.info(f"l_frame: {l_frame}")
-        #label_names = self.get_label_names_from_file()
-        
-        c = 0
+        frame_metas = []
+        outputs = []
+        image_sizes = []
+        source_ids = []
+        # frames without output tensors, skipped by the inference interval
+        skipped_frames = []
         while l_frame is not None:
             try:
                 # Note that l_frame.data needs a cast to pyds.NvDsFrameMeta
@@ -240,19 +436,16 @@ class PipelineParts():
                 # in the C code, so the Python garbage collector will leave
                 # it alone.
                 frame_meta = pyds.NvDsFrameMeta.cast(l_frame.data)
-                #logger.info("frame_meta: {}".format(frame_meta))
             except StopIteration:
                 break
-            #logger.info(f"--> frame_num: {frame_meta.frame_num}")
+            if self.latency is not None:
+                self.latency.lap(frame_meta.pad_index, frame_meta.buf_pts, "infer", probe_t)
             l_user = frame_meta.frame_user_meta_list
-            #logger.info(f"l_user: {l_user}")
             
             if not self.is_save_output:
                 # get width and height of source video 
                 src_width = frame_meta.source_frame_width
                 src_height = frame_meta.source_frame_height
-                #logger.info(f"source_height: {src_height}")
-                #logger.info(f"source_width: {src_width}")
 
                 height_prp = src_height
                 width_prp = src_width
@@ -260,8 +453,7 @@ class PipelineParts():
                 height_prp = self.image_height
                 width_prp = self.image_width 
             
-            c += 1
-            #print("c: ", c)
+            num_outputs = len(outputs)
             while l_user is not None:
                 try:
                     # Note that l_user.data needs a cast to pyds.NvDsUserMeta
@@ -274,63 +466,94 @@ class PipelineParts():
 
                 if (
                         user_meta.base_meta.meta_type
-                        != pyds.NvDsMetaType.NVDSINFER_TENSOR_OUTPUT_META
+                        == pyds.NvDsMetaType.NVDSINFER_TENSOR_OUTPUT_META
                 ):
-                    #logger.info("user_meta: {}".format(user_meta))
-                    continue
-                
-                # get tensor-meta from triton inference output
-                tensor_meta = pyds.NvDsInferTensorMeta.cast(user_meta.user_meta_data)
-                #logger.info("tensor_meta: {}".format(tensor_meta))
-
-                # Boxes in the tensor meta should be in network resolution which is
-                # found in tensor_meta.network_info. Use this info to scale boxes to
-                # the input frame resolution.
-                layers_info = []
-                #logger.info(f"tensor_meta: {tensor_meta.num_output_layers}")
-                for i in range(tensor_meta.num_output_layers):
-                    layer = pyds.get_nvds_LayerInfo(tensor_meta, i)
-                    #logger.info(f"layer.dims: {layer.dims.d}, {layer.dims.numDims}, {layer.dims.numElements}")
-                    # Convert tensor metadata to numpy array
-                    ptr = ctypes.cast(pyds.get_ptr(layer.buffer), ctypes.POINTER(ctypes.c_float))
-                    output_np_array = np.ctypeslib.as_array(ptr, shape=(1, 6001, 1, 1))
-                    #logger.info(f"--> np_array.shape: {output_np_array.shape}")
-                    layers_info.append(layer)
-                #logger.info(f"layers_info: {layers_info}")
-                
-                detected_obj = postprocess(
-                    output_np_array, 
-                    width_prp, height_prp,
-                    conf_threshold=self.conf_thresh, 
-                    nms_threshold=self.nms_thresh)
-
-                bboxes = [[int(box.x1), int(box.y1), int(box.x2), int(box.y2)] for box in detected_obj]
-                labels = [self.label(int(box.classID)).name for box in detected_obj]
-                scores = [box.confidence for box in detected_obj]
-
-                ensemble_results = {
-                    "frame_%s"%frame_meta.frame_num:{
-                        "scores":scores, 
-                        "labels":labels, 
-                        "boxes":bboxes}
-                }
-                logger.info(f"--> ensemble_result: {ensemble_results}")
-
-                self.extracted_frame += 1
+                    # get tensor-meta from triton inference output
+                    tensor_meta = pyds.NvDsInferTensorMeta.cast(user_meta.user_meta_data)
+
+                    # Boxes in the tensor meta should be in network resolution which is
+                    # found in tensor_meta.network_info. Use this info to scale boxes to
+                    # the input frame resolution.
+                    # Zero-copy numpy views of the output layers, keyed by layer name
+                    layers = self.tensor_reader.read(tensor_meta)
+                    if self.output_layer is not None:
+                        output_np_array = layers[self.output_layer]
+                    else:
+                        output_np_array = list(layers.values())[-1]
+
+                    frame_metas.append(frame_meta)
+                    outputs.append(output_np_array.reshape(-1))
+                    image_sizes.append((width_prp, height_prp))
+                    source_ids.append(frame_meta.source_id)
+                    if self.tensor_capture is not None:
+                        self.tensor_capture.push(
+                            frame_meta.frame_num, frame_meta.source_id, width_prp, height_prp,
+                            timestamp, output_np_array)
 
                 try:
                     l_user = l_user.next
                 except StopIteration:
                     break
 
-                # If save video output is true, add bbox and score, label information to frame                     
-                if self.is_save_output:
-                    for bbox, score, label in zip(bboxes, scores, labels): 
-                        #logger.info(f"bounding box: {bbox}")
-                        self.add_obj_meta_to_frame(bbox, score, label, batch_meta, frame_meta)
+            if len(outputs) == num_outputs and self.inference_skipper is not None:
+                skipped_frames.append((frame_meta, width_prp, height_prp))
                 
             try:
                 l_frame = l_frame.next
             except StopIteration:
                 break
-        return Gst.PadProbeReturn.OK
\ No newline at end of file
+
+        if skipped_frames:
+            self.propagate_tracks(batch_meta, skipped_frames, timestamp)
+
+        if not outputs:
+            return Gst.PadProbeReturn.OK
+
+        timings = {} if self.latency is not None else None
+        if self.postprocess_pool is not None:
+            # frames drawn on the preview need their object meta before the buffer moves on,
+            # the others are postprocessed by the pool once their tensors are copied
+            drawn = [self.draws(frame_meta) for frame_meta in frame_metas]
+            if not all(drawn):
+                offloaded = [index for index, draws in enumerate(drawn) if not draws]
+                self.postprocess_pool.submit(
+                    [outputs[index] for index in offloaded],
+                    [image_sizes[index] for index in offloaded],
+                    [source_ids[index] for index in offloaded],
+                    (timestamp, [(frame_metas[index].frame_num, frame_metas[index].source_id) for index in offloaded]))
+                kept = [index for index, draws in enumerate(drawn) if draws]
+                frame_metas = [frame_metas[index] for index in kept]
+                outputs = [outputs[index] for index in kept]
+                image_sizes = [image_sizes[index] for index in kept]
+                source_ids = [source_ids[index] for index in kept]
+
+        if outputs:
+            batch_detections = postprocess_batch(
+                np.stack(outputs), 
+                image_sizes,
+                conf_threshold=self.conf_thresh, 
+                nms_threshold=self.nms_thresh,
+                source_ids=source_ids,
+                timings=timings)
+
+            for frame_meta, detections in zip(frame_metas, batch_detections.split()):
+                self.emit_result(frame_meta.frame_num, frame_meta.source_id, timestamp, detections)
+                if self.inference_skipper is not None:
+                    self.inference_skipper.update(frame_meta.source_id, frame_meta.frame_num, detections)
+
+                # If save video output is true, add bbox and score, label information to frame                     
+                if self.draws(frame_meta):
+                    meta_t = time.perf_counter()
+                    add_detections_to_frame(
+                        pyds, self.object_style, batch_meta, frame_meta, detections, self.label_names, self.max_draw_objects)
+                    if timings is not None:
+                        timings["meta"] = timings.get("meta", 0.0) + time.perf_counter() - meta_t
+
+        if self.inference_skipper is not None:
+            self.apply_infer_interval()
+
+        if self.latency is not None:
+            self.record_timings(timings)
+            self.latency.record("postprocess", None, time.perf_counter() - probe_t)
+
+        return Gst.PadProbeReturn.OK
@@ -1,4 +1,5 @@
 import gi  
+import math
 import os
 import pathlib
 import sys
@@ -11,12 +12,173 @@ gi.require_version("Gst", "1.0")
 from gi.repository import GObject, GLib, Gst
 from loguru import logger
 
+from ds_triton_pipeline.pipeline_builder import ElementSpec, PipelineBuilder, PipelineSpec
+
 config_path = os.path.join(file_path, "config_ds_triton_infer")
 ds_dali_yolo_config = os.path.join(config_path, "ds_dali_yolov5_trt_nopostprocess.txt")
 ds_yolo_config = os.path.join(config_path, "ds_yolov5_trt_nopostprocess.txt")
 grpc_ds_dali_yolo_config = os.path.join(config_path, "grpc_ds_dali_yolov5_trt_nopostprocess.txt")
 grpc_ds_yolo_config = os.path.join(config_path, "grpc_ds_yolov5_trt_nopostprocess.txt")
 
+# On Jetson, there is a problem with the encoder failing to initialize
+# due to limitation on TLS usage. To work around this, preload libgomp.
+# Add a reminder here in case the user forgets.
+preload_reminder = "If the following error is encountered:\n" + \
+                "/usr/lib/aarch64-linux-gnu/libgomp.so.1: cannot allocate memory in static TLS block\n" + \
+                "Preload the offending library:\n" + \
+                "export LD_PRELOAD=/usr/lib/aarch64-linux-gnu/libgomp.so.1\n"
+
+
+# PIPELINE SPECS
+def infer_config(is_dali=False, is_grpc=False):
+    """
+    nvinferserver config file: native or DALI preprocessing, Triton in process or over GRPC
+    """
+    if not is_dali:
+        if not is_grpc:
+            logger.info("DeepStream Triton yolov5 tensorRT inference")
+            return ds_yolo_config
+        logger.info("DeepStream GRPC Triton yolov5 tensorRT inference")
+        return grpc_ds_yolo_config
+    if not is_grpc:
+        logger.info("DeepStream Triton DALI yolov5 tensorRT inference")
+        return ds_dali_yolo_config
+    logger.info("DeepStream GRPC Triton DALI yolov5 tensorRT inference")
+    return grpc_ds_dali_yolo_config
+
+
+def source_kind(test_video):
+    """
+    Pipeline type of the inputs: "h264" elementary stream file, "uri" (file/https/rtsp uris),
+    "image" (jpeg files) or None if not supported
+    """
+    first = test_video[0]
+    if first.endswith(".h264") and not first.startswith("https://") and not first.startswith("file:///"):
+        return "h264"
+    if first.startswith("file://") or first.startswith("https://") or first.startswith("rtsp://"):
+        return "uri"
+    if os.path.isdir(first) or os.path.isfile(first) or first.endswith(".jpg") or first.endswith(".mjpeg"):
+        return "image"
+    return None
+
+
+def pipeline_spec(
+    kind, test_video,
+    batch_size=1,
+    is_save_output=True,
+    output_video_name="./out.mp4",
+    image_width=1920, image_height=1080,
+    is_dali=False, is_grpc=False,
+    preview_streams=0, preview_fps=5, preview_queue_size=2,
+    push_timeout=4.0):
+    """
+    PipelineSpec of a pipeline type:
+        h264:  filesrc -> h264parse -> nvv4l2decoder -> streammux -> nvinferserver -> output
+        uri:   source bins (uridecodebin) -> streammux -> nvinferserver -> output
+        image: filesrc -> jpegparse -> nvjpegdec -> streammux -> nvinferserver -> fakesink
+    The output is a fakesink. With `is_save_output` a tee splits it into the detections
+    branch, a queue and the fakesink at full rate, and the annotated preview branch:
+        leaky queue -> valve -> tiler -> videorate -> nvvideoconvert -> nvdsosd -> mp4 encode
+    The tiler shows the first `preview_streams` streams (0: all), videorate keeps at most
+    `preview_fps` frames per second (0: all). The leaky queue drops the oldest batches when
+    the encode falls behind, so the preview never holds back inference. The preview elements
+    are only in the spec when the video is saved.
+
+    `push_timeout` is the initial streammux batched-push-timeout in seconds.
+    """
+    spec = PipelineSpec("ds-triton-yolov5")
+    num_sources = len(test_video) if kind == "uri" else 1
+    mux_properties = [("width", image_width), ("height", image_height)]
+    if kind == "uri":
+        logger.info("Playing %s MP4 or URI file %s " % (len(test_video), (" ").join(test_video)))
+        for idx, uri_name in enumerate(test_video):
+            spec.add(ElementSpec(
+                "uridecodebin", "source-bin-%02d" % idx, "Source bin %d" % idx,
+                make=lambda idx=idx, uri_name=uri_name: create_source_bin(idx, uri_name), comment=uri_name))
+            spec.link("source-bin-%02d" % idx, "Stream-muxer", "src", "sink_%d" % idx)
+        if any(uri_name.find("rtsp://") == 0 for uri_name in test_video):
+            logger.info("At least one of the source is live")
+            mux_properties.append(("live-source", 1))
+    else:
+        logger.info("Playing file %s " % test_video[0])
+        if kind == "h264":
+            # elementary h264 stream, hardware accelerated decode on GPU
+            spec.add(ElementSpec("filesrc", "file-source", "Source", [("location", test_video[0])]))
+            spec.add(ElementSpec("h264parse", "h264-parser", "H264Parser"))
+            spec.add(ElementSpec("nvv4l2decoder", "nvv4l2-decoder", "Decoder"))
+            spec.chain("file-source", "h264-parser", "nvv4l2-decoder")
+            spec.link("nvv4l2-decoder", "Stream-muxer", "src", "sink_0")
+        else:
+            spec.add(ElementSpec("filesrc", "file-source", "Source", [("location", test_video[0])]))
+            spec.add(ElementSpec("jpegparse", "jpeg-parser", "JPEGParser"))
+            spec.add(ElementSpec("nvjpegdec", "nvjpeg-decoder", "Decoder"))
+            spec.chain("file-source", "jpeg-parser", "nvjpeg-decoder")
+            spec.link("nvjpeg-decoder", "Stream-muxer", "src", "sink_0")
+    mux_properties.append(("batch-size", batch_size if num_sources == 1 else num_sources))
+    mux_properties.append(("batched-push-timeout", int(push_timeout * 1e6)))
+    # nvstreammux forms batches from one or more sources
+    spec.add(ElementSpec("nvstreammux", "Stream-muxer", "NvStreamMux", mux_properties))
+
+    # nvinferserver runs the inference on the batches, its behaviour is set by the config file
+    infer_properties = [("config-file-path", infer_config(is_dali, is_grpc))]
+    if kind == "image":
+        infer_properties.append(("batch-size", 1))
+    spec.add(ElementSpec("nvinferserver", "primary-inference", "Nvinferserver", infer_properties))
+    spec.link("Stream-muxer", "primary-inference")
+
+    if is_save_output and kind != "image":
+        spec.add(ElementSpec("tee", "infer-tee", "Tee"))
+        spec.link("primary-inference", "infer-tee")
+        spec.add(ElementSpec("queue", "detections-queue", "Detections queue"))
+        spec.add(ElementSpec("fakesink", "fake-sink", "FakeSink"))
+        spec.link("infer-tee", "detections-queue", "src_0", "sink")
+        spec.link("detections-queue", "fake-sink")
+
+        # leaky downstream: drop the oldest queued batches instead of blocking the tee
+        spec.add(ElementSpec("queue", "preview-queue", "Preview queue", [
+            ("leaky", 2), ("max-size-buffers", preview_queue_size), ("max-size-bytes", 0), ("max-size-time", 0)]))
+        spec.add(ElementSpec("valve", "preview-valve", "Preview valve", [("drop", False)]))
+        tiles = min(preview_streams, num_sources) if preview_streams > 0 else num_sources
+        columns = int(math.ceil(math.sqrt(tiles)))
+        spec.add(ElementSpec("nvmultistreamtiler", "tiler", "Tiler", [
+            ("rows", int(math.ceil(tiles / columns))), ("columns", columns),
+            ("width", image_width), ("height", image_height)]))
+        spec.link("infer-tee", "preview-queue", "src_1", "sink")
+        preview = ["preview-queue", "preview-valve", "tiler"]
+        if preview_fps > 0:
+            spec.add(ElementSpec("videorate", "preview-rate", "Preview rate", [
+                ("max-rate", preview_fps), ("drop-only", True)]))
+            preview.append("preview-rate")
+
+        # convert NV12 to RGBA for the OSD, then encode and save the osd output
+        spec.add(ElementSpec("nvvideoconvert", "convertor", "Nvvidconv"))
+        spec.add(ElementSpec("nvdsosd", "onscreendisplay", "OSD (nvosd)"))
+        spec.add(ElementSpec("queue", "queue", "Queue"))
+        spec.add(ElementSpec("nvvideoconvert", "convertor2", "Converter 2 (nvvidconv2)"))
+        spec.add(ElementSpec("capsfilter", "capsfilter", "capsfilter", caps="video/x-raw, format=I420"))
+        spec.add(ElementSpec("avenc_mpeg4", "encoder", "Encoder", [("bitrate", 2000000)], detail=preload_reminder))
+        spec.add(ElementSpec("mpeg4videoparse", "mpeg4-parser", "Code Parser"))
+        spec.add(ElementSpec("qtmux", "qtmux", "Container"))
+        spec.add(ElementSpec(
+            "filesink", "filesink", "Sink", [("location", output_video_name), ("sync", 0), ("async", 0)]))
+        spec.chain(
+            *preview, "convertor", "onscreendisplay", "queue", "convertor2", "capsfilter",
+            "encoder", "mpeg4-parser", "qtmux", "filesink")
+    else:
+        spec.add(ElementSpec("fakesink", "fake-sink", "FakeSink"))
+        spec.link("primary-inference", "fake-sink")
+    return spec
+
+
+def build_pipeline(pipeline, pl, spec):
+    """
+    Build `spec` into `pipeline`, return (pipeline, {name: element}, builder with the timings)
+    """
+    builder = PipelineBuilder(pl.make_elm_or_print_err)
+    logger.info("Adding and linking elements in the Pipeline \n")
+    pipeline, elements = builder.build(spec, pipeline)
+    return pipeline, elements, builder
+
 
 # PIPELINE FOR H264 DEEPSTREAM TRITON INFERENCE
 def h264_pipeline(
@@ -30,137 +192,11 @@ def h264_pipeline(
     """
     Build pipeline for inference h264 stream video input
     """
-    try:
-        # Source element for reading from the file
-        source = pl.make_elm_or_print_err("filesrc", "file-source", "Source")
-
-        # Since the data format in the input file is elementary h264 stream,
-        # we need a h264parser
-        h264parser = pl.make_elm_or_print_err("h264parse", "h264-parser", "H264Parser")
-        parser = h264parser
-
-        # Use nvdec_h264 for hardware accelerated decode on GPU
-        decoder = pl.make_elm_or_print_err("nvv4l2decoder", "nvv4l2-decoder", "Decoder")
-
-        # Create nvstreammux instance to form batches from one or more sources.
-        streammux = pl.make_elm_or_print_err("nvstreammux", "Stream-muxer", "NvStreamMux")
-
-        # Use nvinferserver to run inferencing on decoder's output,
-        # behaviour of inferencing is set through config file
-        pgie = pl.make_elm_or_print_err("nvinferserver", "primary-inference", "Nvinferserver")
-
-        # Use convertor to convert from NV12 to RGBA as required by nvosd
-        nvvidconv = pl.make_elm_or_print_err("nvvideoconvert", "convertor", "Nvvidconv")
-
-        # Create OSD to draw on the converted RGBA buffer
-        nvosd = pl.make_elm_or_print_err("nvdsosd", "onscreendisplay", "OSD (nvosd)")
-
-        # Finally encode and save the osd output
-        queue = pl.make_elm_or_print_err("queue", "queue", "Queue")
-
-        nvvidconv2 = pl.make_elm_or_print_err("nvvideoconvert", "convertor2", "Converter 2 (nvvidconv2)")
-
-        capsfilter = pl.make_elm_or_print_err("capsfilter", "capsfilter", "capsfilter")
-
-        caps = Gst.Caps.from_string("video/x-raw, format=I420")
-        capsfilter.set_property("caps", caps)
-
-        # On Jetson, there is a problem with the encoder failing to initialize
-        # due to limitation on TLS usage. To work around this, preload libgomp.
-        # Add a reminder here in case the user forgets.
-        preload_reminder = "If the following error is encountered:\n" + \
-                        "/usr/lib/aarch64-linux-gnu/libgomp.so.1: cannot allocate memory in static TLS block\n" + \
-                        "Preload the offending library:\n" + \
-                        "export LD_PRELOAD=/usr/lib/aarch64-linux-gnu/libgomp.so.1\n"
-        encoder = pl.make_elm_or_print_err("avenc_mpeg4", "encoder", "Encoder", preload_reminder)
-
-        encoder.set_property("bitrate", 2000000)
-
-        codeparser = pl.make_elm_or_print_err("mpeg4videoparse", "mpeg4-parser", 'Code Parser')
-
-        container = pl.make_elm_or_print_err("qtmux", "qtmux", "Container")
-
-        if is_save_output:
-            sink = pl.make_elm_or_print_err("filesink", "filesink", "Sink")
-
-            sink.set_property("location", output_video_name)
-            sink.set_property("sync", 0)
-            sink.set_property("async", 0)
-        else:
-            sink = pl.make_elm_or_print_err("fakesink", "fake-sink", "FakeSink")
-
-        logger.info("Playing file %s " % test_video_file)
-        source.set_property("location", test_video_file)
-        streammux.set_property("width", image_width)
-        streammux.set_property("height", image_height)
-        streammux.set_property("batch-size", batch_size)
-        streammux.set_property("batched-push-timeout", 4000000)
-        if not is_dali:
-            if not is_grpc:
-                logger.info("DeepStream Triton yolov5 tensorRT inference")
-                pgie.set_property("config-file-path", ds_yolo_config)
-            else:
-                logger.info("DeepStream GRPC Triton yolov5 tensorRT inference")
-                pgie.set_property("config-file-path", grpc_ds_yolo_config)
-        else:
-            if not is_grpc:
-                logger.info("DeepStream Triton DALI yolov5 tensorRT inference")
-                pgie.set_property("config-file-path", ds_dali_yolo_config)
-            else:
-
-                logger.info("DeepStream GRPC Triton DALI yolov5 tensorRT inference")
-                pgie.set_property("config-file-path", grpc_ds_dali_yolo_config)
-
-        logger.info("Adding elements to Pipeline \n")
-        pipeline.add(source)
-        pipeline.add(parser)
-        pipeline.add(decoder)
-        pipeline.add(streammux)
-        pipeline.add(pgie)
-        if is_save_output:
-            pipeline.add(nvvidconv)
-            pipeline.add(nvosd)
-            pipeline.add(queue)
-            pipeline.add(nvvidconv2)
-            pipeline.add(capsfilter)
-            pipeline.add(encoder)
-            pipeline.add(codeparser)
-            pipeline.add(container)
-        pipeline.add(sink)
-
-        # we link the elements together
-        # file-source -> h264-parser -> nvh264-decoder ->
-        # nvinfer -> nvvidconv -> nvosd -> video-renderer
-        logger.info("Linking elements in the Pipeline \n")
-        source.link(parser)
-        parser.link(decoder)
-
-        # streammux link to decoded frame sink_0
-        sinkpad = streammux.get_request_pad("sink_0")
-        if not sinkpad:
-            logger.opt(colors=True).warning("WARNING: Unable to get the sink pad of streammux \n")
-        srcpad = decoder.get_static_pad("src")
-        if not srcpad:
-            logger.opt(colors=True).warning("WARNING: Unable to get source pad of decoder \n")
-        srcpad.link(sinkpad)
-        streammux.link(pgie)
-
-        if is_save_output:
-            pgie.link(nvvidconv)
-            nvvidconv.link(nvosd)
-            nvosd.link(queue)
-            queue.link(nvvidconv2)
-            nvvidconv2.link(capsfilter)
-            capsfilter.link(encoder)
-            encoder.link(codeparser)
-            codeparser.link(container)
-            container.link(sink)
-        else:
-            pgie.link(sink)
-        
-        return pipeline, pgie, nvosd
-    except Exception as ex:
-        logger.error("ERROR: %s" % ex)
+    spec = pipeline_spec(
+        "h264", [test_video_file], batch_size, is_save_output, output_video_name, image_width, image_height,
+        is_dali, is_grpc)
+    pipeline, elements, _ = build_pipeline(pipeline, pl, spec)
+    return pipeline, elements["primary-inference"], elements.get("onscreendisplay")
 
 
 #----------------------------------------------------------------------------------
@@ -248,149 +284,11 @@ def uri_local_pipeline(
     """
     Build Pipeline for inference mp4 and URI video 
     """
-    try:
-        # Source element for reading from the uri or local file
-        # Create nvstreammux instance to form batches from one or more sources.
-        streammux = pl.make_elm_or_print_err("nvstreammux", "Stream-muxer", "NvStreamMux")
-
-        # Use nvinferserver to run inferencing on decoder's output,
-        # behaviour of inferencing is set through config file
-        pgie = pl.make_elm_or_print_err("nvinferserver", "primary-inference", "Nvinferserver")
-
-        # Use convertor to convert from NV12 to RGBA as required by nvosd
-        nvvidconv = pl.make_elm_or_print_err("nvvideoconvert", "convertor", "Nvvidconv")
-
-        # Create OSD to draw on the converted RGBA buffer
-        nvosd = pl.make_elm_or_print_err("nvdsosd", "onscreendisplay", "OSD (nvosd)")
-
-
-        # Finally encode and save the osd output
-        queue = pl.make_elm_or_print_err("queue", "queue", "Queue")
-
-        nvvidconv2 = pl.make_elm_or_print_err("nvvideoconvert", "convertor2", "Converter 2 (nvvidconv2)")
-
-        capsfilter = pl.make_elm_or_print_err("capsfilter", "capsfilter", "capsfilter")
-
-        caps = Gst.Caps.from_string("video/x-raw, format=I420")
-        capsfilter.set_property("caps", caps)
-
-        # On Jetson, there is a problem with the encoder failing to initialize
-        # due to limitation on TLS usage. To work around this, preload libgomp.
-        # Add a reminder here in case the user forgets.
-        preload_reminder = "If the following error is encountered:\n" + \
-                        "/usr/lib/aarch64-linux-gnu/libgomp.so.1: cannot allocate memory in static TLS block\n" + \
-                        "Preload the offending library:\n" + \
-                        "export LD_PRELOAD=/usr/lib/aarch64-linux-gnu/libgomp.so.1\n"
-        encoder = pl.make_elm_or_print_err("avenc_mpeg4", "encoder", "Encoder", preload_reminder)
-
-        encoder.set_property("bitrate", 2000000)
-
-        codeparser = pl.make_elm_or_print_err("mpeg4videoparse", "mpeg4-parser", 'Code Parser')
-
-        container = pl.make_elm_or_print_err("qtmux", "qtmux", "Container")
-
-        if is_save_output:
-            sink = pl.make_elm_or_print_err("filesink", "filesink", "Sink")
-
-            sink.set_property("location", output_video_name)
-            sink.set_property("sync", 0)
-            sink.set_property("async", 0)
-        else:
-            sink = pl.make_elm_or_print_err("fakesink", "fake-sink", "FakeSink")
-
-        logger.info("Playing %s MP4 or URI file %s " % (len(test_video_file), (" ").join(test_video_file)))
-        is_live = False
-        
-        pipeline.add(streammux)    
-        for idx in range(len(test_video_file)):
-            uri_name = test_video_file[idx]
-            if uri_name.find("rtsp://") == 0:
-                is_live = True
-
-            source_bin = create_source_bin(idx, uri_name)
-            if not source_bin:
-                logger.opt(colors=True).warning("Unable to create source bin \n")
-            padname = "sink_%s" % idx
-
-            pipeline.add(source_bin)
-
-            # streamux link to decode frame by padname
-            sinkpad = streammux.get_request_pad(padname)
-            if not sinkpad:
-                logger.warning("Unable to create sink pad bin \n")
-            
-            srcpad = source_bin.get_static_pad("src")
-            if not srcpad:
-                logger.warning("Unable to create src pad bin \n")
-            
-            srcpad.link(sinkpad)   
-
-        if is_live:
-            logger.info("At least one of the source is live")
-            streammux.set_property("live-source", 1) 
-        
-        streammux.set_property("width", image_width)
-        streammux.set_property("height", image_height)
-        if len(test_video_file) == 1:
-            streammux.set_property("batch-size", batch_size)
-        else: 
-            streammux.set_property("batch-size", len(test_video_file))
-        streammux.set_property("batched-push-timeout", 4000000)
-
-        if not is_dali:
-            if not is_grpc:
-                logger.info("DeepStream Triton yolov5 tensorRT inference")
-                pgie.set_property("config-file-path", ds_yolo_config)
-            else:
-                logger.info("DeepStream GRPC Triton yolov5 tensorRT inference")
-                pgie.set_property("config-file-path", grpc_ds_yolo_config)
-        else:
-            if not is_grpc:
-                logger.info("DeepStream Triton DALI yolov5 tensorRT inference")
-                pgie.set_property("config-file-path", ds_dali_yolo_config)
-            else:
-
-                logger.info("DeepStream GRPC Triton DALI yolov5 tensorRT inference")
-                pgie.set_property("config-file-path", grpc_ds_dali_yolo_config)
-
-        logger.info("Adding elements to Pipeline \n")
-        pipeline.add(pgie)
-
-        if is_save_output:
-            pipeline.add(nvvidconv)
-            pipeline.add(nvosd)
-            pipeline.add(queue)
-            pipeline.add(nvvidconv2)
-            pipeline.add(capsfilter)
-            pipeline.add(encoder)
-            pipeline.add(codeparser)
-            pipeline.add(container)
-        pipeline.add(sink)
-
-        # we link the elements together
-        # uri -> uridecode bin ->
-        # nvinfer -> nvvidconv -> nvosd -> video-renderer
-        logger.info("Linking elements in the Pipeline \n")
-
-
-        streammux.link(pgie)
-        if is_save_output:
-            pgie.link(nvvidconv)
-            nvvidconv.link(nvosd)
-            nvosd.link(queue)
-            queue.link(nvvidconv2)
-            nvvidconv2.link(capsfilter)
-            capsfilter.link(encoder)
-            encoder.link(codeparser)
-            codeparser.link(container)
-            container.link(sink)
-        else:
-            pgie.link(sink)
-        
-        return pipeline, pgie, nvosd
-    except Exception as ex:
-        logger.error("ERROR: %s" % ex)
-
+    spec = pipeline_spec(
+        "uri", test_video_file, batch_size, is_save_output, output_video_name, image_width, image_height,
+        is_dali, is_grpc)
+    pipeline, elements, _ = build_pipeline(pipeline, pl, spec)
+    return pipeline, elements["primary-inference"], elements.get("onscreendisplay")
 
 
 # --------------------------------------------------------------------------------------------------------
@@ -403,84 +301,8 @@ def image_pipeline(
     output_video_name="./out.mp4", 
     image_width=1920, image_height=1080, 
     is_dali=False, is_grpc=False):
-    try:
-        # Source element for reading from the file
-        logger.info("Creating Source \n ")
-        source = pl.make_elm_or_print_err("filesrc", "file-source", "Source")
-        
-        # Since the data format in the input file is jpeg,
-        # we need a jpegparser
-        logger.info("Creating jpegParser \n")
-        jpegparser = pl.make_elm_or_print_err("jpegparse", "jpeg-parser", "JPEGParser")
-        
-        # Use nvdec for hardware accelerated decode on GPU
-        logger.info("Creating Decoder \n")
-        #decoder = pl.make_elm_or_print_err("nvv4l2decoder", "nvv4l2-decoder", "Decoder")
-        decoder = pl.make_elm_or_print_err("nvjpegdec", "nvjpeg-decoder", "Decoder")
-        
-        # Create nvstreammux instance to form batches from one or more sources.
-        streammux = pl.make_elm_or_print_err("nvstreammux", "Stream-muxer", "NvStreamMux")
-        
-        # Create segmentation for primary inference
-        pgie = pl.make_elm_or_print_err("nvinferserver", "primary-inference", "Nvinferserver")
-
-        sink = pl.make_elm_or_print_err("fakesink", "fake-sink", "FakeSink")
-
-        
-        logger.info("Playing file %s " % test_video_file)
-        source.set_property('location', test_video_file)
-
-        streammux.set_property('width', image_width)
-        streammux.set_property('height', image_height)
-        streammux.set_property('batch-size', batch_size)
-        streammux.set_property('batched-push-timeout', 4000000)
-        if not is_dali:
-            if not is_grpc:
-                logger.info("DeepStream Triton yolov5 tensorRT inference")
-                pgie.set_property("config-file-path", ds_yolo_config)
-            else:
-                logger.info("DeepStream GRPC Triton yolov5 tensorRT inference")
-                pgie.set_property("config-file-path", grpc_ds_yolo_config)
-        else:
-            if not is_grpc:
-                logger.info("DeepStream Triton DALI yolov5 tensorRT inference")
-                pgie.set_property("config-file-path", ds_dali_yolo_config)
-            else:
-
-                logger.info("DeepStream GRPC Triton DALI yolov5 tensorRT inference")
-                pgie.set_property("config-file-path", grpc_ds_dali_yolo_config)
-        
-        pgie_batch_size = pgie.get_property("batch-size")
-        if pgie_batch_size != 1:
-            logger.warning(f"WARNING: Overriding infer-config batch-size {pgie_batch_size} with number of sources 1 \n")
-            pgie.set_property("batch-size", 1)
-        
-        #sink.set_property("qos", 0)
-        logger.info("Adding elements to Pipeline \n")
-        pipeline.add(source)
-        pipeline.add(jpegparser)
-        pipeline.add(decoder)
-        pipeline.add(streammux)
-        pipeline.add(pgie)
-        pipeline.add(sink)
-
-        # we link the elements together
-        # file-source -> jpeg-parser -> nvv4l2-decoder ->
-        # nvinfer -> nvsegvisual -> sink
-        logger.info("Linking elements in the Pipeline \n")
-        source.link(jpegparser)
-        jpegparser.link(decoder)
-
-        sinkpad = streammux.get_request_pad("sink_0")
-        if not sinkpad:
-            logger.warning(" Unable to get the sink pad of streammux \n")
-        srcpad = decoder.get_static_pad("src")
-        if not srcpad:
-            logger.warning(" Unable to get source pad of decoder \n")
-        srcpad.link(sinkpad)
-        streammux.link(pgie)
-        pgie.link(sink)
-        
-        return pipeline, pgie
-    except Exception as ex:
-        logger.error("ERROR: {}".format(ex))    
\ No newline at end of file
+    spec = pipeline_spec(
+        "image", [test_video_file], batch_size, False, output_video_name, image_width, image_height,
+        is_dali, is_grpc)
+    pipeline, elements, _ = build_pipeline(pipeline, pl, spec)
+    return pipeline, elements["primary-inference"]
@@ -0,0 +1,350 @@
+import threading
+import time
+
+import gi
+
+gi.require_version("Gst", "1.0")
+from gi.repository import GLib, Gst
+from loguru import logger
+
+from common.metrics_server import MetricFamily
+from ds_triton_pipeline.pipeline_type import create_source_bin
+
+
+SOURCE_STATES = ("up", "reconnecting", "down")
+
+
+class SourceManager:
+    """
+    Attach and detach uridecodebin source bins while the pipeline is PLAYING. Source ids are
+    the nvstreammux sink pad indices, so they are also the frame meta source ids; the lowest
+    free id is reused after a removal. Gst calls only happen on the GLib main loop: the
+    public methods may be called from any thread and wait for the loop to run them.
+
+    A source whose bin posts an error, whose live stream ends or that delivers no frame for
+    `stall_timeout` seconds (0: never) is rebuilt on the same pad after `backoff_initial` seconds,
+    doubling up to `backoff_max` on every failed attempt, while the other sources keep
+    streaming. It is "reconnecting" until its first frame, then "up" again; after
+    `max_reconnects` failed attempts in a row (0: never) it is left "down". With a
+    `backoff_initial` of 0 nothing is reconnected.
+
+    The streammux batch size is not changed at runtime, start the pipeline with a
+    --batch_size that fits the largest number of sources.
+    """
+    def __init__(
+        self, pipeline, streammux, pl=None, max_sources=64, call_timeout=10.0,
+        backoff_initial=1.0, backoff_max=60.0, max_reconnects=0, stall_timeout=0.0, clock=time.monotonic):
+        self.pipeline = pipeline
+        self.streammux = streammux
+        self.pl = pl
+        self.max_sources = max_sources
+        self.call_timeout = call_timeout
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.max_reconnects = max_reconnects
+        self.stall_timeout = stall_timeout
+        self.clock = clock
+        # source id -> {"uri", "bin", "state", "attempts", "reconnects", "down_since", "downtime",
+        #               "attached", "last_buffer", "timer", "mark_up_queued"}
+        self.sources = {}
+        self._lock = threading.Lock()
+        self._watchdog = None
+
+    def _record(self, uri, source_bin):
+        now = self.clock()
+        return {
+            "uri": uri, "bin": source_bin, "state": "up", "attempts": 0, "reconnects": 0,
+            "down_since": None, "downtime": 0.0, "attached": now, "last_buffer": None, "timer": None,
+            "mark_up_queued": False}
+
+    def start(self):
+        """
+        Start the stall watchdog, on the GLib main loop
+        """
+        if self.backoff_initial > 0 and self.stall_timeout > 0 and self._watchdog is None:
+            self._watchdog = GLib.timeout_add_seconds(1, self._check_stalls)
+
+    def adopt(self, uris):
+        """
+        Manage the source bins built by uri_local_pipeline, source-bin-<id> for every uri
+        """
+        for source_id, uri in enumerate(uris):
+            source_bin = self.pipeline.get_by_name("source-bin-%02d" % source_id)
+            if source_bin is None:
+                continue
+            sinkpad = self.streammux.get_static_pad("sink_%u" % source_id)
+            if sinkpad is not None:
+                sinkpad.add_probe(Gst.PadProbeType.BUFFER, self._buffer_probe, source_id)
+            with self._lock:
+                self.sources[source_id] = self._record(uri, source_bin)
+
+    def _call(self, function, *args):
+        """
+        Run `function` on the GLib main loop, return its result or raise its exception
+        """
+        done = threading.Event()
+        result = {}
+
+        def run():
+            try:
+                result["value"] = function(*args)
+            except Exception as ex:
+                result["error"] = ex
+            done.set()
+            return False
+
+        GLib.idle_add(run)
+        if not done.wait(self.call_timeout):
+            raise TimeoutError(f"{function.__name__} did not run within {self.call_timeout} s")
+        if "error" in result:
+            raise result["error"]
+        return result["value"]
+
+    def add(self, uri):
+        """
+        Decode `uri` into a new streammux sink pad, return its source id
+        """
+        return self._call(self._add, uri)
+
+    def remove(self, source_id):
+        return self._call(self._remove, source_id)
+
+    def list(self):
+        """
+        Sources with their health: state, reconnects and seconds spent not up
+        """
+        now = self.clock()
+        with self._lock:
+            return [{
+                "source_id": source_id,
+                "uri": source["uri"],
+                "state": source["state"],
+                "reconnects": source["reconnects"],
+                "downtime": source["downtime"] + (now - source["down_since"] if source["down_since"] is not None else 0.0),
+            } for source_id, source in sorted(self.sources.items())]
+
+    def register_metrics(self, registry):
+        registry.add_collector(self.collect_metrics)
+
+    def collect_metrics(self):
+        sources = self.list()
+        return [
+            MetricFamily("ds_source_state", "gauge", "1 for the current health state of the source",
+                         [({"source": source["source_id"], "state": state}, int(source["state"] == state))
+                          for source in sources for state in SOURCE_STATES]),
+            MetricFamily("ds_source_reconnects_total", "counter", "Source bin rebuilds",
+                         [({"source": source["source_id"]}, source["reconnects"]) for source in sources]),
+            MetricFamily("ds_source_downtime_seconds_total", "counter", "Seconds the source was not up",
+                         [({"source": source["source_id"]}, source["downtime"]) for source in sources]),
+        ]
+
+    def _attach(self, source_id, uri):
+        """
+        Build the source bin of `uri` and link it to streammux pad `source_id`, return the bin
+        """
+        source_bin = create_source_bin(source_id, uri)
+        if source_bin is None:
+            raise RuntimeError(f"Unable to create a source bin for {uri}")
+        self.pipeline.add(source_bin)
+        sinkpad = self.streammux.get_request_pad("sink_%u" % source_id)
+        if sinkpad is None:
+            self.pipeline.remove(source_bin)
+            raise RuntimeError(f"Unable to get streammux sink pad sink_{source_id}")
+        if source_bin.get_static_pad("src").link(sinkpad) != Gst.PadLinkReturn.OK:
+            self.streammux.release_request_pad(sinkpad)
+            self.pipeline.remove(source_bin)
+            raise RuntimeError(f"Unable to link source {source_id} to the streammux")
+        sinkpad.add_probe(Gst.PadProbeType.BUFFER, self._buffer_probe, source_id)
+        if self.pl is not None and self.pl.latency is not None:
+            sinkpad.add_probe(Gst.PadProbeType.BUFFER, self.pl.streammux_sink_pad_buffer_probe, source_id)
+
+        if source_bin.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+            self._release(source_id, source_bin)
+            raise RuntimeError(f"Unable to start source {source_id} ({uri})")
+        return source_bin
+
+    def _add(self, uri):
+        with self._lock:
+            source_id = next((index for index in range(self.max_sources) if index not in self.sources), None)
+        if source_id is None:
+            raise ValueError(f"All {self.max_sources} sources are in use")
+        source_bin = self._attach(source_id, uri)
+        with self._lock:
+            self.sources[source_id] = self._record(uri, source_bin)
+        logger.info(f"Added source {source_id}: {uri}")
+        return source_id
+
+    def _release(self, source_id, source_bin):
+        """
+        Stop the bin, flush and release its streammux pad and drop it from the pipeline
+        """
+        state_return = source_bin.set_state(Gst.State.NULL)
+        if state_return == Gst.StateChangeReturn.ASYNC:
+            state_return, _, _ = source_bin.get_state(int(self.call_timeout * Gst.SECOND))
+        if state_return == Gst.StateChangeReturn.FAILURE:
+            logger.warning(f"WARNING: Source {source_id} did not stop cleanly")
+        sinkpad = self.streammux.get_static_pad("sink_%u" % source_id)
+        if sinkpad is not None:
+            # clear the flushing state streammux keeps per pad, then give the pad back
+            sinkpad.send_event(Gst.Event.new_flush_stop(False))
+            self.streammux.release_request_pad(sinkpad)
+        self.pipeline.remove(source_bin)
+
+    def _remove(self, source_id):
+        with self._lock:
+            source = self.sources.pop(source_id, None)
+        if source is None:
+            raise KeyError(f"No source {source_id}")
+        if source["timer"] is not None:
+            GLib.source_remove(source["timer"])
+        if source["bin"] is not None:
+            self._release(source_id, source["bin"])
+        if self.pl is not None:
+            self.pl.remove_source(source_id)
+        logger.info(f"Removed source {source_id}: {source['uri']}")
+        return source_id
+
+    def source_of(self, element):
+        """
+        Id of the managed source bin `element` belongs to, None if it is not in one
+        """
+        while element is not None:
+            name = element.get_name()
+            if name.startswith("source-bin-"):
+                source_id = int(name[len("source-bin-"):])
+                return source_id if source_id in self.sources else None
+            element = element.get_parent()
+        return None
+
+    def source_error(self, message):
+        """
+        bus_call error hook: take over the errors of managed source bins, which are then
+        rebuilt instead of stopping the pipeline. Return True if the error was handled.
+        """
+        source_id = self.source_of(message.src) if self.backoff_initial > 0 else None
+        if source_id is None:
+            return False
+        error, _ = message.parse_error()
+        GLib.idle_add(self._fail, source_id, str(error))
+        return True
+
+    def _fail(self, source_id, reason):
+        """
+        Release the bin of a failed source and schedule its rebuild with exponential backoff
+        """
+        source = self.sources.get(source_id)
+        if source is None or source["state"] == "down" or source["timer"] is not None:
+            # removed, given up or already waiting for its rebuild
+            return False
+        logger.warning(f"WARNING: Source {source_id} failed: {reason}")
+        if source["bin"] is not None:
+            self._release(source_id, source["bin"])
+            if self.pl is not None:
+                self.pl.remove_source(source_id)
+        with self._lock:
+            source["bin"] = None
+            source["attempts"] += 1
+            if source["down_since"] is None:
+                source["down_since"] = self.clock()
+            if self.max_reconnects and source["attempts"] > self.max_reconnects:
+                source["state"] = "down"
+            else:
+                source["state"] = "reconnecting"
+        if source["state"] == "down":
+            logger.error(f"ERROR: Source {source_id} is down after {self.max_reconnects} reconnect attempts")
+            return False
+        delay = min(self.backoff_initial * 2 ** (source["attempts"] - 1), self.backoff_max)
+        logger.info(f"Reconnecting source {source_id} in {delay:.1f} s")
+        source["timer"] = GLib.timeout_add(int(delay * 1000), self._reconnect, source_id)
+        return False
+
+    def _reconnect(self, source_id):
+        source = self.sources.get(source_id)
+        if source is None:
+            return False
+        source["timer"] = None
+        try:
+            source_bin = self._attach(source_id, source["uri"])
+        except Exception as ex:
+            self._fail(source_id, str(ex))
+            return False
+        with self._lock:
+            source["bin"] = source_bin
+            source["reconnects"] += 1
+            source["attached"] = self.clock()
+            source["last_buffer"] = None
+            source["mark_up_queued"] = False
+        return False
+
+    def _buffer_probe(self, pad, info, source_id):
+        """
+        Streammux sink pad probe: time of the last frame of the source, a reconnecting
+        source is up again with its first frame
+        """
+        source = self.sources.get(source_id)
+        if source is not None:
+            source["last_buffer"] = self.clock()
+            # queued once per reconnect, not for every frame until the main loop runs it
+            if source["state"] == "reconnecting" and not source["mark_up_queued"]:
+                source["mark_up_queued"] = True
+                GLib.idle_add(self._mark_up, source_id)
+        return Gst.PadProbeReturn.OK
+
+    def _mark_up(self, source_id):
+        source = self.sources.get(source_id)
+        if source is None or source["state"] != "reconnecting" or source["bin"] is None:
+            return False
+        with self._lock:
+            source["state"] = "up"
+            source["attempts"] = 0
+            if source["down_since"] is not None:
+                source["downtime"] += self.clock() - source["down_since"]
+                source["down_since"] = None
+        logger.info(f"Source {source_id} is up again")
+        return False
+
+    def _check_stalls(self):
+        """
+        Watchdog: fail the attached sources that delivered no frame for `stall_timeout` seconds.
+        Sources that never delivered one since the pipeline started are left to their bin's
+        own errors, the first frames can wait long on the inference server start.
+        """
+        now = self.clock()
+        for source_id, source in list(self.sources.items()):
+            if source["bin"] is None:
+                continue
+            last = source["last_buffer"]
+            if last is None:
+                if source["state"] != "reconnecting":
+                    continue
+                last = source["attached"]
+            if now - last > self.stall_timeout:
+                self._fail(source_id, f"no frame for {now - last:.1f} s")
+        return True
+
+    def bus_message(self, bus, message):
+        """
+        Bus watch: handle nvstreammux end of stream messages of single sources. A live (rtsp)
+        source is reconnected, others are removed.
+        """
+        if message.type != Gst.MessageType.ELEMENT:
+            return True
+        structure = message.get_structure()
+        if structure is not None and structure.has_name("stream-eos"):
+            parsed, source_id = structure.get_uint("stream-id")
+            source = self.sources.get(source_id) if parsed else None
+            if source is not None:
+                logger.info(f"End of stream of source {source_id}")
+                # the pad is still streaming its EOS, release it from a later loop iteration
+                if self.backoff_initial > 0 and source["uri"].startswith("rtsp://"):
+                    GLib.idle_add(self._fail, source_id, "end of stream")
+                else:
+                    GLib.idle_add(self._remove_ended, source_id)
+        return True
+
+    def _remove_ended(self, source_id):
+        try:
+            self._remove(source_id)
+        except KeyError:
+            pass
+        return False
@@ -0,0 +1,77 @@
+import ctypes
+import importlib
+
+import numpy as np
+
+from loguru import logger
+
+
+# NvDsInferDataType name -> (numpy dtype, ctypes element type)
+INFER_DATA_TYPES = {
+    "FLOAT": (np.float32, ctypes.c_float),
+    "HALF": (np.float16, ctypes.c_uint16),
+    "INT8": (np.int8, ctypes.c_int8),
+    "INT32": (np.int32, ctypes.c_int32),
+}
+
+
+class LayerLayout:
+    """
+    Name, dtype and shape of an output layer, with a cached ctypes array type
+    to build numpy views over the layer buffer without copying.
+    """
+    def __init__(self, name, dtype, shape, c_type):
+        self.name = name
+        self.dtype = np.dtype(dtype)
+        self.shape = tuple(shape)
+        self.num_elements = int(np.prod(self.shape))
+        self._array_type = c_type * self.num_elements
+
+    def view(self, address):
+        """
+        Read-only numpy view over the layer buffer at `address`
+        """
+        array = np.frombuffer(self._array_type.from_address(address), dtype=self.dtype).reshape(self.shape)
+        array.flags.writeable = False
+        return array
+
+
+class TensorReader:
+    """
+    Zero-copy access to the output layers of nvinferserver NvDsInferTensorMeta.
+    Layer name, dtype and dims are read from NvDsInferLayerInfo once per layer index,
+    then every frame only costs a pointer lookup and a numpy view.
+    `pyds_module` defaults to the real pyds, any module with the same API works.
+    """
+    def __init__(self, pyds_module=None):
+        self.pyds = pyds_module if pyds_module is not None else importlib.import_module("pyds")
+        self._data_types = {
+            getattr(self.pyds.NvDsInferDataType, name): types for name, types in INFER_DATA_TYPES.items()}
+        self._layouts = {}
+
+    def layout(self, layer_info, index):
+        """
+        Cached LayerLayout of the layer at `index`
+        """
+        layout = self._layouts.get(index)
+        if layout is None:
+            dims = layer_info.dims
+            shape = list(dims.d)[:dims.numDims]
+            if layer_info.dataType not in self._data_types:
+                raise ValueError(f"Unsupported data type {layer_info.dataType} of layer {layer_info.layerName}")
+            dtype, c_type = self._data_types[layer_info.dataType]
+            layout = LayerLayout(layer_info.layerName, dtype, shape, c_type)
+            self._layouts[index] = layout
+            logger.info(f"Output layer {index}: {layout.name} {layout.dtype} {layout.shape}")
+        return layout
+
+    def read(self, tensor_meta):
+        """
+        Return {layer name: read-only numpy view} of all output layers, in layer order
+        """
+        views = {}
+        for i in range(tensor_meta.num_output_layers):
+            layer_info = self.pyds.get_nvds_LayerInfo(tensor_meta, i)
+            layout = self.layout(layer_info, i)
+            views[layout.name] = layout.view(self.pyds.get_ptr(layer_info.buffer))
+        return views
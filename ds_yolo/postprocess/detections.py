@@ -0,0 +1,153 @@
+import numpy as np
+
+from postprocess.labels import LabelSet
+
+
+class Detections:
+    """
+    Columnar detections of a batch, backed by contiguous numpy arrays and sorted by frame.
+    Frame b owns rows offsets[b]:offsets[b + 1], so per-frame slices are views.
+
+    boxes: (N, 4) float32 x1, y1, x2, y2 in source resolution
+    scores: (N,) float32 confidences
+    class_ids: (N,) int32
+    frame_ids: (N,) int32 index of the frame in the batch
+    source_ids: (N,) int32 source (stream) id of the frame
+    offsets: (B + 1,) int64 row offsets of the frames
+    image_sizes: (B, 2) int64 source (width, height) of the frames
+    """
+    def __init__(self, boxes, scores, class_ids, frame_ids, source_ids, offsets, image_sizes):
+        self.boxes = boxes
+        self.scores = scores
+        self.class_ids = class_ids
+        self.frame_ids = frame_ids
+        self.source_ids = source_ids
+        self.offsets = offsets
+        self.image_sizes = image_sizes
+        self._normalized_boxes = None
+
+    @classmethod
+    def from_columns(cls, boxes, scores, class_ids, frame_ids, image_sizes, source_ids=None):
+        """
+        Build from frame-sorted columns, casting them to the container dtypes.
+        `source_ids` holds one id per frame, the frame index by default.
+        """
+        image_sizes = np.asarray(image_sizes, dtype=np.int64).reshape(-1, 2)
+        num_frames = image_sizes.shape[0]
+        frame_ids = np.ascontiguousarray(frame_ids, dtype=np.int32)
+        if source_ids is None:
+            source_ids = np.arange(num_frames, dtype=np.int32)
+        source_ids = np.asarray(source_ids, dtype=np.int32).reshape(num_frames)
+
+        offsets = np.zeros(num_frames + 1, dtype=np.int64)
+        np.cumsum(np.bincount(frame_ids, minlength=num_frames), out=offsets[1:])
+        return cls(
+            np.ascontiguousarray(boxes, dtype=np.float32).reshape(-1, 4),
+            np.ascontiguousarray(scores, dtype=np.float32),
+            np.ascontiguousarray(class_ids, dtype=np.int32),
+            frame_ids,
+            source_ids[frame_ids],
+            offsets,
+            image_sizes)
+
+    @classmethod
+    def empty(cls, image_sizes=(), source_ids=None):
+        return cls.from_columns(np.empty((0, 4)), np.empty(0), np.empty(0), np.empty(0), image_sizes, source_ids)
+
+    @classmethod
+    def concatenate(cls, parts):
+        """
+        Detections of consecutive batches merged into one, frames keep their order
+        """
+        parts = list(parts)
+        if not parts:
+            return cls.empty()
+        counts = np.concatenate([np.diff(part.offsets) for part in parts])
+        offsets = np.zeros(counts.size + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        return cls(
+            np.concatenate([part.boxes for part in parts]),
+            np.concatenate([part.scores for part in parts]),
+            np.concatenate([part.class_ids for part in parts]),
+            np.repeat(np.arange(counts.size, dtype=np.int32), counts),
+            np.concatenate([part.source_ids for part in parts]),
+            offsets,
+            np.concatenate([part.image_sizes for part in parts]))
+
+    def __len__(self):
+        return self.scores.shape[0]
+
+    @property
+    def num_frames(self):
+        return self.offsets.size - 1
+
+    def frame(self, index):
+        """
+        Zero-copy view of the detections of frame `index`
+        """
+        start, end = self.offsets[index], self.offsets[index + 1]
+        frame = Detections(
+            self.boxes[start:end],
+            self.scores[start:end],
+            self.class_ids[start:end],
+            self.frame_ids[start:end],
+            self.source_ids[start:end],
+            np.array([0, end - start], dtype=np.int64),
+            self.image_sizes[index:index + 1])
+        if self._normalized_boxes is not None:
+            frame._normalized_boxes = self._normalized_boxes[start:end]
+        return frame
+
+    def split(self):
+        """
+        Per-frame views, in batch order
+        """
+        return [self.frame(index) for index in range(self.num_frames)]
+
+    @property
+    def normalized_boxes(self):
+        """
+        Boxes divided by their frame's source size, computed on first access
+        """
+        if self._normalized_boxes is None:
+            sizes = np.repeat(self.image_sizes, np.diff(self.offsets), axis=0).astype(np.float32)
+            self._normalized_boxes = self.boxes / np.tile(sizes, 2)
+        return self._normalized_boxes
+
+    def int_boxes(self):
+        """
+        Boxes truncated to integer pixels, as drawn and reported
+        """
+        return self.boxes.astype(np.int32)
+
+    def labels(self, label_names):
+        """
+        Names of the detected classes, `label_names` being a LabelSet or a list indexed by class id
+        """
+        if isinstance(label_names, LabelSet):
+            return label_names.lookup(self.class_ids).tolist()
+        return [label_names[class_id] for class_id in self.class_ids.tolist()]
+
+    def to_dict(self, label_names):
+        """
+        JSON serializable {"scores", "labels", "boxes"} of the detections
+        """
+        return {
+            "scores": self.scores.tolist(),
+            "labels": self.labels(label_names),
+            "boxes": self.int_boxes().tolist()}
+
+    def display_texts(self, label_names):
+        """
+        "<label> <score>" object display text of every detection
+        """
+        if isinstance(label_names, LabelSet):
+            return label_names.display_texts(self.class_ids.tolist(), self.scores.tolist())
+        return ["%s %.3f" % (label, score) for label, score in zip(self.labels(label_names), self.scores.tolist())]
+
+    def objects(self, label_names):
+        """
+        (box, score, label, display text) tuples for object meta insertion
+        """
+        return zip(
+            self.int_boxes().tolist(), self.scores.tolist(), self.labels(label_names), self.display_texts(label_names))
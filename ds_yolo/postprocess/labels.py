@@ -1,5 +1,10 @@
+import os
+import re
+
 from enum import Enum
 
+import numpy as np
+
 
 class FlagLabels(Enum):
     co_viet_tan = 0
@@ -18,6 +23,93 @@ class HorrorLabels(Enum):
     horror = 1
     safe = 0
 
+
+class LabelSet(tuple):
+    """
+    Class names of a model indexed by class id, usable wherever a list of label names is.
+    Built once per model: `array` maps a whole class id array to names with one numpy
+    index, `display_prefixes` holds the "<name> " start of every object display text.
+    """
+    def __new__(cls, names, name=None):
+        label_set = super().__new__(cls, names)
+        label_set.name = name
+        label_set.array = np.array(label_set, dtype=object)
+        label_set.display_prefixes = tuple(label + " " for label in label_set)
+        return label_set
+
+    def __getnewargs__(self):
+        return tuple(self), self.name
+
+    @classmethod
+    def from_enum(cls, labels):
+        """
+        Label set of an Enum whose values are class ids
+        """
+        names = [None] * (max(label.value for label in labels) + 1)
+        for label in labels:
+            names[label.value] = label.name
+        return cls([f"class_{class_id}" if label is None else label for class_id, label in enumerate(names)],
+                   labels.__name__)
+
+    @classmethod
+    def from_file(cls, path):
+        """
+        Label set of a DeepStream labels.txt: one class name per line, in class id order
+        """
+        with open(path) as f:
+            names = [line.strip() for line in f]
+        while names and not names[-1]:
+            names.pop()
+        return cls(names, path)
+
+    @classmethod
+    def from_config(cls, path):
+        """
+        Label set of the labelfile_path of an nvinferserver config, relative to the config
+        """
+        with open(path) as f:
+            match = re.search(r'^\s*labelfile_path\s*:\s*"([^"]+)"', f.read(), re.MULTILINE)
+        if match is None:
+            raise ValueError(f"No labelfile_path in {path}")
+        return cls.from_file(os.path.join(os.path.dirname(os.path.abspath(path)), match.group(1)))
+
+    def lookup(self, class_ids):
+        """
+        Object array of the names of `class_ids`
+        """
+        return self.array[class_ids]
+
+    def display_texts(self, class_ids, scores):
+        """
+        "<name> <score>" object display text of every detection
+        """
+        prefixes = self.display_prefixes
+        return [prefixes[class_id] + "%.3f" % score for class_id, score in zip(class_ids, scores)]
+
+
+LABEL_SETS = {
+    "flag": LabelSet.from_enum(FlagLabels),
+    "nsfw": LabelSet.from_enum(NSFWLabels),
+    "horror": LabelSet.from_enum(HorrorLabels),
+}
+
+
+def get_label_set(label_type):
+    """
+    Label set of a registered label type (flag/nsfw/horror), a labels.txt file or an
+    nvinferserver config with a labelfile_path
+    """
+    label_set = LABEL_SETS.get(label_type)
+    if label_set is not None:
+        return label_set
+    if not os.path.isfile(label_type):
+        raise ValueError(f"Unknown label type {label_type}, expected one of {sorted(LABEL_SETS)} or a labels file")
+    with open(label_type) as f:
+        is_config = "labelfile_path" in f.read()
+    label_set = LabelSet.from_config(label_type) if is_config else LabelSet.from_file(label_type)
+    LABEL_SETS[label_type] = label_set
+    return label_set
+
 if __name__ == "__main__":
     x = FlagLabels(0).name
     print(x)
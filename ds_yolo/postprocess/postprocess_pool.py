@@ -0,0 +1,140 @@
+import concurrent.futures
+import queue
+import threading
+import time
+
+import numpy as np
+
+from loguru import logger
+
+from postprocess.trt_postprocess import postprocess_batch
+
+
+class PostprocessPool:
+    """
+    Run the batch postprocess on `workers` threads instead of in the pad probe; the
+    vectorized decode and NMS spend most of their time in numpy, which releases the GIL.
+
+    `submit` copies the output tensors of a batch into one of `max_in_flight` reusable
+    buffers (the inference buffer is recycled once the probe returns) and returns.
+    When all buffers are in flight it waits for one, so a slow postprocess throttles the
+    pipeline instead of queueing without bound. Every batch gets a sequence number and
+    `emit(context, detections)` is called in submission order, one batch at a time, so
+    the results of every stream stay in frame order.
+    Batches submitted after `stop` are postprocessed and emitted by the caller.
+    If `timings` is given, it is called with the {"decode", "nms"} seconds and the time
+    from submission to emission ("offload") of every batch.
+    """
+    def __init__(self, emit, conf_threshold=0.5, nms_threshold=0.45, workers=2, max_in_flight=4, timings=None):
+        self.emit = emit
+        self.conf_threshold = conf_threshold
+        self.nms_threshold = nms_threshold
+        self.workers = workers
+        self.max_in_flight = max_in_flight
+        self.timings = timings
+
+        self.submitted = 0
+        self.emitted = 0
+        self.errors = 0
+        self.waits = 0
+        self.late = 0
+        self._buffers = [None] * max_in_flight
+        self._free = queue.Queue()
+        for slot in range(max_in_flight):
+            self._free.put(slot)
+        self._done = {}
+        self._next_seq = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def start(self):
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix="postprocess")
+
+    def stop(self):
+        """
+        Postprocess and emit the batches in flight, then stop the worker threads
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        logger.info(
+            f"[INFO] offloaded batches: {self.submitted}, emitted: {self.emitted}, errors: {self.errors}, "
+            f"waits for a free buffer: {self.waits}")
+
+    def in_flight(self):
+        return self.max_in_flight - self._free.qsize()
+
+    def _buffer(self, slot, num_frames, tensor):
+        """
+        Buffer `slot` sized for at least `num_frames` tensors like `tensor`, reallocated
+        only when the batch grows or the tensor changes
+        """
+        buffer = self._buffers[slot]
+        if buffer is None or buffer.shape[0] < num_frames or buffer.shape[1:] != tensor.shape or buffer.dtype != tensor.dtype:
+            rows = max(num_frames, buffer.shape[0] if buffer is not None else 0)
+            buffer = self._buffers[slot] = np.empty((rows,) + tensor.shape, dtype=tensor.dtype)
+        return buffer
+
+    def submit(self, outputs, image_sizes, source_ids, context):
+        """
+        Queue the postprocess of the batch of output tensors `outputs`, `context` is handed
+        back to `emit` with its detections. Called from the pad probe.
+        """
+        try:
+            slot = self._free.get_nowait()
+        except queue.Empty:
+            self.waits += 1
+            slot = self._free.get()
+        buffer = self._buffer(slot, len(outputs), outputs[0])
+        for row, output in enumerate(outputs):
+            buffer[row] = output
+        seq = self.submitted
+        self.submitted += 1
+        args = (seq, slot, len(outputs), list(image_sizes), list(source_ids), context, time.perf_counter())
+        executor = self._executor
+        if executor is not None:
+            try:
+                executor.submit(self._run, *args)
+                return
+            except RuntimeError:
+                # stopped since
+                pass
+        if self.late == 0:
+            logger.warning("WARNING: batch submitted to a stopped postprocess pool, postprocessing it in the caller")
+        self.late += 1
+        self._run(*args)
+
+    def _run(self, seq, slot, num_frames, image_sizes, source_ids, context, submit_t):
+        timings = {} if self.timings is not None else None
+        detections = None
+        try:
+            detections = postprocess_batch(
+                self._buffers[slot][:num_frames], image_sizes,
+                conf_threshold=self.conf_threshold, nms_threshold=self.nms_threshold,
+                source_ids=source_ids, timings=timings)
+        except Exception as ex:
+            with self._lock:
+                self.errors += 1
+            logger.error(f"ERROR: postprocess of batch {seq} failed: {ex}")
+        finally:
+            # the detections are copies, the buffer can take the next batch
+            self._free.put(slot)
+
+        with self._lock:
+            self._done[seq] = (context, detections, submit_t, timings)
+            # whichever worker completes the next batch in sequence emits every batch ready after it
+            while self._next_seq in self._done:
+                context, detections, submit_t, timings = self._done.pop(self._next_seq)
+                self._next_seq += 1
+                if detections is None:
+                    continue
+                try:
+                    self.emit(context, detections)
+                    self.emitted += 1
+                except Exception as ex:
+                    self.errors += 1
+                    logger.error(f"ERROR: postprocess result emission failed: {ex}")
+                if timings is not None:
+                    timings["offload"] = time.perf_counter() - submit_t
+                    self.timings(timings)
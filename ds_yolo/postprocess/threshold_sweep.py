@@ -0,0 +1,88 @@
+import numpy as np
+
+from postprocess.detections import Detections
+from postprocess.trt_postprocess import (
+    _greedy_keep, _group_bounds, _group_overlap_pairs, _scale_boxes, _sorted_candidates)
+
+
+class ThresholdSweep:
+    """
+    Postprocess a batch for many (conf, iou) threshold pairs at once.
+    Candidates passing the lowest confidence threshold are sorted, scaled and paired
+    once, with the IoU of every pair above the lowest NMS threshold. Each setting then
+    only masks candidates and pairs and reruns the greedy keep on them, giving the same
+    detections as `postprocess_batch` with that setting.
+    """
+    def __init__(self, buffers, image_sizes, min_conf_threshold, min_nms_threshold, source_ids=None):
+        buffers = buffers.reshape(buffers.shape[0], -1)
+        self.num_frames = buffers.shape[0]
+        self.image_sizes = np.asarray(image_sizes, dtype=np.int64).reshape(self.num_frames, 2)
+        self.source_ids = source_ids
+
+        self.frames, self.class_ids, bboxes = _sorted_candidates(buffers, min_conf_threshold)
+        self.scores = bboxes[:, 4]
+        starts, sizes = _group_bounds(self.frames, self.class_ids)
+        self.first, self.second, self.ious = _group_overlap_pairs(
+            bboxes, starts, sizes, min_nms_threshold, with_iou=True)
+        self.boxes = _scale_boxes(bboxes, self.image_sizes[self.frames, 0], self.image_sizes[self.frames, 1])
+        self.valid = (self.boxes[:, 0] != self.boxes[:, 2]) & (self.boxes[:, 1] != self.boxes[:, 3])
+
+    def __len__(self):
+        return self.scores.size
+
+    def keep(self, conf_threshold, nms_threshold):
+        """
+        Mask of the candidates kept with this setting
+        """
+        selected = self.scores >= conf_threshold
+        pairs = selected[self.first] & selected[self.second] & ~(self.ious <= nms_threshold)
+        keep = _greedy_keep(self.scores.size, self.first[pairs], self.second[pairs])
+        keep &= selected
+        keep &= self.valid
+        return keep
+
+    def frame_counts(self, keep):
+        """
+        Number of kept detections of every frame
+        """
+        return np.bincount(self.frames[keep], minlength=self.num_frames)
+
+    def detections(self, conf_threshold, nms_threshold):
+        keep = self.keep(conf_threshold, nms_threshold)
+        return Detections.from_columns(
+            self.boxes[keep], self.scores[keep], self.class_ids[keep], self.frames[keep],
+            self.image_sizes, self.source_ids)
+
+
+def box_iou(boxes, other):
+    """
+    (N, M) IoU of x1, y1, x2, y2 boxes
+    """
+    width = np.minimum(boxes[:, None, 2], other[None, :, 2]) - np.maximum(boxes[:, None, 0], other[None, :, 0])
+    height = np.minimum(boxes[:, None, 3], other[None, :, 3]) - np.maximum(boxes[:, None, 1], other[None, :, 1])
+    intersection = np.maximum(width, 0) * np.maximum(height, 0)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    other_areas = (other[:, 2] - other[:, 0]) * (other[:, 3] - other[:, 1])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.nan_to_num(intersection / (areas[:, None] + other_areas[None, :] - intersection))
+
+
+def match_counts(boxes, scores, class_ids, truth_boxes, truth_class_ids, match_iou=0.5):
+    """
+    True positives, false positives and false negatives of the detections of one frame
+    against its ground truth: detections are matched greedily by score to the unmatched
+    ground truth box of the same class with the highest IoU of at least `match_iou`
+    """
+    if not len(truth_boxes):
+        return 0, len(scores), 0
+    iou = box_iou(boxes, truth_boxes)
+    iou[class_ids[:, None] != truth_class_ids[None, :]] = 0
+    matched = np.zeros(len(truth_boxes), dtype=bool)
+    true_positives = 0
+    for index in np.argsort(-scores, kind="stable"):
+        candidates = np.where(matched, 0, iou[index])
+        best = int(np.argmax(candidates))
+        if candidates[best] >= match_iou:
+            matched[best] = True
+            true_positives += 1
+    return true_positives, len(scores) - true_positives, len(truth_boxes) - true_positives
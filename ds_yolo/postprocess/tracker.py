@@ -0,0 +1,253 @@
+import threading
+
+import numpy as np
+
+from postprocess.threshold_sweep import box_iou
+
+
+def match_boxes(boxes, class_ids, other, other_class_ids, iou_threshold):
+    """
+    Greedy one to one matching of two box sets by decreasing IoU, only within a class.
+    Return (indices, other indices, IoU) of the pairs with IoU >= iou_threshold.
+    """
+    iou = box_iou(boxes, other)
+    iou[np.asarray(class_ids)[:, None] != np.asarray(other_class_ids)[None, :]] = 0.0
+    index, other_index = np.nonzero(iou >= iou_threshold)
+    order = np.argsort(-iou[index, other_index], kind="stable")
+    matched = []
+    other_matched = []
+    used = set()
+    other_used = set()
+    for row, column in zip(index[order].tolist(), other_index[order].tolist()):
+        if row in used or column in other_used:
+            continue
+        used.add(row)
+        other_used.add(column)
+        matched.append(row)
+        other_matched.append(column)
+    matched = np.asarray(matched, dtype=np.int64)
+    other_matched = np.asarray(other_matched, dtype=np.int64)
+    return matched, other_matched, iou[matched, other_matched]
+
+
+class BoxTracker:
+    """
+    IoU matched constant velocity Kalman tracker of the detections of one stream, updated on
+    inferred frames and queried in between to carry the boxes over skipped frames.
+
+    Every track holds cx, cy, w, h and their velocities per frame. The four coordinates share
+    one motion model and one measurement history, so a single 2x2 (position, velocity)
+    covariance per track serves all of them. `process_noise` and `measurement_noise` are
+    absolute constants, not scaled by the box size. The gain only depends on the update
+    history of a track (updates and frames between them), not on the object scale.
+    """
+    def __init__(self, iou_threshold=0.3, max_misses=2, process_noise=1e-3, measurement_noise=1e-2):
+        self.iou_threshold = iou_threshold
+        self.max_misses = max_misses
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+
+        self.frame_num = None
+        self.positions = np.empty((0, 4))
+        self.velocities = np.empty((0, 4))
+        self.covariances = np.empty((0, 2, 2))
+        self.scores = np.empty(0, dtype=np.float32)
+        self.class_ids = np.empty(0, dtype=np.int32)
+        self.misses = np.empty(0, dtype=np.int32)
+
+    def __len__(self):
+        return self.scores.size
+
+    def _predict(self, frame_num):
+        dt = max(frame_num - self.frame_num, 0) if self.frame_num is not None else 0
+        positions = self.positions + self.velocities * dt
+        p00, p01, p11 = self.covariances[:, 0, 0], self.covariances[:, 0, 1], self.covariances[:, 1, 1]
+        q = self.process_noise
+        covariances = np.empty_like(self.covariances)
+        covariances[:, 0, 0] = p00 + 2 * dt * p01 + dt * dt * p11 + q * dt ** 3 / 3
+        covariances[:, 0, 1] = p01 + dt * p11 + q * dt ** 2 / 2
+        covariances[:, 1, 0] = covariances[:, 0, 1]
+        covariances[:, 1, 1] = p11 + q * dt
+        return positions, covariances
+
+    @staticmethod
+    def _corners(positions):
+        half = positions[:, 2:] / 2
+        return np.concatenate([positions[:, :2] - half, positions[:, :2] + half], axis=1)
+
+    def predict(self, frame_num):
+        """
+        (boxes, scores, class ids) of the tracks seen at the last update, moved to `frame_num`.
+        The tracker state is left unchanged.
+        """
+        live = self.misses == 0
+        positions, _ = self._predict(frame_num)
+        return self._corners(positions[live]), self.scores[live], self.class_ids[live]
+
+    def update(self, boxes, scores, class_ids, frame_num):
+        """
+        Match the detections of an inferred frame to the tracks, correct the matched tracks,
+        start new ones and retire those missed more than `max_misses` times in a row.
+        Return {"matched", "born", "lost", "iou", "motion"}: mean IoU between the matched
+        predictions and detections, mean center speed of the matched tracks in box heights
+        per frame.
+        """
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        class_ids = np.asarray(class_ids, dtype=np.int32)
+        positions, covariances = self._predict(frame_num)
+        velocities = self.velocities.copy()
+        tracks, detections, matched_iou = match_boxes(
+            self._corners(positions), self.class_ids, boxes, class_ids, self.iou_threshold)
+
+        # Kalman correction of the matched tracks, the measurement is the position itself
+        measured = np.concatenate([(boxes[:, :2] + boxes[:, 2:]) / 2, boxes[:, 2:] - boxes[:, :2]], axis=1)
+        covariance = covariances[tracks]
+        innovation = covariance[:, 0, 0] + self.measurement_noise
+        position_gain = covariance[:, 0, 0] / innovation
+        velocity_gain = covariance[:, 1, 0] / innovation
+        residual = measured[detections] - positions[tracks]
+        positions[tracks] += position_gain[:, None] * residual
+        velocities[tracks] += velocity_gain[:, None] * residual
+        corrected = covariance.copy()
+        corrected[:, 0, 0] -= position_gain * covariance[:, 0, 0]
+        corrected[:, 0, 1] -= position_gain * covariance[:, 0, 1]
+        corrected[:, 1, 0] -= velocity_gain * covariance[:, 0, 0]
+        corrected[:, 1, 1] -= velocity_gain * covariance[:, 0, 1]
+        covariances[tracks] = corrected
+
+        track_scores = self.scores.copy()
+        track_scores[tracks] = np.asarray(scores, dtype=np.float32)[detections]
+        misses = self.misses + 1
+        misses[tracks] = 0
+        motion = 0.0
+        if tracks.size:
+            speeds = np.hypot(velocities[tracks, 0], velocities[tracks, 1])
+            motion = float((speeds / np.maximum(positions[tracks, 3], 1.0)).mean())
+
+        # unmatched detections start tracks at rest with an uncertain velocity
+        born = np.ones(boxes.shape[0], dtype=bool)
+        born[detections] = False
+        num_born = int(born.sum())
+        new_covariances = np.zeros((num_born, 2, 2))
+        new_covariances[:, 0, 0] = self.measurement_noise
+        new_covariances[:, 1, 1] = 1.0
+
+        kept = misses <= self.max_misses
+        self.positions = np.concatenate([positions[kept], measured[born]])
+        self.velocities = np.concatenate([velocities[kept], np.zeros((num_born, 4))])
+        self.covariances = np.concatenate([covariances[kept], new_covariances])
+        self.scores = np.concatenate([track_scores[kept], np.asarray(scores, dtype=np.float32)[born]])
+        self.class_ids = np.concatenate([self.class_ids[kept], class_ids[born]])
+        self.misses = np.concatenate([misses[kept], np.zeros(num_born, dtype=np.int32)])
+        self.frame_num = frame_num
+        return {
+            "matched": int(tracks.size),
+            "born": num_born,
+            "lost": int(misses.size - tracks.size),
+            "iou": float(matched_iou.mean()) if tracks.size else 1.0,
+            "motion": motion,
+        }
+
+
+class AdaptiveInterval:
+    """
+    Inference interval of one stream: raised by one after every stable inferred frame up to
+    `max_interval`, dropped back to `min_interval` as soon as objects appear, disappear or
+    move away from their predicted boxes.
+    """
+    def __init__(self, min_interval=0, max_interval=4, stable_iou=0.7, max_motion=0.02):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.stable_iou = stable_iou
+        self.max_motion = max_motion
+        self.interval = min_interval
+
+    def observe(self, stats):
+        stable = (
+            stats["born"] == 0 and stats["lost"] == 0
+            and stats["iou"] >= self.stable_iou and stats["motion"] <= self.max_motion)
+        if stable:
+            self.interval = min(self.interval + 1, self.max_interval)
+        else:
+            self.interval = self.min_interval
+        return self.interval
+
+
+class InferenceSkipper:
+    """
+    Tracker assisted inference skipping over all streams: a BoxTracker and an AdaptiveInterval
+    per stream, fed by the inferred frames and queried for the skipped ones. Inference
+    skipping applies to whole batches, so the interval to run is the lowest one any stream
+    asks for. Counters are guarded by a lock so `snapshot` can run on another thread.
+    """
+    def __init__(self, max_interval=4, min_interval=0, stable_iou=0.7, max_motion=0.02, **tracker_kwargs):
+        self.max_interval = max_interval
+        self.min_interval = min_interval
+        self.stable_iou = stable_iou
+        self.max_motion = max_motion
+        self.tracker_kwargs = tracker_kwargs
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def _stream(self, source_id):
+        stream = self._streams.get(source_id)
+        if stream is None:
+            with self._lock:
+                stream = self._streams.get(source_id)
+                if stream is None:
+                    stream = self._streams[source_id] = {
+                        "tracker": BoxTracker(**self.tracker_kwargs),
+                        "interval": AdaptiveInterval(
+                            self.min_interval, self.max_interval, self.stable_iou, self.max_motion),
+                        "inferred": 0,
+                        "skipped": 0,
+                    }
+        return stream
+
+    def update(self, source_id, frame_num, detections):
+        """
+        Feed the detections of an inferred frame, return the stream's new interval
+        """
+        stream = self._stream(source_id)
+        stats = stream["tracker"].update(detections.boxes, detections.scores, detections.class_ids, frame_num)
+        interval = stream["interval"].observe(stats)
+        with self._lock:
+            stream["inferred"] += 1
+        return interval
+
+    def propagate(self, source_id, frame_num):
+        """
+        (boxes, scores, class ids) carried to a skipped frame, None for an unknown stream
+        """
+        stream = self._streams.get(source_id)
+        if stream is None:
+            return None
+        with self._lock:
+            stream["skipped"] += 1
+        return stream["tracker"].predict(frame_num)
+
+    def remove(self, source_id):
+        with self._lock:
+            self._streams.pop(source_id, None)
+
+    def interval(self):
+        """
+        Interval for the inference element, the lowest one of all streams
+        """
+        with self._lock:
+            intervals = [stream["interval"].interval for stream in self._streams.values()]
+        return min(intervals) if intervals else self.min_interval
+
+    def snapshot(self):
+        """
+        {source id: {"interval", "inferred", "skipped", "tracks"}}
+        """
+        with self._lock:
+            return {
+                source_id: {
+                    "interval": stream["interval"].interval,
+                    "inferred": stream["inferred"],
+                    "skipped": stream["skipped"],
+                    "tracks": len(stream["tracker"]),
+                }
+                for source_id, stream in self._streams.items()}
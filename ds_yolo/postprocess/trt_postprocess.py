@@ -1,11 +1,37 @@
+import time
+
 from loguru import logger
 
 import numpy as np
 
+from postprocess.detections import Detections
+
 np.set_printoptions(threshold=np.inf)
 
 INPUT_HEIGHT = 640
 INPUT_WIDTH = 640
+# yolov5 tensorrt output: [num_bboxes, (cx, cy, w, h, confidence, class_id) * max_output_bbox_count]
+BOX_SIZE = 6
+# upper bound on IoU matrix elements per NMS chunk, about 16 MB per float32 temporary
+MAX_IOU_ELEMENTS = 1 << 22
+# NMS groups (frame, class) above this many candidates go through `_sequential_keep`
+MAX_PAIRED_GROUP = 256
+# `_sequential_keep` checks every this many kept boxes that the boxes they dropped on
+# average times the boxes left stays above SEQUENTIAL_MIN_DROPPED, about the cost of one
+# `nms` loop iteration over that of one IoU matrix element
+SEQUENTIAL_WINDOW = 16
+SEQUENTIAL_MIN_DROPPED = 1024
+# fixed point passes of `_greedy_keep` before it falls back to a sequential walk
+MAX_KEEP_PASSES = 8
+
+DETECTION_DTYPE = np.dtype([
+    ("class_id", np.int32),
+    ("confidence", np.float32),
+    ("x1", np.float64),
+    ("y1", np.float64),
+    ("x2", np.float64),
+    ("y2", np.float64),
+])
 
 
 class BoundingBox:
@@ -74,34 +100,274 @@ def nms(boxes, box_confidences, nms_threshold=0.5):
     return keep
 
 
+def _candidates(buffers, conf_threshold):
+    """
+    Mask the valid rows of stacked (B, 1 + 6 * max_bboxes) yolov5 output buffers that pass
+    the confidence threshold. Row layout: cx, cy, w, h, confidence, class id.
+    Return the (B, max_bboxes, 6) rows and the (B, max_bboxes) mask.
+    """
+    max_bboxes = (buffers.shape[1] - 1) // BOX_SIZE
+    num_bboxes = np.clip(buffers[:, 0].astype(np.int64), 0, max_bboxes)
+    bboxes = buffers[:, 1: (max_bboxes * BOX_SIZE + 1)].reshape(buffers.shape[0], max_bboxes, BOX_SIZE)
+    mask = np.arange(max_bboxes) < num_bboxes[:, None]
+    mask &= bboxes[..., 4] >= conf_threshold
+    return bboxes, mask
+
+
+def _iou_matrix(boxes):
+    """
+    Pairwise IoU of (..., N, 4) boxes, computed like `nms`: the raw (x, y, w, h) columns
+    with the +1 pixel convention, in the buffer dtype.
+    """
+    x_coord = boxes[..., 0]
+    y_coord = boxes[..., 1]
+    x_end = x_coord + boxes[..., 2]
+    y_end = y_coord + boxes[..., 3]
+    areas = boxes[..., 2] * boxes[..., 3]
+
+    width1 = np.minimum(x_end[..., :, None], x_end[..., None, :])
+    width1 -= np.maximum(x_coord[..., :, None], x_coord[..., None, :])
+    width1 += 1
+    np.maximum(width1, 0.0, out=width1)
+    height1 = np.minimum(y_end[..., :, None], y_end[..., None, :])
+    height1 -= np.maximum(y_coord[..., :, None], y_coord[..., None, :])
+    height1 += 1
+    np.maximum(height1, 0.0, out=height1)
+
+    intersection = np.multiply(width1, height1, out=width1)
+    union = np.add(areas[..., :, None], areas[..., None, :], out=height1)
+    union -= intersection
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.divide(intersection, union, out=intersection)
+
+
+def _sequential_keep(boxes, nms_threshold):
+    """
+    Indices kept by greedy NMS over the score-sorted (N, 4) boxes of one large group.
+    The loop of `nms` runs while its kept boxes drop enough others (dense clusters) to be
+    cheaper than an IoU matrix of the boxes left, which overlap none of the kept ones and
+    go through `_group_overlap_pairs` and `_greedy_keep` from then on.
+    """
+    x_coord = boxes[:, 0]
+    y_coord = boxes[:, 1]
+    x_end = x_coord + boxes[:, 2]
+    y_end = y_coord + boxes[:, 3]
+    areas = boxes[:, 2] * boxes[:, 3]
+
+    remaining = np.arange(boxes.shape[0])
+    keep = []
+    window_start = remaining.size
+    while remaining.size > 0:
+        i = remaining[0]
+        keep.append(i)
+        rest = remaining[1:]
+        width1 = np.maximum(0.0, np.minimum(x_end[i], x_end[rest]) - np.maximum(x_coord[i], x_coord[rest]) + 1)
+        height1 = np.maximum(0.0, np.minimum(y_end[i], y_end[rest]) - np.maximum(y_coord[i], y_coord[rest]) + 1)
+        intersection = width1 * height1
+        iou = intersection / (areas[i] + areas[rest] - intersection)
+        remaining = rest[iou <= nms_threshold]
+        if len(keep) % SEQUENTIAL_WINDOW == 0:
+            dropped = (window_start - remaining.size) / SEQUENTIAL_WINDOW
+            if dropped * remaining.size < SEQUENTIAL_MIN_DROPPED:
+                break
+            window_start = remaining.size
+
+    keep = np.array(keep, dtype=np.int64)
+    if remaining.size > 0:
+        first, second = _group_overlap_pairs(boxes[remaining], np.array([0]), np.array([remaining.size]), nms_threshold)
+        keep = np.concatenate([keep, remaining[_greedy_keep(remaining.size, first, second)]])
+    return keep
+
+
+def _group_bounds(frames, class_ids):
+    """
+    Start and size of every NMS group (run of candidates of the same frame and class)
+    of the sorted candidates
+    """
+    if frames.size == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    change = (frames[1:] != frames[:-1]) | (class_ids[1:] != class_ids[:-1])
+    starts = np.concatenate([[0], np.flatnonzero(change) + 1])
+    return starts, np.diff(np.append(starts, frames.size))
+
+
+def _group_overlap_pairs(bboxes, starts, sizes, nms_threshold, with_iou=False):
+    """
+    Pairs (i, j), i < j, of candidates of the same group whose IoU is above the NMS threshold
+    (a NaN IoU counts as overlapping, like `nms`), as indices into the candidate arrays,
+    plus their IoU with `with_iou`. The IoU is only computed within groups: groups are padded
+    to the next power of two and batched by padded size, in chunks of at most MAX_IOU_ELEMENTS.
+    """
+    first = [np.empty(0, dtype=np.int64)]
+    second = [np.empty(0, dtype=np.int64)]
+    ious = [np.empty(0, dtype=bboxes.dtype)]
+    paired = sizes > 1
+    starts = starts[paired]
+    sizes = sizes[paired]
+    padded = np.left_shift(1, np.ceil(np.log2(sizes)).astype(np.int64))
+    for size in np.unique(padded).tolist():
+        groups = np.flatnonzero(padded == size)
+        offsets = np.arange(size)
+        upper = ~np.tri(size, dtype=bool)
+        step = max(1, MAX_IOU_ELEMENTS // (size * size))
+        for chunk_start in range(0, groups.size, step):
+            chunk = groups[chunk_start: chunk_start + step]
+            valid = offsets < sizes[chunk, None]
+            # padding slots repeat the first box of their group and are masked out
+            index = np.where(valid, starts[chunk, None] + offsets, starts[chunk, None])
+            iou = _iou_matrix(bboxes[index, :4])
+            overlap = ~(iou <= nms_threshold)
+            overlap &= valid[:, None, :]
+            overlap &= upper
+            group, i, j = np.nonzero(overlap)
+            offset = starts[chunk][group]
+            first.append(offset + i)
+            second.append(offset + j)
+            if with_iou:
+                ious.append(iou[group, i, j])
+    if with_iou:
+        return np.concatenate(first), np.concatenate(second), np.concatenate(ious)
+    return np.concatenate(first), np.concatenate(second)
+
+
+def _greedy_keep(num_boxes, first, second):
+    """
+    Greedy NMS over score-sorted candidates given their overlapping pairs (first < second):
+    a box is kept when no kept box ranked before it overlaps it. Solved as a fixed point,
+    which settles in a few vectorized passes unless the overlaps chain; after
+    MAX_KEEP_PASSES passes it walks the pairs in rank order instead.
+    """
+    keep = np.ones(num_boxes, dtype=bool)
+    for _ in range(MAX_KEEP_PASSES):
+        if not first.size:
+            return keep
+        suppressed = np.zeros(num_boxes, dtype=bool)
+        suppressed[second[keep[first]]] = True
+        if np.array_equal(keep, ~suppressed):
+            return keep
+        keep = ~suppressed
+
+    order = np.argsort(first, kind="stable")
+    first = first[order]
+    second = second[order]
+    sources, bounds = np.unique(first, return_index=True)
+    bounds = np.append(bounds, first.size).tolist()
+    keep = np.ones(num_boxes, dtype=bool)
+    for index, source in enumerate(sources.tolist()):
+        if keep[source]:
+            keep[second[bounds[index]: bounds[index + 1]]] = False
+    return keep
+
+
+def _scale_boxes(bboxes, image_width, image_height):
+    """
+    Convert (cx, cy, w, h) in network resolution to (x1, y1, x2, y2) in source resolution.
+    `image_width` and `image_height` are scalars or per-box arrays.
+    """
+    scale_x = np.asarray(image_width, dtype=np.float64) / INPUT_WIDTH
+    scale_y = np.asarray(image_height, dtype=np.float64) / INPUT_HEIGHT
+    img_scale = np.stack([scale_x, scale_y, scale_x, scale_y], axis=-1)
+    box_xy = bboxes[:, :2]
+    box_wh = bboxes[:, 2:4]
+
+    box_x1y1 = box_xy - (box_wh / 2)
+    box_x2y2 = np.minimum(box_xy + (box_wh / 2), [INPUT_WIDTH, INPUT_HEIGHT])
+    return np.concatenate([box_x1y1, box_x2y2], axis=1) * img_scale
+
+
+def _sorted_candidates(buffers, conf_threshold):
+    """
+    Frame ids, class ids and rows of the candidates passing the confidence threshold,
+    ordered by frame, class id ascending, then confidence descending. Equal confidences
+    go latest row first, the per-label loop left their order to the unstable default argsort.
+    """
+    bboxes, mask = _candidates(buffers, conf_threshold)
+    frames, rows = np.nonzero(mask)
+    bboxes = bboxes[frames, rows]
+    class_ids = bboxes[:, 5].astype(np.int32)
+
+    order = np.lexsort((bboxes[:, 4], -class_ids, -frames))[::-1]
+    return frames[order], class_ids[order], bboxes[order]
+
+
+def _decode_batch(buffers, image_sizes, conf_threshold, nms_threshold, timings=None):
+    """
+    Vectorized yolov5 decode of a whole batch in one pass: confidence filtering, class-aware
+    NMS, xywh -> xyxy, scaling to each frame's source resolution and degenerate box removal.
+    Return frame ids, class ids, confidences and float64 (x1, y1, x2, y2) boxes, ordered
+    by frame, class id then confidence like `postprocess`.
+    If `timings` is a dict, the seconds spent in "decode" and "nms" are added to it.
+    """
+    if timings is not None:
+        start_t = time.perf_counter()
+    buffers = buffers.reshape(buffers.shape[0], -1)
+    num_frames = buffers.shape[0]
+    image_sizes = np.asarray(image_sizes, dtype=np.int64).reshape(num_frames, 2)
+
+    frames, class_ids, bboxes = _sorted_candidates(buffers, conf_threshold)
+
+    if timings is not None:
+        nms_t = time.perf_counter()
+    starts, sizes = _group_bounds(frames, class_ids)
+    large = sizes > MAX_PAIRED_GROUP
+    first, second = _group_overlap_pairs(bboxes, starts[~large], sizes[~large], nms_threshold)
+    keep = _greedy_keep(bboxes.shape[0], first, second)
+    for start, size in zip(starts[large].tolist(), sizes[large].tolist()):
+        kept = _sequential_keep(bboxes[start: start + size, :4], nms_threshold)
+        keep[start: start + size] = False
+        keep[start + kept] = True
+    bboxes = bboxes[keep]
+    class_ids = class_ids[keep]
+    frames = frames[keep]
+    if timings is not None:
+        decode_t = time.perf_counter()
+
+    boxes = _scale_boxes(bboxes, image_sizes[frames, 0], image_sizes[frames, 1])
+    valid = (boxes[:, 0] != boxes[:, 2]) & (boxes[:, 1] != boxes[:, 3])
+    if timings is not None:
+        end_t = time.perf_counter()
+        timings["decode"] = timings.get("decode", 0.0) + (nms_t - start_t) + (end_t - decode_t)
+        timings["nms"] = timings.get("nms", 0.0) + (decode_t - nms_t)
+    return frames[valid], class_ids[valid], bboxes[valid, 4], boxes[valid]
+
+
+def postprocess_batch(buffers, image_sizes, conf_threshold=0.4, nms_threshold=0.5, source_ids=None, timings=None):
+    """
+    Decode the stacked output tensors of a batch in one vectorized pass.
+    buffers: (B, 1 + 6 * max_bboxes) stacked output tensors, e.g. (B, 6001)
+    image_sizes: B (width, height) pairs of the source frames
+    source_ids: B source ids of the frames, the frame index by default
+    timings: optional dict, the seconds spent in "decode" and "nms" are added to it
+    Return a `Detections` of the batch, `Detections.frame(b)` being the detections of frame b.
+    """
+    frames, class_ids, scores, boxes = _decode_batch(
+        buffers, image_sizes, conf_threshold, nms_threshold, timings)
+    return Detections.from_columns(boxes, scores, class_ids, frames, image_sizes, source_ids)
+
+
+def decode(buffer, image_width, image_height, conf_threshold=0.4, nms_threshold=0.5):
+    """
+    Single frame decode: return a DETECTION_DTYPE structured array with the same
+    detections in the same order as `postprocess` used to produce.
+    """
+    _, class_ids, scores, boxes = _decode_batch(
+        buffer.reshape(1, -1), [(image_width, image_height)], conf_threshold, nms_threshold)
+
+    detections = np.empty(scores.size, dtype=DETECTION_DTYPE)
+    detections["class_id"] = class_ids
+    detections["confidence"] = scores
+    detections["x1"] = boxes[:, 0]
+    detections["y1"] = boxes[:, 1]
+    detections["x2"] = boxes[:, 2]
+    detections["y2"] = boxes[:, 3]
+    return detections
+
+
 def postprocess(buffer, image_width, image_height, conf_threshold=0.4, nms_threshold=0.5):
     detected_objects = []
-    img_scale = [image_width / INPUT_WIDTH, image_height / INPUT_HEIGHT, image_width / INPUT_WIDTH,
-                 image_height / INPUT_HEIGHT]
-    num_bboxes = int(buffer[0, 0, 0, 0])
-
-    if num_bboxes:
-        bboxes = buffer[0, 1: (num_bboxes * 6 + 1), 0, 0].reshape(-1, 6)
-        labels = set(bboxes[:, 5].astype(int))
-
-        for label in labels:
-            selected_bboxes = bboxes[np.where((bboxes[:, 5] == label) & (bboxes[:, 4] >= conf_threshold))]
-            selected_bboxes_keep = selected_bboxes[nms(selected_bboxes[:, :4], selected_bboxes[:, 4], nms_threshold)]
-            for idx in range(selected_bboxes_keep.shape[0]):
-                box_xy = selected_bboxes_keep[idx, :2]
-                box_wh = selected_bboxes_keep[idx, 2:4]
-                score = selected_bboxes_keep[idx, 4]
-
-                box_x1y1 = box_xy - (box_wh / 2)
-                box_x2y2 = np.minimum(box_xy + (box_wh / 2), [INPUT_WIDTH, INPUT_HEIGHT])
-                box = np.concatenate([box_x1y1, box_x2y2])
-                box *= img_scale
-
-                if box[0] == box[2]:
-                    continue
-                if box[1] == box[3]:
-                    continue
-                detected_objects.append(
-                    BoundingBox(label, float(score), box[0], box[2], box[1], box[3], image_height, image_width))
+    for det in decode(buffer, image_width, image_height, conf_threshold, nms_threshold):
+        detected_objects.append(
+            BoundingBox(int(det["class_id"]), float(det["confidence"]), det["x1"], det["x2"], det["y1"], det["y2"],
+                        image_height, image_width))
 
     return detected_objects